@@ -0,0 +1,1390 @@
+"""
+Micro-benchmark del Pallinatore.
+
+Uso:
+    python bench_pallinatore.py drag [--pallini 150] [--box 300] [--passi 300] [--senza-display]
+    python bench_pallinatore.py quota [--righe 20000]
+    python bench_pallinatore.py excel [--righe 100000] [--formati xlsx,csv,parquet]
+    python bench_pallinatore.py avvio [--ripetizioni 5] [--ocr]
+    python bench_pallinatore.py suite [--larghezza 7000 --altezza 5000 --densita 10]
+                                      [--json risultati.json] [--confronta base.json]
+    python bench_pallinatore.py apertura [--larghezza 14000 --altezza 9900]
+    python bench_pallinatore.py solo-quote [--disegni 5] [--cartella DIR] [--escludi X0,Y0,X1,Y1]
+    python bench_pallinatore.py pallini [--quote 1000]
+
+drag: trascina un pallino con eventi simulati su una tavola sintetica e
+confronta l'aggiornamento incrementale del canvas con il ridisegno
+originale a ogni movimento (PhotoImage dello sfondo e tutti gli elementi
+ricreati). Richiede un display (Tk); con --senza-display il canvas è
+sostituito da un oggetto che registra le chiamate e si misura solo il
+lavoro Python, PhotoImage esclusa.
+
+quota: confronta parse_quota con l'implementazione originale a nove
+pattern su un corpus di quote reali e varianti generate: verifica che i
+risultati siano identici e misura le quote analizzate al secondo.
+
+excel: scrive la tabella riepilogativa del batch con QuoteTableWriter e
+misura righe al secondo (e con --memoria il picco di memoria Python) per
+formato, confrontandola con il vecchio export openpyxl cella per cella.
+
+avvio: tempi di import del modulo (mediana su più processi, ripartiti per
+modulo importato direttamente) e tempo fino alla finestra disegnata, se
+c'è un display. Con --ocr misura anche la prima scansione con e senza
+preriscaldamento del motore (richiede PaddleOCR).
+
+suite: genera un disegno tecnico sintetico (immagine e PDF vettoriale) con
+quote in posizioni note e misura separatamente ogni fase: apertura e
+riduzione, pdf_to_image, elaborazione dei risultati di run_ocr (con un
+motore finto che restituisce le quote note), auto_pallina, tabella, redraw,
+hit-testing, parse_quota ed esportazioni. Funziona senza display e senza
+modelli OCR: canvas e tabella sono sostituiti da oggetti che registrano le
+chiamate, quindi si misura il solo lavoro Python dell'interfaccia. Con
+--json salva i risultati; --confronta segnala le fasi più lente di un
+risultato precedente.
+
+apertura: confronta load_drawing con il caricamento originale (decodifica
+completa in RGB e LANCZOS) su scansioni sintetiche grandi: TIFF a 1 bit,
+TIFF in scala di grigi e JPEG, più un PDF vettoriale A0 (rasterizzato a
+PDF_DPI e ridotto, contro il rendering diretto alla risoluzione di lavoro).
+Misura tempo e picco di memoria di ciascuno in un processo separato e la
+differenza tra le immagini di lavoro. Sulle scansioni misura anche la
+lettura di una regione di 1600 px a piena risoluzione (PageSource) contro
+la decodifica della pagina intera, e l'esportazione del PNG pallinato a
+piena risoluzione (a bande). Prima verifica che le regioni lette da
+PageSource coincidano con il crop di PIL su piccole pagine TIFF, BMP e
+PNG (modi 1, L, P e RGB): con differenze esce con errore.
+
+solo-quote: confronta l'OCR completo con quello in due fasi (--solo-quote)
+su tavole sintetiche con cartiglio, note e distinta base, o sui disegni di
+--cartella. Riporta tempi per fase, disegni al minuto, box rilevati e
+candidati, e il recall delle quote: rispetto al testo scritto (solo tavole
+sintetiche) e rispetto ai testi con cifre trovati dall'OCR completo fuori
+dalle zone escluse. Richiede PaddleOCR.
+
+pallini: posizionamento automatico dei pallini su una tavola sintetica
+densa, confrontato con quello originale (a sinistra di ogni box): tempo,
+pallini sovrapposti tra loro, pallini sopra i testi, inchiostro sotto i
+pallini e distanza media dal proprio testo.
+"""
+
+import os
+import re
+import sys
+import time
+import tempfile
+import tracemalloc
+import random
+import argparse
+import statistics
+import subprocess
+from types import SimpleNamespace
+
+from PIL import Image
+
+
+def _fake_ocr_results(n, width, height, rng):
+    from pallinatore_v6 import OcrResults
+    
+    polys, texts = [], []
+    for _ in range(n):
+        x = rng.uniform(20, width - 120)
+        y = rng.uniform(20, height - 40)
+        polys.append([[x, y], [x + 80, y], [x + 80, y + 20], [x, y + 20]])
+        texts.append(str(rng.randint(1, 999)))
+    return OcrResults(polys, texts, [0.99] * n)
+
+
+def _build_app(n_pallini, n_box, size=(2000, 1400)):
+    from pallinatore_v6 import PallinatoreApp
+    
+    rng = random.Random(0)
+    app = PallinatoreApp()
+    app.geometry("1200x800")
+    app.update()
+    
+    app.working_image = Image.new("RGB", size, "white")
+    app.original_size = size
+    app.ocr_results = _fake_ocr_results(n_box, size[0], size[1], rng)
+    for _ in range(n_pallini):
+        app._add_pallino(rng.uniform(20, 1100), rng.uniform(20, 700), "10")
+    app.zoom = 1.0
+    app._update_display()
+    app.update()
+    return app
+
+
+def _legacy_redraw(app, photo=True):
+    """redraw originale: cancella il canvas e ricrea sfondo, box OCR e pallini.
+    
+    A ogni chiamata ricostruiva la PhotoImage dell'immagine di display e
+    tutti gli elementi. Con photo=False (senza display) la PhotoImage non
+    viene creata e il costo misurato è per difetto.
+    """
+    import tkinter as tk
+    
+    canvas = app.canvas
+    canvas.delete("all")
+    display = app.working_image
+    if app.zoom != 1.0:
+        display = display.resize((int(display.width * app.zoom), int(display.height * app.zoom)))
+    if photo:
+        from PIL import ImageTk
+        app._legacy_photo = ImageTk.PhotoImage(display)
+        canvas.create_image(0, 0, anchor=tk.NW, image=app._legacy_photo)
+    canvas.configure(scrollregion=(0, 0, display.width, display.height))
+    
+    if app.show_boxes_var.get() and app.ocr_results:
+        for box, text in zip(app.ocr_results.polys, app.ocr_results.texts):
+            if not re.search(r"\d", text):
+                continue
+            x0 = float(box[:, 0].min()) * app.zoom
+            y0 = float(box[:, 1].min()) * app.zoom
+            x1 = float(box[:, 0].max()) * app.zoom
+            y1 = float(box[:, 1].max()) * app.zoom
+            canvas.create_rectangle(x0, y0, x1, y1, outline="yellow", width=1)
+            canvas.create_text(x0, y0 - 2, text=text[:15], anchor=tk.SW,
+                               fill="yellow", font=("Arial", 8))
+    
+    r = app.PALLINO_RADIUS
+    for p in app.pallini:
+        x, y = p["x"] * app.zoom, p["y"] * app.zoom
+        if p is app.dragging:
+            canvas.create_oval(x-r-2, y-r-2, x+r+2, y+r+2, outline="blue", width=2)
+        canvas.create_oval(x-r, y-r, x+r, y+r, fill="white", outline="red", width=2)
+        canvas.create_text(x, y, text=str(p["id"]), fill="red", font=("Arial", 9, "bold"))
+
+
+def _legacy_drag(app, event, photo=True):
+    """on_mouse_drag originale: aggiorna la posizione e ridisegna tutto."""
+    p = app.dragging
+    p["x"] = max(10, min(app.working_image.width - 10, event.x / app.zoom + app.drag_offset[0]))
+    p["y"] = max(10, min(app.working_image.height - 10, event.y / app.zoom + app.drag_offset[1]))
+    _legacy_redraw(app, photo)
+
+
+def _drag(app, steps, full_redraw, photo=True):
+    """Trascina il primo pallino per `steps` movimenti; restituisce i secondi."""
+    p = app.pallini[0]
+    start = (int(p["x"]), int(p["y"]))
+    app.on_mouse_down(SimpleNamespace(x=start[0], y=start[1], state=0))
+    
+    t0 = time.perf_counter()
+    for i in range(steps):
+        event = SimpleNamespace(x=start[0] + i % 200, y=start[1] + (i // 2) % 100, state=0)
+        if full_redraw:
+            _legacy_drag(app, event, photo)
+        else:
+            app.on_mouse_drag(event)
+        if photo:
+            app.update_idletasks()
+    elapsed = time.perf_counter() - t0
+    
+    app.dragging = None
+    app.canvas.delete("drag_halo")
+    if full_redraw:
+        # Il canvas originale non ha tile né tag del ridisegno incrementale: lo si ricostruisce
+        app.canvas.delete("all")
+        app._update_display()
+    return elapsed
+
+
+def _headless_drag_app(n_pallini, n_box, size=(2000, 1400)):
+    rng = random.Random(0)
+    app = _headless_app(Image.new("RGB", size, "white"))
+    app.ocr_results = _fake_ocr_results(n_box, size[0], size[1], rng)
+    for _ in range(n_pallini):
+        app._add_pallino(rng.uniform(20, 1100), rng.uniform(20, 700), "10")
+    app.zoom = 1.0
+    app.redraw()
+    return app
+
+
+def bench_drag(args):
+    photo = not args.senza_display
+    app = _build_app(args.pallini, args.box) if photo else _headless_drag_app(args.pallini, args.box)
+    try:
+        results = {}
+        for name, full in (("ridisegno completo", True), ("incrementale", False)):
+            elapsed = _drag(app, args.passi, full, photo)
+            results[name] = args.passi / elapsed if elapsed > 0 else float("inf")
+            print(f"{name:>20}: {results[name]:8.1f} eventi/s "
+                  f"({elapsed * 1000 / args.passi:.2f} ms/evento)")
+        base = results["ridisegno completo"]
+        if base > 0:
+            print(f"{'speedup':>20}: {results['incrementale'] / base:8.1f}x")
+        if not photo:
+            print("Senza display: esclusi PhotoImage e disegno di Tk (ridisegno completo per difetto)")
+    finally:
+        if photo:
+            app.destroy()
+
+
+# Quote lette dai disegni di produzione (testi OCR così come escono dal motore)
+QUOTA_CORPUS = [
+    "20H7", "20 H7", "Ø20H7", "ø12h6", "⌀8 g6", "O/25H8", "0/6H7", "50g6", "10,5h9",
+    "20±0.1", "20 ± 0.1", "Ø30±0,05", "R5±0.2", "120±0.5",
+    "20+0.1-0.2", "20 +0.1 -0.2", "Ø40 +0.025 -0", "15+0,1–0,05", "20-0.2+0.1",
+    "20 0.1 0.2", "Ø16 0.018 0", "20+0.1", "Ø10 +0.015", "20-0.1", "35 -0.05",
+    "20", "20.5", "20,5", "20 . 5", "1 , 25", "R5", "R 2.5", "M8", "M8x1.25", "M10x1",
+    "S12", "G1/4", "g 1/2", "2x45°", "45°", "3x Ø6.6", "4 FORI Ø9", "A-A", "DETTAGLIO B",
+    "SCALA 2:1", "Ra 0.8", "Ra1.6", "0.05 A", "⌖ Ø0.1 A B", "1:50", "12.", ".5", "R0,5",
+    "  20H7  ", "20H7\n", "Ø 20 H7", "100", "1.000", "2,5x45°", "6H", "M6-6H", "",
+]
+
+
+def _quota_corpus(n, seed=0, variants=3000):
+    """Corpus di n quote: quelle reali più varianti composte a caso.
+    
+    Come nelle tavole vere, le stesse quote si ripetono: le righe sono
+    estratte da un insieme di `variants` testi distinti.
+    """
+    rng = random.Random(seed)
+    symbols = ["", "", "Ø", "ø", "⌀", "R", "M", "S", "s", "G", "O/", "0/", "r"]
+    numbers = ["20", "20.5", "20,5", "0.1", "0,05", "120", "1.25", "6", "0", "3."]
+    seps = ["", " ", "  ", "\n"]
+    tails = [
+        lambda: "",
+        lambda: rng.choice(seps) + rng.choice(["H7", "h6", "g6", "js7", "K", "6H"]),
+        lambda: rng.choice(seps) + "±" + rng.choice(seps) + rng.choice(numbers),
+        lambda: rng.choice(seps) + "+" + rng.choice(numbers) + rng.choice(seps) + rng.choice("-–") + rng.choice(numbers),
+        lambda: rng.choice(seps) + rng.choice("-–") + rng.choice(numbers) + rng.choice(seps) + "+" + rng.choice(numbers),
+        lambda: " " + rng.choice(numbers) + " " + rng.choice(numbers),
+        lambda: rng.choice(seps) + rng.choice(["+", "-", "–"]) + rng.choice(seps) + rng.choice(numbers),
+        lambda: rng.choice([" . 5", " , 5", "x45°", "°", " A", "/4"]),
+    ]
+    pool = list(QUOTA_CORPUS)
+    while len(pool) < variants:
+        pool.append(rng.choice(seps[:2]) + rng.choice(symbols) + rng.choice(seps[:2])
+                    + rng.choice(numbers) + rng.choice(tails)())
+    return pool + [rng.choice(pool) for _ in range(n - len(pool))]
+
+
+def _legacy_parse_quota(text):
+    """parse_quota originale (nove re.match in sequenza), riferimento per il confronto."""
+    original = text
+    text = text.strip()
+    
+    # Normalizza simboli diametro
+    text = text.replace("Ø", "⌀").replace("ø", "⌀").replace("O/", "⌀").replace("0/", "⌀")
+    
+    result = {"simbolo": "", "nominale": "", "tol_plus": "", "tol_minus": "", "classe": ""}
+    
+    # Estrai simbolo iniziale (⌀, R, M, S, ecc.)
+    m = re.match(r"^([⌀RMSsGg])\s*", text)
+    if m:
+        result["simbolo"] = m.group(1).upper()
+        text = text[m.end():].strip()
+    
+    # Pattern 1: Numero + classe tolleranza ISO (es. "20H7", "20 H7", "10h6", "50g6")
+    m = re.match(r"^([\d.,]+)\s*([A-Za-z]\d+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        result["classe"] = m.group(2)
+        return result
+    
+    # Pattern 2: ±tolleranza simmetrica (es. "20±0.1", "20 ± 0.1")
+    m = re.match(r"^([\d.,]+)\s*[±]\s*([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        tol = m.group(2).replace(",", ".")
+        result["tol_plus"] = f"+{tol}"
+        result["tol_minus"] = f"-{tol}"
+        return result
+    
+    # Pattern 3: Tolleranze asimmetriche +X/-Y (es. "20+0.1-0.2", "20 +0.1 -0.2")
+    m = re.match(r"^([\d.,]+)\s*\+\s*([\d.,]+)\s*[-–]\s*([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        result["tol_plus"] = f"+{m.group(2).replace(',', '.')}"
+        result["tol_minus"] = f"-{m.group(3).replace(',', '.')}"
+        return result
+    
+    # Pattern 4: Tolleranze asimmetriche -Y/+X (ordine inverso)
+    m = re.match(r"^([\d.,]+)\s*[-–]\s*([\d.,]+)\s*\+\s*([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        result["tol_minus"] = f"-{m.group(2).replace(',', '.')}"
+        result["tol_plus"] = f"+{m.group(3).replace(',', '.')}"
+        return result
+    
+    # Pattern 5: Tolleranze su righe separate (es. "20\n+0.1\n-0.2" o "20 0.1 0.2")
+    m = re.match(r"^([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        # Assume prima positiva, seconda negativa
+        result["tol_plus"] = f"+{m.group(2).replace(',', '.')}"
+        result["tol_minus"] = f"-{m.group(3).replace(',', '.')}"
+        return result
+    
+    # Pattern 6: Solo +tolleranza (es. "20+0.1")
+    m = re.match(r"^([\d.,]+)\s*\+\s*([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        result["tol_plus"] = f"+{m.group(2).replace(',', '.')}"
+        return result
+    
+    # Pattern 7: Solo -tolleranza (es. "20-0.1")
+    m = re.match(r"^([\d.,]+)\s*[-–]\s*([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        result["tol_minus"] = f"-{m.group(2).replace(',', '.')}"
+        return result
+    
+    # Pattern 8: Numero con spazi (es. "20 . 5" -> "20.5")
+    cleaned = re.sub(r"(\d)\s*[.,]\s*(\d)", r"\1.\2", text)
+    m = re.match(r"^([\d.]+)\s*$", cleaned)
+    if m:
+        result["nominale"] = m.group(1)
+        return result
+    
+    # Pattern 9: Solo numero
+    m = re.match(r"^([\d.,]+)\s*$", text)
+    if m:
+        result["nominale"] = m.group(1).replace(",", ".")
+        return result
+    
+    # Fallback: tutto come nominale
+    result["nominale"] = original.strip()
+    return result
+
+
+def _rate(fn, texts, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(texts)
+        best = min(best, time.perf_counter() - t0)
+    return len(texts) / best
+
+
+def bench_quota(args):
+    import pallinatore_v6 as pv
+    
+    texts = _quota_corpus(args.righe, variants=args.varianti)
+    distinct = len(set(texts))
+    
+    mismatches = [t for t in set(texts) if pv.parse_quota(t) != _legacy_parse_quota(t)]
+    for t in mismatches[:10]:
+        print(f"DIVERSO {t!r}: {pv.parse_quota(t)} != {_legacy_parse_quota(t)}")
+    print(f"{len(texts)} quote ({distinct} distinte): "
+          f"{'output identico' if not mismatches else f'{len(mismatches)} differenze'}")
+    
+    # Solo la grammatica compilata, senza la cache LRU
+    uncached = pv._parse_quota_fields.__wrapped__
+    fields = pv._QUOTA_FIELDS
+    
+    legacy = _rate(lambda b: [_legacy_parse_quota(t) for t in b], texts)
+    rows = [
+        ("originale", legacy),
+        ("compilato", _rate(lambda b: [dict(zip(fields, uncached(t))) for t in b], texts)),
+        ("compilato + memo", _rate(lambda b: [pv.parse_quota(t) for t in b], texts)),
+        ("parse_quota_many", _rate(pv.parse_quota_many, texts)),
+    ]
+    for name, rate in rows:
+        print(f"{name:>20}: {rate:12,.0f} quote/s  ({rate / legacy:5.1f}x)")
+    return 1 if mismatches else 0
+
+
+def _legacy_write_excel(path, pallini):
+    """write_excel originale (openpyxl normale, larghezze a fine foglio), per il confronto."""
+    import openpyxl
+    import pallinatore_v6 as pv
+    from openpyxl.styles import Font, Alignment
+    
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Quote"
+    
+    # Colonna pagina solo per documenti multipagina
+    multi_page = any(p.get("page", 0) for p in pallini)
+    
+    headers = ["ID", "Quota_raw", "Simbolo", "Nominale", "Tol+", "Tol-", "Classe"]
+    if multi_page:
+        headers.append("Pagina")
+    for col, h in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=h)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal="center")
+    
+    all_parsed = pv.parse_quota_many([p["text"] for p in pallini])
+    for row, (p, parsed) in enumerate(zip(pallini, all_parsed), 2):
+        ws.cell(row=row, column=1, value=p["id"])
+        ws.cell(row=row, column=2, value=p["text"])
+        ws.cell(row=row, column=3, value=parsed["simbolo"])
+        ws.cell(row=row, column=4, value=parsed["nominale"])
+        ws.cell(row=row, column=5, value=parsed["tol_plus"])
+        ws.cell(row=row, column=6, value=parsed["tol_minus"])
+        ws.cell(row=row, column=7, value=parsed["classe"])
+        if multi_page:
+            ws.cell(row=row, column=8, value=p.get("page", 0) + 1)
+    
+    for col in ws.columns:
+        max_len = max(len(str(cell.value or "")) for cell in col)
+        ws.column_dimensions[col[0].column_letter].width = max_len + 2
+    
+    wb.save(path)
+
+
+def _measure(fn, memory=False):
+    """Esegue fn() e ritorna (secondi, picco MB di memoria Python o None).
+    
+    tracemalloc rallenta molto le allocazioni: con memory=True i tempi
+    non sono confrontabili con quelli senza.
+    """
+    if memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    try:
+        fn()
+    finally:
+        elapsed = time.perf_counter() - t0
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+    return elapsed, peak
+
+
+def _format_peak(peak):
+    return f"picco {peak:7.1f} MB" if peak is not None else ""
+
+
+def bench_excel(args):
+    import pallinatore_v6 as pv
+    
+    texts = _quota_corpus(args.righe)
+    rng = random.Random(1)
+    per_drawing = 400
+    drawings = [
+        (f"disegno_{k:04d}.pdf",
+         [{"id": i + 1, "text": texts[(k * per_drawing + i) % len(texts)], "page": i // 200,
+           "x": rng.uniform(0, 2000), "y": rng.uniform(0, 1400)}
+          for i in range(min(per_drawing, args.righe - k * per_drawing))])
+        for k in range((args.righe + per_drawing - 1) // per_drawing)
+    ]
+    print(f"{args.righe} righe da {len(drawings)} disegni")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formati.split(","):
+            path = os.path.join(tmp, f"riepilogo.{fmt}")
+            
+            def run():
+                with pv.QuoteTableWriter(path, pv.SUMMARY_COLUMNS) as writer:
+                    for name, pallini in drawings:
+                        writer.write_rows(pv.quote_rows(pallini, drawing=name))
+            
+            try:
+                elapsed, peak = _measure(run, args.memoria)
+            except ImportError as e:
+                print(f"{fmt:>20}: non disponibile ({e})")
+                continue
+            size = os.path.getsize(path) / 1e6
+            print(f"{fmt:>20}: {args.righe / elapsed:10,.0f} righe/s  "
+                  f"file {size:6.1f} MB  {_format_peak(peak)}")
+        
+        if args.originale:
+            flat = [p for _, pallini in drawings for p in pallini]
+            path = os.path.join(tmp, "originale.xlsx")
+            elapsed, peak = _measure(lambda: _legacy_write_excel(path, flat), args.memoria)
+            size = os.path.getsize(path) / 1e6
+            print(f"{'xlsx originale':>20}: {args.righe / elapsed:10,.0f} righe/s  "
+                  f"file {size:6.1f} MB  {_format_peak(peak)}")
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Processi figli di "avvio": ognuno stampa i propri tempi come ultima riga
+_CHILD_WINDOW = """
+import time
+start = time.perf_counter()
+import pallinatore_v6 as pv
+app = pv.PallinatoreApp()
+app.update()
+print(time.perf_counter() - start)
+app.destroy()
+"""
+
+_CHILD_OCR = """
+import sys, time
+from PIL import Image, ImageDraw
+import pallinatore_v6 as pv
+image = Image.new("RGB", (2000, 1400), "white")
+draw = ImageDraw.Draw(image)
+for i in range(40):
+    draw.text((60 + (i % 8) * 230, 80 + (i // 8) * 250), f"{10 + i}H7", fill="black")
+times = []
+if sys.argv[1] == "caldo":
+    start = time.perf_counter()
+    pv.start_ocr_warmup().join()
+    times.append(time.perf_counter() - start)
+for _ in range(3):
+    start = time.perf_counter()
+    pv.run_ocr(image)
+    times.append(time.perf_counter() - start)
+print(" ".join(f"{t:.4f}" for t in times))
+"""
+
+
+def _child(code, *args):
+    """Esegue code in un nuovo interprete e ritorna l'ultima riga di stdout."""
+    proc = subprocess.run([sys.executable, "-c", code, *args], cwd=HERE,
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "errore")
+    return proc.stdout.strip().splitlines()[-1]
+
+
+def _import_times(module):
+    """Tempi di import (ms cumulativi) dei moduli importati direttamente da module.
+    
+    Un modulo condiviso viene attribuito al primo che lo importa.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=HERE, capture_output=True, text=True)
+    direct, pending = {}, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending[name.strip()] = int(cumulative) / 1000
+        elif depth == 0:
+            if name.strip() == module:
+                direct = dict(pending, **{module: int(cumulative) / 1000})
+            pending = {}
+    return direct
+
+
+def bench_avvio(args):
+    runs = [_import_times("pallinatore_v6") for _ in range(args.ripetizioni)]
+    names = set().union(*runs)
+    median = {name: statistics.median(r.get(name, 0.0) for r in runs) for name in names}
+    total = median.pop("pallinatore_v6", 0.0)
+    print(f"import pallinatore_v6: {total:7.1f} ms (mediana di {args.ripetizioni} processi)")
+    for name, ms in sorted(median.items(), key=lambda item: -item[1])[:args.moduli]:
+        print(f"{name:>22}: {ms:7.1f} ms")
+    
+    try:
+        samples = [float(_child(_CHILD_WINDOW)) for _ in range(args.ripetizioni)]
+        print(f"{'finestra disegnata':>22}: {statistics.median(samples) * 1000:7.1f} ms "
+              f"(import incluso)")
+    except RuntimeError as e:
+        print(f"{'finestra disegnata':>22}: non misurabile ({e})")
+    
+    if args.ocr:
+        cold = [float(t) for t in _child(_CHILD_OCR, "freddo").split()]
+        warm = [float(t) for t in _child(_CHILD_OCR, "caldo").split()]
+        print(f"senza preriscaldamento: prima scansione {cold[0]:6.2f} s, "
+              f"successive {statistics.median(cold[1:]):6.2f} s")
+        print(f"con preriscaldamento:   motore pronto in {warm[0]:6.2f} s (in background), "
+              f"prima scansione {warm[1]:6.2f} s, successive {statistics.median(warm[2:]):6.2f} s")
+
+
+# ============ SUITE ============
+
+def synthetic_drawing(width, height, density=10.0, seed=0):
+    """Disegno tecnico sintetico: cornice, geometrie, quote ed etichette.
+    
+    density è il numero di quote per megapixel. Ritorna l'immagine e i
+    testi scritti, ciascuno con il proprio box (ground truth, in pixel).
+    """
+    from PIL import ImageDraw, ImageFont
+    
+    rng = random.Random(seed)
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=max(12, height // 180))
+    except TypeError:
+        font = ImageFont.load_default()
+    
+    margin = max(20, width // 60)
+    draw.rectangle((margin, margin, width - margin, height - margin), outline=0, width=3)
+    for _ in range(int(width * height / 1e6 * 3)):
+        x, y = rng.uniform(margin, width - margin), rng.uniform(margin, height - margin)
+        w, h = rng.uniform(50, width / 6), rng.uniform(50, height / 6)
+        if rng.random() < 0.5:
+            draw.rectangle((x, y, min(x + w, width - margin), min(y + h, height - margin)),
+                           outline=0, width=2)
+        else:
+            draw.ellipse((x, y, x + h / 2, y + h / 2), outline=0, width=2)
+    
+    quotes = [t.strip() for t in QUOTA_CORPUS if any(c.isdigit() for c in t)]
+    labels = [t for t in QUOTA_CORPUS if t.strip() and not any(c.isdigit() for c in t)]
+    n_quotes = int(width * height / 1e6 * density)
+    truth = []
+    for i in range(n_quotes + n_quotes // 5):
+        text = rng.choice(quotes) if i < n_quotes else rng.choice(labels)
+        x = rng.uniform(margin * 2, width - margin * 2 - 200)
+        y = rng.uniform(margin * 2 + 30, height - margin * 2)
+        x0, y0, x1, y1 = draw.textbbox((x, y), text, font=font)
+        if i < n_quotes:
+            # Linea di quota sotto il testo
+            draw.line((x0 - 30, y1 + 4, x1 + 30, y1 + 4), fill=0, width=1)
+        draw.text((x, y), text, fill=0, font=font)
+        truth.append({"box": [[x0, y0], [x1, y0], [x1, y1], [x0, y1]], "text": text})
+    return image, truth
+
+
+def synthetic_pdf(path, width, height, truth, dpi=150):
+    """PDF vettoriale con gli stessi testi del disegno sintetico."""
+    import fitz
+    
+    k = 72 / dpi
+    doc = fitz.open()
+    page = doc.new_page(width=width * k, height=height * k)
+    shape = page.new_shape()
+    for item in truth:
+        (x0, y0), _, (x1, y1), _ = item["box"]
+        shape.draw_line((x0 * k - 10, y1 * k + 2), (x1 * k + 10, y1 * k + 2))
+        page.insert_text((x0 * k, y1 * k), item["text"], fontsize=max(4, (y1 - y0) * k))
+    shape.finish(color=(0, 0, 0), width=0.5)
+    shape.commit()
+    doc.save(path)
+    doc.close()
+
+
+class FakeOcrEngine:
+    """Motore OCR finto: restituisce il ground truth nel formato di PaddleOCR 3.x."""
+    
+    def __init__(self, truth, size):
+        self.truth = truth
+        self.size = size
+    
+    def ocr(self, image):
+        import numpy as np
+        
+        sx = image.shape[1] / self.size[0]
+        sy = image.shape[0] / self.size[1]
+        polys = [np.array([[x * sx, y * sy] for x, y in item["box"]], dtype=np.int16)
+                 for item in self.truth]
+        return [{"rec_polys": polys, "dt_polys": polys,
+                 "rec_texts": [item["text"] for item in self.truth],
+                 "rec_scores": [0.95] * len(self.truth)}]
+
+
+class _Recorder:
+    """Canvas / tabella headless: accetta ogni chiamata e restituisce id crescenti."""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def _call(self, *args, **kwargs):
+        self.calls += 1
+        return self.calls
+    
+    create_oval = create_text = create_rectangle = create_image = _call
+    delete = coords = itemconfigure = configure = config = move = _call
+    insert = item = tag_lower = tag_raise = set = _call
+    
+    def canvasx(self, x, *args):
+        return x
+    
+    canvasy = canvasx
+    
+    def get_children(self, *args):
+        return ()
+    
+    def __getattr__(self, name):
+        return self._call
+
+
+def _headless_app(working_image):
+    """PallinatoreApp senza Tk: stato reale, widget sostituiti da _Recorder.
+    
+    Le tile di sfondo (PhotoImage) richiedono Tk: si misurano a parte con
+    _render_view.
+    """
+    import tkinter as tk
+    from unittest import mock
+    import pallinatore_v6 as pv
+    
+    app = pv.PallinatoreApp.__new__(pv.PallinatoreApp)
+    app.tk = None
+    app.title = app.geometry = app.after = app.protocol = lambda *args, **kwargs: None
+    
+    def build_ui():
+        app.canvas, app.tree = _Recorder(), _Recorder()
+        app.zoom_label, app.page_label, app.engine_status = _Recorder(), _Recorder(), _Recorder()
+        app.status = SimpleNamespace(set=lambda text: None, get=lambda: "")
+        app.show_boxes_var = SimpleNamespace(get=lambda: True)
+    
+    app._build_ui = build_ui
+    app._render_viewport = lambda: None
+    with mock.patch.object(tk.Tk, "__init__", lambda self, *args, **kwargs: None):
+        pv.PallinatoreApp.__init__(app)
+    app.working_image = working_image
+    app.original_size = working_image.size
+    app.pyramid = pv.ZoomPyramid(working_image)
+    return app
+
+
+def _render_view(pyramid, zoom, view=(1200, 800)):
+    """Tile dello sfondo che coprono una vista, come _render_viewport (senza PhotoImage)."""
+    import pallinatore_v6 as pv
+    
+    t = pv.PallinatoreApp.VIEW_TILE
+    w, h = int(pyramid.image.width * zoom), int(pyramid.image.height * zoom)
+    x1, y1 = min(w, view[0]), min(h, view[1])
+    return [pyramid.render(zoom, (tx * t, ty * t, min(w, (tx + 1) * t), min(h, (ty + 1) * t)))
+            for ty in range((y1 - 1) // t + 1) for tx in range((x1 - 1) // t + 1)]
+
+
+def _timed(fn, repeat):
+    """Tempo migliore (s) su repeat esecuzioni e risultato dell'ultima.
+    
+    Il minimo è meno sensibile della mediana al rumore di sistema.
+    """
+    import gc
+    
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return min(samples), result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(width, height, density, repeat=3, hits=2000, seed=0):
+    """Esegue tutte le fasi; ritorna {fase: {"secondi": ..., ...}}."""
+    import pallinatore_v6 as pv
+    
+    stages = {}
+    
+    def stage(name, fn, **extra):
+        try:
+            seconds, result = _timed(fn, repeat)
+        except ImportError as e:
+            print(f"{name:>22}: non disponibile ({e})")
+            return None
+        stages[name] = dict(secondi=round(seconds, 6), **extra)
+        print(f"{name:>22}: {seconds * 1000:9.1f} ms")
+        return result
+    
+    image, truth = synthetic_drawing(width, height, density, seed)
+    n_quotes = sum(any(c.isdigit() for c in item["text"]) for item in truth)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        png = os.path.join(tmp, "disegno.png")
+        pdf = os.path.join(tmp, "disegno.pdf")
+        image.save(png)
+        try:
+            synthetic_pdf(pdf, width, height, truth)
+        except ImportError:
+            pdf = None
+        
+        # Apertura: decodifica e riduzione a DISPLAY_MAX_SIZE (come open_file)
+        working, original_size, image_scale = stage(
+            "open_file", lambda: pv.DrawingDocument(png).get_page(0))
+        if pdf:
+            stage("pdf_to_image", lambda: pv.pdf_to_image(pdf))
+        stage("zoom_pyramid", lambda: pv.ZoomPyramid(working))
+        for zoom in (0.5, 2.0):
+            # Nuova piramide a ogni ripetizione: niente livelli già in cache
+            stage(f"render_view_{zoom:g}x",
+                  lambda: _render_view(pv.ZoomPyramid(working), zoom))
+        
+        engine = FakeOcrEngine(truth, original_size)
+        pixels = pv.to_ocr_array(working)
+        results = stage("run_ocr", lambda: pv.run_ocr(pixels, engine=engine), testi=len(truth))
+        
+        app = _headless_app(working)
+        app.image_scale = image_scale
+        app.ocr_results = results
+        stage("auto_pallina", app.auto_pallina)
+        stages["auto_pallina"].update(pallini=len(app.pallini), quote_note=n_quotes)
+        stage("refresh_tree", app._refresh_tree, righe=len(app.pallini))
+        stage("redraw", app.redraw)
+        
+        rng = random.Random(seed)
+        points = [(rng.uniform(0, working.width), rng.uniform(0, working.height))
+                  for _ in range(hits)]
+        # Metà dei punti sui pallini, metà a caso
+        points[::2] = [(p["x"] + 2, p["y"] - 2) for p in
+                       (app.pallini[i % len(app.pallini)] for i in range(len(points[::2])))]
+        found = stage("hit_test", lambda: sum(app._find_pallino_at(x, y) is not None
+                                               for x, y in points), query=hits)
+        stages["hit_test"]["trovati"] = found
+        stage("nearest_ocr_text", lambda: [app._nearest_ocr_text(x, y) for x, y in points[:500]],
+              query=500)
+        
+        def parse():
+            pv._parse_quota_fields.cache_clear()
+            return pv.parse_quota_many(results.texts)
+        stage("parse_quota", parse, testi=len(results))
+        
+        pallini = [dict(p) for p in app.pallini]
+        document = pv.DrawingDocument(png)
+        source = document.source(0)
+        stage("export_png", lambda: pv.export_pallinated_image(
+            source, pallini, image_scale, os.path.join(tmp, "out.png")))
+        source.close()
+        stage("export_pdf_raster", lambda: pv.export_pallinated_pdf(
+            document, pallini, os.path.join(tmp, "out_raster.pdf")))
+        if pdf:
+            # Il PDF a 150 dpi ha gli stessi pixel dell'immagine: stessi pallini
+            pdf_document = pv.DrawingDocument(pdf)
+            stage("export_pdf_vettoriale", lambda: pv.export_annotated_pdf(
+                pdf_document, pallini, os.path.join(tmp, "out_vettoriale.pdf")))
+        stage("export_excel", lambda: pv.write_excel(os.path.join(tmp, "out.xlsx"), pallini))
+        stage("save_project", lambda: pv.save_project(
+            os.path.join(tmp, "out.pallinatore"), png, pallini, len(pallini) + 1,
+            {0: results}, 0, original_size, image_scale))
+    
+    return stages
+
+
+def bench_suite(args):
+    import json
+    import platform
+    
+    print(f"Disegno sintetico {args.larghezza}x{args.altezza}, {args.densita} quote/MP, "
+          f"migliore di {args.ripetizioni}")
+    stages = run_suite(args.larghezza, args.altezza, args.densita, args.ripetizioni)
+    report = {
+        "data": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revisione": _git_revision(),
+        "python": platform.python_version(),
+        "sistema": platform.platform(),
+        "parametri": {"larghezza": args.larghezza, "altezza": args.altezza,
+                      "densita": args.densita, "ripetizioni": args.ripetizioni},
+        "fasi": stages,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+        print(f"Risultati salvati in {args.json}")
+    
+    if args.confronta:
+        with open(args.confronta, encoding="utf-8") as fh:
+            previous = json.load(fh)
+        base = previous["fasi"]
+        regressions = 0
+        print(f"\nConfronto con {args.confronta} (soglia {args.soglia:.2f}x):")
+        if previous.get("parametri") != report["parametri"]:
+            print(f"Attenzione: parametri diversi dal riferimento {previous.get('parametri')}")
+        for name, data in stages.items():
+            if name not in base or not base[name]["secondi"]:
+                continue
+            ratio = data["secondi"] / base[name]["secondi"]
+            flag = "  REGRESSIONE" if ratio > args.soglia else ""
+            regressions += bool(flag)
+            print(f"{name:>22}: {ratio:6.2f}x{flag}")
+        return 1 if regressions else 0
+
+
+# ============ APERTURA ============
+
+def _legacy_load_drawing(path, max_size=2000):
+    """Caricamento originale di open_file (immagini raster e PDF)."""
+    if path.lower().endswith(".pdf"):
+        import pallinatore_v6 as pv
+        img = pv.pdf_to_image(path)
+    else:
+        img = Image.open(path)
+    img = img.convert("RGB")
+    orig_w, orig_h = img.size
+    max_dim = max(orig_w, orig_h)
+    if max_dim > max_size:
+        image_scale = max_size / max_dim
+        new_w = int(orig_w * image_scale)
+        new_h = int(orig_h * image_scale)
+        working_image = img.resize((new_w, new_h), Image.LANCZOS)
+        del img
+    else:
+        working_image = img
+        image_scale = 1.0
+    return working_image, (orig_w, orig_h), image_scale
+
+
+_CHILD_LOAD = """
+import sys, json, time
+import pallinatore_v6 as pv
+import bench_pallinatore as bench
+load = pv.load_drawing if sys.argv[2] == "nuovo" else bench._legacy_load_drawing
+pv.profiler.enable()
+start = time.perf_counter()
+with pv.profiler.span("apertura"):
+    image, _, _ = load(sys.argv[1])
+elapsed = time.perf_counter() - start
+growth = pv.profiler.summary()[0]["crescita_rss"] if pv.current_rss() else None
+print(json.dumps({"secondi": elapsed, "crescita": growth, "modo": image.mode}))
+"""
+
+# Una regione di 1600 px al centro della pagina, come una tile dell'OCR a piena
+# risoluzione: l'originale decodificava e teneva in memoria la pagina intera
+_CHILD_REGION = """
+import sys, json, time
+from PIL import Image
+import pallinatore_v6 as pv
+if __name__ == "__main__":
+    width, height = pv.PageSource(sys.argv[1]).size
+    x0, y0 = max(0, width // 2 - 800), max(0, height // 2 - 800)
+    box = (x0, y0, min(width, x0 + 1600), min(height, y0 + 1600))
+    pv.profiler.enable()
+    start = time.perf_counter()
+    with pv.profiler.span("regione"):
+        if sys.argv[2] == "nuovo":
+            source = pv.PageSource(sys.argv[1])
+            region = source.read_region(box)
+        else:
+            source = Image.open(sys.argv[1])
+            source.load()
+            region = source.crop(box)
+    elapsed = time.perf_counter() - start
+    growth = pv.profiler.summary()[0]["crescita_rss"] if pv.current_rss() else None
+    print(json.dumps({"secondi": elapsed, "crescita": growth}))
+"""
+
+# PNG pallinato a piena risoluzione, scritto a bande di EXPORT_BAND_HEIGHT righe
+_CHILD_EXPORT = """
+import sys, json, time, tempfile, os
+import pallinatore_v6 as pv
+if __name__ == "__main__":
+    source = pv.PageSource(sys.argv[1])
+    width, height = source.size
+    image_scale = pv.DISPLAY_MAX_SIZE / max(width, height)
+    pallini = [{"id": k + 1, "x": (k * 37) % pv.DISPLAY_MAX_SIZE * width / max(width, height),
+                "y": (k * 53) % pv.DISPLAY_MAX_SIZE * height / max(width, height)}
+               for k in range(300)]
+    pv.profiler.enable()
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        with pv.profiler.span("esportazione"):
+            pv.export_pallinated_image(source, pallini, image_scale, os.path.join(tmp, "out.png"))
+        elapsed = time.perf_counter() - start
+    source.close()
+    growth = pv.profiler.summary()[0]["crescita_rss"] if pv.current_rss() else None
+    print(json.dumps({"secondi": elapsed, "crescita": growth}))
+"""
+
+
+def _check_region_reads(tmp):
+    """Confronta PageSource.read_region con il crop di PIL su piccole pagine.
+    
+    TIFF non compresso e BMP passano dalla copia a bande (PIL mappa il file),
+    PNG e TIFF LZW dal decoder: entrambi i percorsi, anche in modo P.
+    Ritorna l'elenco delle letture diverse.
+    """
+    import numpy as np
+    import pallinatore_v6 as pv
+    
+    rng = np.random.default_rng(0)
+    gray = Image.fromarray(rng.integers(0, 256, (700, 900), dtype=np.uint8))
+    bits = gray.point(lambda v: 255 if v > 128 else 0).convert("1")
+    pages = {
+        "P": gray.convert("RGB").convert("P", palette=Image.ADAPTIVE),
+        "P 2 colori": bits.convert("P"),
+        "1": bits,
+        "L": gray,
+        "RGB": gray.convert("RGB"),
+    }
+    formats = {"TIFF": (".tif", {}), "TIFF LZW": (".tif", {"compression": "tiff_lzw"}),
+               "BMP": (".bmp", {}), "PNG": (".png", {})}
+    failures = []
+    for mode, page in pages.items():
+        for label, (ext, options) in formats.items():
+            path = os.path.join(tmp, f"verifica{ext}")
+            page.save(path, **options)
+            source = pv.PageSource(path)
+            with Image.open(path) as reference:
+                for box in ((0, 0, 900, 700), (100, 50, 600, 400), (850, 650, 1000, 800)):
+                    region = source.read_region(box)
+                    expected = reference.crop(box).convert(region.mode)
+                    if region.tobytes() != expected.tobytes():
+                        failures.append(f"{label} {mode} {box}")
+            source.close()
+    return failures
+
+
+def bench_apertura(args):
+    import json
+    import numpy as np
+    import pallinatore_v6 as pv
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = _check_region_reads(tmp)
+    for failure in failures:
+        print(f"  regione diversa dal crop: {failure}")
+    print(f"Verifica read_region (TIFF, BMP, PNG; modi 1, L, P, RGB): "
+          f"{'letture identiche' if not failures else f'{len(failures)} differenze'}\n")
+    
+    print(f"Scansioni sintetiche {args.larghezza}x{args.altezza}")
+    image, truth = synthetic_drawing(args.larghezza, args.altezza, 10.0)
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {
+            "TIFF 1 bit (G4)": ("scansione_1bit.tif", lambda p: image.point(
+                lambda v: 255 if v > 128 else 0).convert("1").save(p, compression="group4")),
+            "TIFF grigio (LZW)": ("scansione_grigio.tif",
+                                  lambda p: image.save(p, compression="tiff_lzw")),
+            "JPEG colore": ("scansione.jpg",
+                            lambda p: image.convert("RGB").save(p, quality=90)),
+            # Stessi testi su una pagina larga 1189 mm (A0)
+            "PDF vettoriale A0": ("tavola.pdf", lambda p: synthetic_pdf(
+                p, args.larghezza, args.altezza, truth, dpi=args.larghezza * 25.4 / 1189)),
+        }
+        for label, (name, save) in files.items():
+            path = os.path.join(tmp, name)
+            save(path)
+            size = os.path.getsize(path) / 1e6
+            print(f"\n{label} ({size:.1f} MB su disco)")
+            for which in ("originale", "nuovo"):
+                data = json.loads(_child(_CHILD_LOAD, path, which))
+                peak = ("" if data["crescita"] is None
+                        else f"picco +{data['crescita'] / 2 ** 20:7.0f} MB")
+                print(f"{which:>12}: {data['secondi']:6.2f} s  {peak}  modo {data['modo']}")
+            if not name.endswith(".pdf"):
+                for which in ("originale", "nuovo"):
+                    data = json.loads(_child(_CHILD_REGION, path, which))
+                    peak = ("" if data["crescita"] is None
+                            else f"picco +{data['crescita'] / 2 ** 20:7.0f} MB")
+                    print(f"{'regione':>12}: {data['secondi']:6.2f} s  {peak}  ({which})")
+                data = json.loads(_child(_CHILD_EXPORT, path))
+                peak = ("" if data["crescita"] is None
+                        else f"picco +{data['crescita'] / 2 ** 20:7.0f} MB")
+                print(f"{'export PNG':>12}: {data['secondi']:6.2f} s  {peak}")
+            
+            old = np.asarray(_legacy_load_drawing(path)[0].convert("L"), dtype=np.int16)
+            new = np.asarray(pv.load_drawing(path)[0].convert("L"), dtype=np.int16)
+            # Il rendering diretto dei PDF può differire di un pixel per lato
+            h, w = min(old.shape[0], new.shape[0]), min(old.shape[1], new.shape[1])
+            diff = np.abs(old[:h, :w] - new[:h, :w])
+            print(f"{'differenza':>12}: media {diff.mean():.3f}, massima {diff.max()} "
+                  f"(livelli di grigio)")
+    return 1 if failures else 0
+
+
+# ============ SOLO QUOTE ============
+
+def synthetic_sheet(width, height, density=10.0, seed=0):
+    """Tavola sintetica completa: disegno con quote, note, distinta base e cartiglio.
+    
+    Ritorna l'immagine, il ground truth delle sole quote (testi con cifre
+    nel disegno) e la zona del cartiglio in frazioni della pagina.
+    """
+    from PIL import ImageDraw, ImageFont
+    
+    image, truth = synthetic_drawing(width, height, density, seed)
+    truth = [t for t in truth if any(c.isdigit() for c in t["text"])]
+    rng = random.Random(seed + 1)
+    draw = ImageDraw.Draw(image)
+    size = max(12, height // 180)
+    try:
+        font = ImageFont.load_default(size=size)
+        title_font = ImageFont.load_default(size=3 * size)
+    except TypeError:
+        font = title_font = ImageFont.load_default()
+    margin = max(20, width // 60)
+    
+    # Le zone di testo coprono il disegno sottostante, come su una tavola vera
+    def panel(x0, y0, x1, y1):
+        draw.rectangle((x0, y0, x1, y1), fill=255, outline=0, width=2)
+        return [t for t in truth if not (x0 - 5 <= t["box"][0][0] <= x1 and y0 - 5 <= t["box"][0][1] <= y1)]
+    
+    # Cartiglio in basso a destra
+    zone = (0.62, 0.84, 1.0, 1.0)
+    x0, y0 = int(zone[0] * width), int(zone[1] * height)
+    x1, y1 = width - margin, height - margin
+    truth = panel(x0, y0, x1, y1)
+    draw.text((x0 + 2 * size, y0 + size), "FLANGIA DI TESTA", fill=0, font=title_font)
+    fields = [f"DIS. N. {rng.randint(10000, 99999)}-{rng.randint(1, 9)}", "SCALA 1:2",
+              f"FOGLIO 1/{rng.randint(1, 4)}", f"REV. {rng.randint(0, 9)}",
+              f"DATA {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024", "MATERIALE S355JR",
+              "PESO 12,4 kg", "TOLL. GEN. ISO 2768-mK"]
+    for i, text in enumerate(fields):
+        draw.text((x0 + 2 * size + (i % 2) * (x1 - x0) // 2, y0 + 5 * size + (i // 2) * 2 * size),
+                  text, fill=0, font=font)
+    
+    # Note in alto a sinistra: righe lunghe con cifre
+    notes = ["NOTE:", "1. SMUSSI NON QUOTATI 0,5x45°", "2. RAGGI NON QUOTATI R0,5 MAX",
+             "3. TOLLERANZE GENERALI SECONDO ISO 2768-1 CLASSE m",
+             "4. RUGOSITA SUPERFICIALE Ra 3,2 SALVO DOVE INDICATO",
+             "5. ELIMINARE SPIGOLI VIVI E BAVE DI LAVORAZIONE"]
+    nx0, ny0 = margin * 2, margin * 2
+    truth = panel(nx0, ny0, nx0 + 40 * size, ny0 + (len(notes) + 1) * 2 * size)
+    for i, text in enumerate(notes):
+        draw.text((nx0 + size, ny0 + size + 2 * i * size), text, fill=0, font=font)
+    
+    # Distinta base in alto a destra: colonne allineate con cifre
+    rows = 12
+    bx0, by0 = width - margin * 2 - 36 * size, margin * 2
+    truth = panel(bx0, by0, width - margin * 2, by0 + (rows + 1) * 2 * size)
+    for r in range(rows):
+        y = by0 + size // 2 + 2 * r * size
+        cells = (str(r + 1), f"VITE TCEI M{rng.choice((4, 5, 6, 8))}x{rng.choice((10, 16, 20))}",
+                 f"{rng.randint(1, 12)}", f"UNI {rng.randint(5700, 5999)}")
+        for c, (text, dx) in enumerate(zip(cells, (1, 4, 22, 26))):
+            draw.text((bx0 + dx * size, y), text, fill=0, font=font)
+    return image, truth, zone
+
+
+def _normalized(text):
+    return re.sub(r"\s+", "", text).upper()
+
+
+def _recall(reference, results, pad=0.5):
+    """Frazione dei testi di riferimento [(bbox, testo)] ritrovati in results.
+    
+    Un testo è ritrovato se un box di results ha il centro dentro il suo
+    bbox (allargato di pad volte l'altezza) e lo stesso testo normalizzato.
+    """
+    if not reference:
+        return 1.0
+    centers = results.centers
+    texts = [_normalized(t) for t in results.texts]
+    found = 0
+    for (x0, y0, x1, y1), text in reference:
+        m = pad * (y1 - y0)
+        inside = ((centers[:, 0] >= x0 - m) & (centers[:, 0] <= x1 + m) &
+                  (centers[:, 1] >= y0 - m) & (centers[:, 1] <= y1 + m))
+        target = _normalized(text)
+        found += any(texts[i] == target for i in inside.nonzero()[0].tolist())
+    return found / len(reference)
+
+
+def _zone(text):
+    import pallinatore_v6 as pv
+    return pv._parse_zone(text)
+
+
+def _ocr_pixels(image):
+    """Pixel inviati all'OCR da ocr_drawing (stessa riduzione a OCR_MAX_SIZE)."""
+    import pallinatore_v6 as pv
+    
+    k = pv.OCR_MAX_SIZE / max(image.size)
+    if k < 1:
+        image = image.resize((int(image.width * k), int(image.height * k)), Image.LANCZOS)
+    return pv.to_ocr_array(image)
+
+
+def bench_solo_quote(args):
+    import pallinatore_v6 as pv
+    
+    zones = list(args.escludi)
+    if args.cartella:
+        paths = pv.collect_drawings([args.cartella])
+        sheets = [(os.path.basename(p), pv.load_drawing(p)[0], None) for p in paths]
+        print(f"{len(sheets)} disegni da {args.cartella}")
+    else:
+        sheets = []
+        for seed in range(args.disegni):
+            image, truth, zone = synthetic_sheet(args.larghezza, args.altezza, args.densita, seed)
+            sheets.append((f"tavola_{seed}", image, truth))
+        zones = zones or [zone]
+        print(f"{len(sheets)} tavole sintetiche {args.larghezza}x{args.altezza}, "
+              f"{args.densita} quote/MP, zone escluse {zones}")
+    if not sheets:
+        return 1
+    
+    # Modelli caricati e predittori inizializzati prima di misurare (la cache
+    # OCR non interviene: si chiamano direttamente le due pipeline)
+    warm = _ocr_pixels(sheets[0][1])
+    pv.run_ocr(warm)
+    pv.run_ocr_two_stage(warm)
+    
+    print(f"\n{'disegno':>12} {'completo':>9} {'2 fasi':>8} {'box':>5} {'cand.':>5} "
+          f"{'rec. vs completo':>17} {'rec. quote':>17}")
+    totals = {"completo": 0.0, "due_fasi": 0.0}
+    recalls, truth_recalls = [], []
+    pv.profiler.enable()
+    for name, image, truth in sheets:
+        pixels = _ocr_pixels(image)
+        k = image.width / pixels.shape[1]
+        boxes = pv.zones_to_boxes(zones, pixels.shape[1], pixels.shape[0])
+        stats = {}
+        t0 = time.perf_counter()
+        full = pv.run_ocr(pixels)
+        t1 = time.perf_counter()
+        fast = pv.run_ocr_two_stage(pixels, exclude_boxes=boxes, stats=stats)
+        t2 = time.perf_counter()
+        totals["completo"] += t1 - t0
+        totals["due_fasi"] += t2 - t1
+        full, fast = full.scaled(k), fast.scaled(k)
+        boxes = pv.zones_to_boxes(zones, *image.size)
+        
+        # Riferimento: testi con cifre dell'OCR completo fuori dalle zone escluse
+        reference = []
+        for i in full.has_digit.nonzero()[0].tolist():
+            cx, cy = full.centers[i].tolist()
+            if not any(bx0 <= cx < bx1 and by0 <= cy < by1 for bx0, by0, bx1, by1 in boxes):
+                reference.append((full.bbox[i].tolist(), full.texts[i]))
+        recall = _recall(reference, fast)
+        recalls.append(recall)
+        line = (f"{name:>12} {t1 - t0:8.2f}s {t2 - t1:7.2f}s {stats.get('regioni', 0):5d} "
+                f"{stats.get('candidati', 0):5d} {recall:16.1%}")
+        if truth is not None:
+            written = [((b[0][0], b[0][1], b[2][0], b[2][1]), t["text"])
+                       for t in truth for b in [t["box"]]]
+            pair = (_recall(written, full), _recall(written, fast))
+            truth_recalls.append(pair)
+            line += f" {pair[0]:7.1%} / {pair[1]:6.1%}"
+        print(line)
+    
+    n = len(sheets)
+    print(f"\nOCR completo: {totals['completo'] / n:6.2f} s/disegno "
+          f"({n / totals['completo'] * 60:5.1f} disegni/min)")
+    print(f"Due fasi:     {totals['due_fasi'] / n:6.2f} s/disegno "
+          f"({n / totals['due_fasi'] * 60:5.1f} disegni/min), "
+          f"{totals['completo'] / totals['due_fasi']:.2f}x")
+    print(f"Recall rispetto all'OCR completo (testi con cifre fuori dalle zone escluse): "
+          f"{statistics.mean(recalls):.1%} (minimo {min(recalls):.1%})")
+    if truth_recalls:
+        print(f"Recall delle quote scritte: completo {statistics.mean(p[0] for p in truth_recalls):.1%}, "
+              f"due fasi {statistics.mean(p[1] for p in truth_recalls):.1%}")
+    print("\nFasi dell'OCR in due fasi:")
+    for s in pv.profiler.summary():
+        if s["fase"] in ("ocr_detection", "ocr_candidates", "ocr_recognition", "ocr_inference"):
+            print(f"{s['fase']:>22}: {s['totale'] / n:7.3f} s/disegno")
+
+
+# ============ PALLINI ============
+
+def _legacy_auto_place(ocr_results, image=None):
+    """Posizionamento originale: a sinistra del box, centrato verticalmente."""
+    import numpy as np
+    idx = np.flatnonzero(ocr_results.has_digit)
+    xs = np.maximum(ocr_results.bbox[idx, 0] - 20, 15).tolist()
+    ys = ocr_results.centers[idx, 1].tolist()
+    texts = ocr_results.texts
+    return [(x, y, texts[i].strip()) for i, x, y in zip(idx.tolist(), xs, ys)]
+
+
+def _placement_quality(placed, results, image, r):
+    """Metriche di un posizionamento: sovrapposizioni, inchiostro, distanza."""
+    import numpy as np
+    import pallinatore_v6 as pv
+    
+    xy = np.array([(x, y) for x, y, _ in placed], dtype=np.float64).reshape(-1, 2)
+    # Coppie di pallini che si toccano, con un indice a griglia
+    grid = pv.SpatialGrid(cell=2 * r)
+    touching = 0
+    for i, (x, y) in enumerate(xy.tolist()):
+        touching += grid.nearest(x, y, 2 * r) is not None
+        grid.insert(i, x, y)
+    # Pallini che coprono un box di testo (cerchio contro rettangolo)
+    bb = results.bbox.astype(np.float64)
+    on_text = 0
+    for x, y in xy.tolist():
+        dx = np.maximum(np.maximum(bb[:, 0] - x, 0), x - bb[:, 2])
+        dy = np.maximum(np.maximum(bb[:, 1] - y, 0), y - bb[:, 3])
+        on_text += bool((dx * dx + dy * dy < r * r).any())
+    # Inchiostro medio sotto i pallini (pixel scuri nel disco)
+    gray = np.asarray(image.convert("L"))
+    yy, xx = np.mgrid[-int(r):int(r) + 1, -int(r):int(r) + 1]
+    disk = xx * xx + yy * yy <= r * r
+    ink = []
+    for x, y in xy.round().astype(int).tolist():
+        patch = gray[max(0, y - int(r)):y + int(r) + 1, max(0, x - int(r)):x + int(r) + 1]
+        if patch.shape == disk.shape:
+            ink.append(float((patch[disk] < 128).mean()))
+    # Distanza dal centro del pallino al proprio box
+    own = bb[results.has_digit]
+    dx = np.maximum(np.maximum(own[:, 0] - xy[:, 0], 0), xy[:, 0] - own[:, 2])
+    dy = np.maximum(np.maximum(own[:, 1] - xy[:, 1], 0), xy[:, 1] - own[:, 3])
+    return {"sovrapposti": touching, "sopra_testi": on_text,
+            "inchiostro": statistics.mean(ink) if ink else 0.0,
+            "distanza": float(np.hypot(dx, dy).mean()) if len(xy) else 0.0}
+
+
+def bench_pallini(args):
+    import pallinatore_v6 as pv
+    
+    # Tavola quadrata con la densità che dà circa --quote quote
+    side = int((args.quote / args.densita) ** 0.5 * 1000)
+    image, truth = synthetic_drawing(side, side, args.densita)
+    results = pv.OcrResults.from_records(truth)
+    n = int(results.has_digit.sum())
+    print(f"Tavola sintetica {side}x{side}: {len(results)} testi, {n} quote")
+    r = pv.PALLINO_PLACE_RADIUS
+    
+    for name, place in (("originale", _legacy_auto_place), ("nuovo", pv.auto_place_pallini)):
+        elapsed, placed = _timed(lambda: place(results, image), args.ripetizioni)
+        q = _placement_quality(placed, results, image, r)
+        print(f"{name:>10}: {elapsed * 1000:7.1f} ms  sovrapposti {q['sovrapposti']:4d}  "
+              f"sopra testi {q['sopra_testi']:4d}  inchiostro {q['inchiostro']:6.1%}  "
+              f"distanza {q['distanza']:5.1f} px")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark del Pallinatore")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    
+    p = sub.add_parser("drag", help="Trascinamento pallini sul canvas")
+    p.add_argument("--pallini", type=int, default=150)
+    p.add_argument("--box", type=int, default=300, help="Box OCR visualizzati")
+    p.add_argument("--passi", type=int, default=300, help="Eventi di movimento")
+    p.add_argument("--senza-display", action="store_true",
+                   help="Canvas finto: solo il lavoro Python, senza Tk")
+    p.set_defaults(func=bench_drag)
+    
+    p = sub.add_parser("quota", help="parse_quota: confronto con l'originale")
+    p.add_argument("--righe", type=int, default=20000, help="Quote nel corpus")
+    p.add_argument("--varianti", type=int, default=3000, help="Quote distinte nel corpus")
+    p.set_defaults(func=bench_quota)
+    
+    p = sub.add_parser("excel", help="Tabella quote in streaming (xlsx, csv, parquet)")
+    p.add_argument("--righe", type=int, default=100000)
+    p.add_argument("--formati", default="xlsx,csv,parquet")
+    p.add_argument("--originale", action="store_true",
+                   help="Confronta anche con l'export openpyxl originale")
+    p.add_argument("--memoria", action="store_true",
+                   help="Misura il picco di memoria (tracemalloc, rallenta)")
+    p.set_defaults(func=bench_excel)
+    
+    p = sub.add_parser("avvio", help="Tempi di import, apertura finestra e primo OCR")
+    p.add_argument("--ripetizioni", type=int, default=5)
+    p.add_argument("--moduli", type=int, default=12, help="Moduli mostrati")
+    p.add_argument("--ocr", action="store_true",
+                   help="Misura la prima scansione con e senza preriscaldamento")
+    p.set_defaults(func=bench_avvio)
+    
+    p = sub.add_parser("suite", help="Tutte le fasi su un disegno sintetico (senza display)")
+    p.add_argument("--larghezza", type=int, default=7000)
+    p.add_argument("--altezza", type=int, default=5000)
+    p.add_argument("--densita", type=float, default=10.0, help="Quote per megapixel")
+    p.add_argument("--ripetizioni", type=int, default=3)
+    p.add_argument("--json", metavar="FILE", help="Salva i risultati in JSON")
+    p.add_argument("--confronta", metavar="FILE", help="Risultati JSON di riferimento")
+    p.add_argument("--soglia", type=float, default=1.2,
+                   help="Rapporto oltre il quale una fase è una regressione")
+    p.set_defaults(func=bench_suite)
+    
+    p = sub.add_parser("apertura", help="load_drawing su scansioni grandi: tempo e memoria")
+    p.add_argument("--larghezza", type=int, default=14000)
+    p.add_argument("--altezza", type=int, default=9900)
+    p.set_defaults(func=bench_apertura)
+    
+    p = sub.add_parser("solo-quote", help="OCR in due fasi: velocità e recall rispetto al completo")
+    p.add_argument("--disegni", type=int, default=5, help="Tavole sintetiche")
+    p.add_argument("--larghezza", type=int, default=2480)
+    p.add_argument("--altezza", type=int, default=1754)
+    p.add_argument("--densita", type=float, default=10.0)
+    p.add_argument("--cartella", help="Disegni reali invece delle tavole sintetiche")
+    p.add_argument("--escludi", action="append", default=[], type=_zone,
+                   metavar="X0,Y0,X1,Y1", help="Zona esclusa (default: il cartiglio sintetico)")
+    p.set_defaults(func=bench_solo_quote)
+    
+    p = sub.add_parser("pallini", help="Posizionamento automatico dei pallini senza collisioni")
+    p.add_argument("--quote", type=int, default=1000, help="Quote sulla tavola (circa)")
+    p.add_argument("--densita", type=float, default=30.0, help="Quote per megapixel")
+    p.add_argument("--ripetizioni", type=int, default=3)
+    p.set_defaults(func=bench_pallini)
+    
+    args = parser.parse_args(argv)
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,216 +9,3490 @@ Pallinatore Quote v6
 
 import os
 import re
+import sys
+import time
+import queue
+import logging
+import functools
+import contextlib
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 from PIL import Image, ImageTk
 import numpy as np
 
-# PaddleOCR - inizializzazione lazy
+# Dimensione massima per display (pixel sul lato lungo)
+DISPLAY_MAX_SIZE = 2000
+# Scansioni accettate (un A0 a 600 dpi ha circa 560 Mpx; il limite di PIL è 89 Mpx)
+MAX_IMAGE_PIXELS = 1_000_000_000
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+# Dimensione massima per OCR (pixel sul lato lungo)
+OCR_MAX_SIZE = 2500
+
+# Posizionamento automatico dei pallini (pixel di working_image): raggio come
+# nelle esportazioni, distanza minima dal testo e tra pallini, cella della
+# mappa ridotta di inchiostro e testi usata per valutare le posizioni
+PALLINO_PLACE_RADIUS = 15
+PALLINO_PLACE_GAP = 3
+PALLINO_INK_CELL = 4
+
+# Visualizzazione: limiti di zoom e budget di memoria della piramide
+ZOOM_MIN = 0.1
+ZOOM_MAX = 8.0
+PYRAMID_MAX_MB = 256
+
+# OCR a tile sulla risoluzione originale (pixel dell'immagine sorgente)
+OCR_TILE_SIZE = 1600
+OCR_TILE_OVERLAP = 200
+OCR_TILE_WORKERS = 2
+
+# OCR di una regione selezionata: le regioni piccole (lato lungo in pixel
+# sorgente) vengono ingrandite fino a OCR_REGION_MAX_UPSCALE volte
+OCR_REGION_MIN_SIDE = 1200
+OCR_REGION_MAX_UPSCALE = 2.0
+
+# PDF: risoluzione di riferimento delle pagine (pixel "originali", coordinate
+# dei progetti ed export) e risoluzione a cui vengono renderizzate le tile OCR
+PDF_DPI = 150
+PDF_OCR_DPI = 300
+
+# Impostazioni del motore OCR (fanno parte della chiave della cache)
+OCR_ENGINE_SETTINGS = {"lang": "en"}
+
+# OCR in due fasi: rilevamento sull'intera pagina, riconoscimento dei soli
+# candidati quota (parametri dei modelli TextDetection / TextRecognition)
+OCR_DET_SETTINGS = {}
+OCR_REC_SETTINGS = {}
+OCR_REC_BATCH = 16
+# Filtro dei candidati: lunghezza stimata oltre la quale un box è una nota,
+# righe allineate oltre le quali è la colonna di una tabella (distinta base)
+OCR_CANDIDATE_MAX_CHARS = 24
+OCR_TABLE_MIN_ROWS = 8
+
+# Cache su disco dei risultati OCR, condivisa tra GUI e batch
+# (PALLINATORE_OCR_CACHE=off la disattiva, altrimenti indica la cartella)
+OCR_CACHE_MAX_MB = 512
+
+# Servizio OCR locale condiviso tra più istanze (GUI e batch) della stessa macchina.
+# I client lo usano solo se richiesto: PALLINATORE_OCR_SERVER=on (indirizzo di
+# default) o host:porta, oppure l'opzione --usa-ocr-server
+OCR_SERVER_ADDRESS = ("127.0.0.1", 47613)
+OCR_SERVER_CONNECT_TIMEOUT = 0.25  # Attesa (s) della connessione: il servizio è locale
+OCR_SERVER_BATCH = 8             # Immagini al massimo per chiamata al motore
+OCR_SERVER_BATCH_WAIT = 0.02     # Attesa (s) per raccogliere altre richieste nel batch
+OCR_SERVER_MAX_PIXELS = 120_000_000
+OCR_SERVER_RETRY = 10.0          # Dopo un errore di connessione si riprova dopo (s)
+OCR_SERVER_TIMEOUT = 600.0       # Attesa massima di una risposta (coda inclusa)
+
+# Esportazione a piena risoluzione: righe di pixel elaborate per volta
+EXPORT_BAND_HEIGHT = 512
+# JPEG e BMP vengono composti in memoria da PIL: oltre questi pixel si riducono
+EXPORT_IMAGE_MAX_PIXELS = 40_000_000
+
+# Pagine raster più grandi di così (byte decodificati) vengono decodificate in un
+# processo separato, che restituisce la memoria al sistema appena ha finito
+RASTER_DECODE_PROCESS_BYTES = 128 * 1024 * 1024
+
+# File di progetto: OCR e pallini salvati accanto al disegno (archivio NumPy)
+PROJECT_EXTENSION = ".pallinatore"
+PROJECT_VERSION = 1
+
+# Estensioni gestite (apertura file e modalità batch)
+SUPPORTED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".pdf")
+
+# Misure delle prestazioni per fase (PALLINATORE_PROFILE=1 le attiva all'avvio,
+# PALLINATORE_PROFILE=file.json salva anche la traccia all'uscita)
+PROFILE_SAMPLE_INTERVAL = 0.01   # Campionamento della memoria (s)
+PROFILE_MAX_EVENTS = 200_000
+
+
+# ============ STRUMENTAZIONE ============
+
+# Messaggi diagnostici: avvisi sempre, dettagli con PALLINATORE_DEBUG=1
+log = logging.getLogger("pallinatore")
+
+
+def configure_logging():
+    """Messaggi del logger "pallinatore" sulla console, livello da PALLINATORE_DEBUG."""
+    debug = os.environ.get("PALLINATORE_DEBUG", "").lower() in ("1", "on", "si", "yes")
+    if not log.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        log.addHandler(handler)
+    log.setLevel(logging.DEBUG if debug else logging.INFO)
+
+
+_rss_reader = None
+
+
+def _make_rss_reader():
+    """Funzione che legge la memoria residente del processo nel modo più economico."""
+    try:
+        import psutil
+        process = psutil.Process()
+        return lambda: process.memory_info().rss
+    except ImportError:
+        pass
+    if sys.platform.startswith("linux"):
+        page = os.sysconf("SC_PAGE_SIZE")
+        
+        def read_statm():
+            with open("/proc/self/statm", "rb") as fh:
+                return int(fh.read().split()[1]) * page
+        return read_statm
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+        
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+        
+        kernel32, psapi = ctypes.windll.kernel32, ctypes.windll.psapi
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.c_void_p, wintypes.DWORD]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        
+        def read_windows():
+            psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                       counters.cb)
+            return counters.WorkingSetSize
+        return read_windows
+    return lambda: 0
+
+
+def current_rss():
+    """Memoria residente del processo in byte (0 se non misurabile)."""
+    global _rss_reader
+    if _rss_reader is None:
+        _rss_reader = _make_rss_reader()
+    return _rss_reader()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start", "rss_start", "peak")
+    
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+    
+    def __enter__(self):
+        self.rss_start = self.peak = current_rss()
+        with self.profiler._lock:
+            self.profiler._open.append(self)
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        rss = current_rss()
+        profiler = self.profiler
+        with profiler._lock:
+            profiler._open.remove(self)
+            if len(profiler.events) < PROFILE_MAX_EVENTS:
+                thread = threading.current_thread()
+                profiler.events.append((self.name, os.getpid(), thread.ident, thread.name, self.start,
+                                        end - self.start, self.rss_start,
+                                        max(self.peak, rss), rss))
+        return False
+
+
+class Profiler:
+    """Misure per fase ("span"): durata e picco di memoria residente.
+    
+    Disattivato non registra nulla e span() restituisce un contesto vuoto
+    condiviso, quindi le fasi strumentate non costano quasi niente. Attivo,
+    un thread campiona la RSS ogni PROFILE_SAMPLE_INTERVAL secondi per
+    stimare il picco di ogni span aperto; la traccia si esporta nel formato
+    Chrome (chrome://tracing, Perfetto).
+    """
+    
+    def __init__(self):
+        self.enabled = False
+        self.events = []       # (nome, pid, tid, thread, inizio, durata, rss inizio, rss picco, rss fine)
+        self.samples = []      # (tempo, rss) mentre almeno uno span è aperto
+        self._open = []
+        self._lock = threading.Lock()
+        self._null = contextlib.nullcontext()
+        self._sampler = None
+    
+    def span(self, name):
+        """Contesto che misura la fase name (vuoto se disattivato)."""
+        if not self.enabled:
+            return self._null
+        return _Span(self, name)
+    
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._sampler.start()
+    
+    def disable(self):
+        self.enabled = False
+    
+    def clear(self):
+        with self._lock:
+            self.events = []
+            self.samples = []
+    
+    def take(self):
+        """Ritorna gli span registrati e li rimuove (per inviarli da un worker)."""
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+    
+    def merge(self, events):
+        """Aggiunge span registrati in un altro processo."""
+        with self._lock:
+            self.events.extend(events)
+    
+    def _sample(self):
+        while self.enabled:
+            time.sleep(PROFILE_SAMPLE_INTERVAL)
+            if not self._open:
+                continue
+            rss = current_rss()
+            with self._lock:
+                for span in self._open:
+                    if rss > span.peak:
+                        span.peak = rss
+                if len(self.samples) < PROFILE_MAX_EVENTS:
+                    self.samples.append((time.perf_counter(), rss))
+    
+    def summary(self):
+        """Riepilogo per fase, dalla più costosa: dizionari con conteggi e tempi."""
+        stats = {}
+        with self._lock:
+            events = list(self.events)
+        for name, _, _, _, _, duration, rss_start, peak, _ in events:
+            s = stats.setdefault(name, {"fase": name, "n": 0, "totale": 0.0, "max": 0.0,
+                                        "picco_rss": 0, "crescita_rss": 0})
+            s["n"] += 1
+            s["totale"] += duration
+            s["max"] = max(s["max"], duration)
+            s["picco_rss"] = max(s["picco_rss"], peak)
+            s["crescita_rss"] = max(s["crescita_rss"], peak - rss_start)
+        for s in stats.values():
+            s["medio"] = s["totale"] / s["n"]
+        return sorted(stats.values(), key=lambda s: -s["totale"])
+    
+    def chrome_trace(self):
+        """Eventi nel formato Trace Event di Chrome."""
+        with self._lock:
+            events, samples = list(self.events), list(self.samples)
+        mb = 1024 * 1024
+        trace, threads = [], {}
+        for name, pid, tid, thread, start, duration, rss_start, peak, rss_end in events:
+            threads[pid, tid] = thread
+            trace.append({
+                "name": name, "cat": "pallinatore", "ph": "X", "pid": pid, "tid": tid,
+                "ts": round(start * 1e6, 1), "dur": round(duration * 1e6, 1),
+                "args": {"rss_inizio_mb": round(rss_start / mb, 1),
+                         "rss_picco_mb": round(peak / mb, 1),
+                         "rss_fine_mb": round(rss_end / mb, 1)},
+            })
+        for t, rss in samples:
+            trace.append({"name": "RSS", "ph": "C", "pid": os.getpid(), "ts": round(t * 1e6, 1),
+                          "args": {"MB": round(rss / mb, 1)}})
+        for (pid, tid), thread in threads.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                          "args": {"name": thread}})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+    
+    def dump(self, path):
+        """Salva la traccia Chrome (JSON) in path."""
+        import json
+        
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(self.chrome_trace(), fh)
+        os.replace(tmp, path)
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """Decoratore: misura ogni chiamata della funzione come span name."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            with _Span(profiler, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _profile_from_env():
+    """Attiva le misure secondo PALLINATORE_PROFILE (1 oppure file della traccia)."""
+    value = os.environ.get("PALLINATORE_PROFILE", "").strip()
+    if not value or value.lower() in ("0", "off", "no"):
+        return
+    profiler.enable()
+    if value.lower() not in ("1", "on", "si", "yes"):
+        import atexit
+        
+        def save():
+            profiler.dump(value)
+            print(f"Traccia delle prestazioni salvata in {value}")
+        atexit.register(save)
+
+# PaddleOCR - inizializzazione lazy, anticipata in background all'avvio della GUI
+# (PALLINATORE_OCR_PRELOAD=off la disattiva)
 _ocr_engine = None
+_warmup_thread = None
+_warmup_error = None
+_warmup_remote = False
+
+_engine_lock = threading.Lock()
+_ocr_lock = threading.Lock()          # Un solo thread alla volta sul motore condiviso
+_tile_executor = None
+
+# Motori aggiuntivi per l'OCR a tile in parallelo: creati una volta sola, al più
+# OCR_TILE_WORKERS - 1, e riusati da tutte le scansioni
+_engine_slots = threading.BoundedSemaphore(OCR_TILE_WORKERS)
+_engine_pool = []
+_engine_pool_size = 0
+
+def get_ocr_engine():
+    global _ocr_engine
+    if _ocr_engine is None:
+        # Il preriscaldamento può essere in corso: si attende lui invece di
+        # costruire un secondo motore
+        with _engine_lock:
+            if _ocr_engine is None:
+                with profiler.span("ocr_engine_load"):
+                    from paddleocr import PaddleOCR
+                    _ocr_engine = PaddleOCR(**OCR_ENGINE_SETTINGS)
+    return _ocr_engine
+
+
+def ocr_engine_loaded():
+    return _ocr_engine is not None
+
+
+def start_ocr_warmup():
+    """Carica il motore OCR in un thread di background.
+    
+    Oltre ai modelli esegue un'inferenza su un'immagine vuota, così anche
+    la prima scansione vera trova i predittori già inizializzati. Ritorna
+    il thread (None se il preriscaldamento è disattivato).
+    """
+    global _warmup_thread
+    if _warmup_thread is not None:
+        return _warmup_thread
+    if os.environ.get("PALLINATORE_OCR_PRELOAD", "").lower() in ("0", "off", "no"):
+        return None
+    
+    def warmup():
+        global _warmup_error, _warmup_remote
+        # Con il servizio locale attivo i modelli non vengono caricati qui
+        if ocr_server_available():
+            _warmup_remote = True
+            log.debug("OCR tramite servizio locale")
+            return
+        start = time.perf_counter()
+        try:
+            engine = get_ocr_engine()
+            loaded = time.perf_counter()
+            with _ocr_lock:
+                engine.ocr(np.full((64, 256, 3), 255, dtype=np.uint8))
+            log.debug(f"Motore OCR pronto: modelli {loaded - start:.1f}s, "
+                      f"prima inferenza {time.perf_counter() - loaded:.1f}s")
+        except Exception as e:
+            _warmup_error = e
+            log.warning(f"Preriscaldamento OCR fallito: {e}")
+    
+    _warmup_thread = threading.Thread(target=warmup, name="ocr-warmup", daemon=True)
+    _warmup_thread.start()
+    return _warmup_thread
+
+
+def ocr_engine_status():
+    """Stato del motore: "pronto", "servizio", "caricamento", "errore" o "inattivo"."""
+    if _warmup_thread is not None and _warmup_thread.is_alive():
+        return "caricamento"
+    if _warmup_remote and _ocr_engine is None:
+        return "servizio"
+    if _warmup_error is not None:
+        return "errore"
+    if _ocr_engine is not None:
+        return "pronto"
+    return "inattivo"
+
+
+@contextlib.contextmanager
+def pooled_ocr_engine():
+    """Motore OCR in uso esclusivo per la durata del blocco with.
+    
+    I predittori non sono thread-safe. Si usa il motore condiviso se è
+    libero (tenendo _ocr_lock), altrimenti uno dei motori aggiuntivi del
+    pool; ne vengono creati al più OCR_TILE_WORKERS - 1 in tutto il
+    processo, e restano caricati per le scansioni successive.
+    """
+    global _engine_pool_size
+    with _engine_slots:
+        if _ocr_lock.acquire(blocking=False):
+            try:
+                yield get_ocr_engine()
+            finally:
+                _ocr_lock.release()
+            return
+        
+        with _engine_lock:
+            engine = _engine_pool.pop() if _engine_pool else None
+            create = engine is None and _engine_pool_size < OCR_TILE_WORKERS - 1
+            if create:
+                _engine_pool_size += 1
+        if engine is None and not create:
+            # Motori aggiuntivi tutti occupati: si attende quello condiviso
+            with _ocr_lock:
+                yield get_ocr_engine()
+            return
+        
+        if create:
+            try:
+                with profiler.span("ocr_engine_load"):
+                    from paddleocr import PaddleOCR
+                    engine = PaddleOCR(**OCR_ENGINE_SETTINGS)
+            except Exception:
+                with _engine_lock:
+                    _engine_pool_size -= 1
+                raise
+        try:
+            yield engine
+        finally:
+            with _engine_lock:
+                _engine_pool.append(engine)
+
+
+_DIGIT_RE = re.compile(r"\d")
+
+
+class OcrResults:
+    """Risultati OCR di una pagina in forma colonnare (un array per campo).
+    
+    polys (N, 4, 2) float32 contiene i quadrilateri dei testi; bbox (N, 4)
+    con x0, y0, x1, y1 e centers (N, 2) sono calcolati una volta sola, come
+    la maschera has_digit dei testi che contengono cifre. Riscalature e
+    traslazioni lavorano sull'intero array. Per compatibilità r[i] e
+    l'iterazione restituiscono dizionari {"box", "text", "conf"}.
+    """
+    
+    def __init__(self, polys=None, texts=(), conf=None):
+        if polys is None:
+            polys = np.zeros((0, 4, 2), np.float32)
+        self.polys = np.ascontiguousarray(polys, dtype=np.float32).reshape(-1, 4, 2)
+        self.texts = [str(t) for t in texts]
+        n = len(self.polys)
+        if len(self.texts) != n:
+            raise ValueError(f"{n} box ma {len(self.texts)} testi")
+        self.conf = (np.zeros(n, np.float32) if conf is None
+                     else np.asarray(conf, dtype=np.float32).reshape(n))
+        self._update_geometry()
+        self._has_digit = None
+    
+    def _update_geometry(self):
+        self.bbox = np.concatenate([self.polys.min(axis=1), self.polys.max(axis=1)], axis=1)
+        self.centers = self.polys.mean(axis=1)
+    
+    @staticmethod
+    def as_quad(points):
+        """Quadrilatero (4, 2) di un poligono; se ha più vertici, il suo rettangolo."""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        if len(points) == 4:
+            return points
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float32)
+    
+    @classmethod
+    def from_records(cls, records):
+        """Da una sequenza di dizionari {"box", "text", "conf"}."""
+        records = list(records)
+        if not records:
+            return cls()
+        return cls(np.stack([cls.as_quad(r["box"]) for r in records]),
+                   [r["text"] for r in records], [r.get("conf", 0.0) for r in records])
+    
+    @classmethod
+    def concatenate(cls, parts):
+        parts = [p for p in parts if len(p)]
+        if not parts:
+            return cls()
+        out = cls.__new__(cls)
+        out.polys = np.concatenate([p.polys for p in parts])
+        out.texts = [t for p in parts for t in p.texts]
+        out.conf = np.concatenate([p.conf for p in parts])
+        out._update_geometry()
+        out._has_digit = None
+        return out
+    
+    def _with_polys(self, polys):
+        out = self.__class__.__new__(self.__class__)
+        out.polys = np.ascontiguousarray(polys, dtype=np.float32)
+        out.texts = self.texts
+        out.conf = self.conf
+        out._update_geometry()
+        out._has_digit = self._has_digit
+        return out
+    
+    def scaled(self, factor):
+        """Copia con le coordinate moltiplicate per factor (scalare o (fx, fy))."""
+        return self._with_polys(self.polys * np.float32(factor))
+    
+    def translated(self, dx, dy):
+        """Copia con le coordinate traslate di (dx, dy)."""
+        return self._with_polys(self.polys + np.array([dx, dy], dtype=np.float32))
+    
+    @property
+    def has_digit(self):
+        """Maschera (N,) dei testi che contengono almeno una cifra."""
+        if self._has_digit is None:
+            self._has_digit = np.fromiter((_DIGIT_RE.search(t) is not None for t in self.texts),
+                                          dtype=bool, count=len(self.texts))
+        return self._has_digit
+    
+    def select(self, index):
+        """Copia con i soli box indicati (maschera booleana o indici)."""
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        out = OcrResults(self.polys[index], [self.texts[i] for i in index.tolist()],
+                         self.conf[index])
+        if self._has_digit is not None:
+            out._has_digit = self._has_digit[index]
+        return out
+    
+    def __len__(self):
+        return len(self.texts)
+    
+    def __getitem__(self, i):
+        return {"box": self.polys[i].astype(float), "text": self.texts[i],
+                "conf": float(self.conf[i])}
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class OcrCache:
+    """Cache su disco dei risultati OCR, indirizzata per contenuto.
+    
+    La chiave è l'hash dei pixel inviati all'OCR, delle impostazioni del
+    motore e del fattore di scala. Ogni voce è un file binario compatto;
+    oltre il limite di dimensione vengono eliminate le voci usate meno di
+    recente (la data di modifica viene aggiornata a ogni lettura).
+    """
+    
+    MAGIC = b"POC1"
+    
+    def __init__(self, directory, max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None    # Stima dell'occupazione, calcolata al primo inserimento
+        os.makedirs(directory, exist_ok=True)
+    
+    @staticmethod
+    def _engine_version():
+        try:
+            from importlib.metadata import version
+            return version("paddleocr")
+        except Exception:
+            return "?"
+    
+    def key(self, pixels, scale=1.0, variant=""):
+        import hashlib
+        
+        pixels = np.ascontiguousarray(pixels)
+        params = (pixels.shape, str(pixels.dtype), sorted(OCR_ENGINE_SETTINGS.items()),
+                  self._engine_version(), round(float(scale), 6))
+        # variant distingue pipeline diverse (es. OCR in due fasi)
+        if variant:
+            params += (variant,)
+        h = hashlib.sha256()
+        h.update(repr(params).encode())
+        h.update(memoryview(pixels).cast("B"))
+        return h.hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".ocr")
+    
+    def get(self, key):
+        """Ritorna i risultati in cache o None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh:
+                data = fh.read()
+            os.utime(path)
+            return self._decode(data)
+        except (OSError, ValueError):
+            return None
+    
+    def put(self, key, results):
+        path = self._path(key)
+        data = self._encode(results)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as fh:
+                fh.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning(f"Cache OCR: scrittura non riuscita: {e}")
+            return
+        if self._size is None:
+            self._size = self._scan_size()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+    
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".ocr"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+    
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+    
+    def _evict(self):
+        """Elimina le voci meno recenti fino al 90% del limite."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+    
+    @classmethod
+    def _encode(cls, results):
+        import struct
+        
+        n = len(results)
+        counts = np.full(n, 4, dtype=np.uint16)
+        points = results.polys.reshape(-1, 2)
+        scores = results.conf.astype(np.float32)
+        texts = [t.encode("utf-8") for t in results.texts]
+        lengths = np.array([len(t) for t in texts], dtype=np.uint32)
+        return b"".join([cls.MAGIC, struct.pack("<II", n, len(points)), counts.tobytes(),
+                         points.tobytes(), scores.tobytes(), lengths.tobytes(), b"".join(texts)])
+    
+    @classmethod
+    def _decode(cls, data):
+        import struct
+        
+        if data[:4] != cls.MAGIC:
+            raise ValueError("formato cache non valido")
+        n, n_points = struct.unpack_from("<II", data, 4)
+        pos = 12
+        counts = np.frombuffer(data, np.uint16, n, pos); pos += 2 * n
+        points = np.frombuffer(data, np.float32, 2 * n_points, pos).reshape(-1, 2); pos += 8 * n_points
+        scores = np.frombuffer(data, np.float32, n, pos); pos += 4 * n
+        lengths = np.frombuffer(data, np.uint32, n, pos); pos += 4 * n
+        
+        ends = (pos + np.cumsum(lengths, dtype=np.int64)).tolist()
+        texts = [data[start:end].decode("utf-8") for start, end in zip([pos] + ends, ends)]
+        
+        if np.all(counts == 4):
+            polys = points.reshape(-1, 4, 2)
+        else:
+            # Voci scritte da versioni che salvavano poligoni con più vertici
+            bounds = np.cumsum(counts, dtype=np.int64).tolist()
+            polys = np.stack([OcrResults.as_quad(points[s:e])
+                              for s, e in zip([0] + bounds, bounds)])
+        return OcrResults(polys, texts, scores)
+
+
+_ocr_cache = None
+
+def get_ocr_cache():
+    """Cache OCR condivisa della macchina (None se disattivata)."""
+    global _ocr_cache
+    if _ocr_cache is None:
+        directory = os.environ.get("PALLINATORE_OCR_CACHE", "")
+        if directory.lower() in ("0", "off", "no"):
+            _ocr_cache = False
+        else:
+            if not directory:
+                base = (os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+                        or os.path.join(os.path.expanduser("~"), ".cache"))
+                directory = os.path.join(base, "pallinatore", "ocr")
+            try:
+                _ocr_cache = OcrCache(directory)
+            except OSError as e:
+                log.warning(f"Cache OCR disattivata: {e}")
+                _ocr_cache = False
+    return _ocr_cache or None
+
+
+def cached_ocr(pixels, compute, scale=1.0, variant=""):
+    """Ritorna i risultati OCR dalla cache o li calcola con compute()."""
+    cache = get_ocr_cache()
+    if cache is None:
+        return compute()
+    with profiler.span("ocr_cache"):
+        key = cache.key(pixels, scale, variant)
+        results = cache.get(key)
+    if results is not None:
+        return results
+    results = compute()
+    cache.put(key, results)
+    return results
+
+
+@profiled("to_ocr_array")
+def to_ocr_array(image):
+    """Converte un'immagine PIL o un array RGB nell'array BGR atteso da PaddleOCR."""
+    if isinstance(image, Image.Image):
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image = np.asarray(image)
+    elif image.ndim == 2:
+        image = np.repeat(image[:, :, None], 3, axis=2)
+    return np.ascontiguousarray(image[:, :, ::-1])
+
+
+@profiled("run_ocr")
+def run_ocr(image, progress_callback=None, engine=None):
+    """Esegue OCR su un'immagine.
+    
+    image può essere un'immagine PIL, un array NumPy BGR (come OpenCV) o un
+    percorso: le immagini in memoria vengono passate direttamente al motore,
+    senza file temporanei.
+    """
+    if isinstance(image, Image.Image):
+        image = to_ocr_array(image)
+    
+    # Il servizio locale, se attivo, evita di caricare i modelli in questo processo
+    if engine is None and isinstance(image, np.ndarray):
+        if progress_callback and ocr_server_address() is not None:
+            progress_callback(None, "Rilevamento e riconoscimento testo...")
+        results = ocr_server_request(image)
+        if results is not None:
+            if progress_callback:
+                progress_callback(100, "Completato!")
+            return results
+    
+    if engine is None and not ocr_engine_loaded() and progress_callback:
+        progress_callback(None, "Caricamento modelli OCR...")
+    ocr = engine or get_ocr_engine()
+    
+    if progress_callback:
+        progress_callback(None, "Rilevamento e riconoscimento testo...")
+    
+    with profiler.span("ocr_inference"):
+        if engine is None:
+            with _ocr_lock:
+                raw = ocr.ocr(image)
+        else:
+            raw = ocr.ocr(image)
+    
+    if progress_callback:
+        progress_callback(70, "Elaborazione risultati...")
+    
+    if raw is None or len(raw) == 0:
+        return OcrResults()
+    
+    results = _parse_ocr_result(raw[0], progress_callback)
+    
+    if progress_callback:
+        progress_callback(100, "Completato!")
+    
+    return results
+
+
+@profiled("ocr_parse")
+def _parse_ocr_result(res_obj, progress_callback=None):
+    """Converte il risultato grezzo di PaddleOCR in un OcrResults."""
+    try:
+        polys = res_obj.get('rec_polys')
+        if polys is None or len(polys) == 0:
+            polys = res_obj.get('dt_polys')
+        texts = res_obj.get('rec_texts', [])
+        scores = res_obj.get('rec_scores', [])
+        
+        if polys is None or len(polys) == 0:
+            return OcrResults()
+        
+        total = len(polys)
+        if progress_callback:
+            progress_callback(80, f"Elaborazione {total} testi...")
+        
+        try:
+            quads = np.asarray(polys, dtype=np.float32)
+        except ValueError:
+            quads = None
+        if quads is None or quads.shape != (total, 4, 2):
+            quads = np.stack([OcrResults.as_quad(p) for p in polys])
+        texts = [texts[i] if i < len(texts) else "" for i in range(total)]
+        conf = [float(scores[i]) if i < len(scores) and scores[i] is not None else 0.0
+                for i in range(total)]
+        return OcrResults(quads, texts, conf)
+    
+    except Exception as e:
+        log.error(f"Lettura dei risultati OCR non riuscita: {e}")
+    
+    return OcrResults()
+
+
+def _ocr_tile(tile, two_stage=False, exclude_boxes=(), pooled=False):
+    """OCR di una tile (immagine PIL).
+    
+    Senza pooled la tile passa per run_ocr (servizio locale o motore
+    condiviso sotto _ocr_lock); con pooled, usato dai thread del pool a
+    tile, prende un motore libero da pooled_ocr_engine.
+    """
+    arr = to_ocr_array(tile)
+    
+    if two_stage:
+        return cached_ocr(arr, lambda: run_ocr_two_stage(arr, exclude_boxes=exclude_boxes),
+                          variant=_two_stage_variant(exclude_boxes))
+    
+    def compute():
+        if not pooled:
+            return run_ocr(arr)
+        results = ocr_server_request(arr)
+        if results is None:
+            with pooled_ocr_engine() as engine:
+                results = run_ocr(arr, engine=engine)
+        return results
+    
+    return cached_ocr(arr, compute)
+
+
+def _tile_grid(width, height, tile_size, overlap):
+    """Origini delle tile che coprono l'immagine con la sovrapposizione richiesta."""
+    step = max(1, tile_size - overlap)
+    
+    def starts(total):
+        if total <= tile_size:
+            return [0]
+        pos = list(range(0, total - tile_size, step))
+        pos.append(total - tile_size)
+        return pos
+    
+    return [(x, y) for y in starts(height) for x in starts(width)]
+
+
+def _merge_seam_text(first, second, overlap_ratio):
+    """Unisce i testi di un box tagliato da una giuntura tra tile."""
+    # Cerca la parte di testo letta da entrambe le tile
+    for k in range(min(len(first), len(second)), 0, -1):
+        if first.endswith(second[:k]):
+            return first + second[k:]
+    # Nessuna corrispondenza: stima i caratteri nella zona sovrapposta
+    skip = int(round(len(second) * overlap_ratio))
+    return first + second[skip:]
+
+
+@profiled("merge_tiles")
+def _merge_tile_results(results, cut, iom_threshold=0.3, cell=256.0):
+    """Elimina i duplicati nelle zone di sovrapposizione e unisce i box tagliati.
+    
+    results: OcrResults di tutte le tile in coordinate sorgente;
+    cut: maschera dei box che toccano un bordo interno della propria tile.
+    I box tenuti sono indicizzati in una griglia uniforme di lato cell: ogni
+    box viene confrontato solo con quelli delle celle che tocca, nello
+    stesso ordine del confronto con tutti.
+    """
+    bbox = results.bbox.astype(float)
+    areas = (bbox[:, 2] - bbox[:, 0]) * (bbox[:, 3] - bbox[:, 1])
+    # Prima i box interi, poi i più grandi
+    order = np.lexsort((-areas, cut))
+    
+    kept = []        # [poligono, testo, confidenza, tagliato]
+    bounds = []      # (x0, y0, x1, y1) dei box tenuti
+    grid = {}        # (cx, cy) -> indici in kept dei box che toccano la cella
+    
+    def cells(x0, y0, x1, y1):
+        return [(cx, cy) for cx in range(int(x0 // cell), int(x1 // cell) + 1)
+                for cy in range(int(y0 // cell), int(y1 // cell) + 1)]
+    
+    for i in order.tolist():
+        x0, y0, x1, y1 = bbox[i].tolist()
+        a = max((x1 - x0) * (y1 - y0), 1e-6)
+        box_cells = cells(x0, y0, x1, y1)
+        
+        match = None
+        near = set()
+        for c in box_cells:
+            near.update(grid.get(c, ()))
+        for k in sorted(near):
+            kx0, ky0, kx1, ky1 = bounds[k]
+            iw = min(x1, kx1) - max(x0, kx0)
+            ih = min(y1, ky1) - max(y0, ky0)
+            if iw <= 0 or ih <= 0:
+                continue
+            ka = max((kx1 - kx0) * (ky1 - ky0), 1e-6)
+            if iw * ih / min(a, ka) > iom_threshold:
+                match = k
+                break
+        
+        if match is None:
+            for c in box_cells:
+                grid.setdefault(c, set()).add(len(kept))
+            kept.append([results.polys[i], results.texts[i], float(results.conf[i]), bool(cut[i])])
+            bounds.append((x0, y0, x1, y1))
+            continue
+        
+        other = kept[match]
+        if not (cut[i] and other[3]):
+            # Duplicato (o frammento) di un box già letto per intero
+            continue
+        
+        # Entrambi tagliati: testo più lungo della sovrapposizione, unisci
+        kx0, ky0, kx1, ky1 = bounds[match]
+        ux0, uy0, ux1, uy1 = min(x0, kx0), min(y0, ky0), max(x1, kx1), max(y1, ky1)
+        horizontal = (ux1 - ux0) >= (uy1 - uy0)
+        text_i = results.texts[i]
+        if horizontal:
+            parts = sorted([(x0, x1, text_i), (kx0, kx1, other[1])], key=lambda p: p[0])
+        else:
+            parts = sorted([(y0, y1, text_i), (ky0, ky1, other[1])], key=lambda p: p[0])
+        (s0, e0, t0), (s1, e1, t1) = parts
+        ratio = max(0.0, min(e0, e1) - s1) / max(e1 - s1, 1e-6)
+        kept[match] = [
+            np.array([[ux0, uy0], [ux1, uy0], [ux1, uy1], [ux0, uy1]], dtype=np.float32),
+            _merge_seam_text(t0, t1, ratio),
+            min(float(results.conf[i]), other[2]),
+            True,
+        ]
+        bounds[match] = (ux0, uy0, ux1, uy1)
+        # L'unione contiene il box precedente: basta aggiungere le celle nuove
+        for c in cells(ux0, uy0, ux1, uy1):
+            grid.setdefault(c, set()).add(match)
+    
+    if not kept:
+        return OcrResults()
+    return OcrResults(np.stack([k[0] for k in kept]), [k[1] for k in kept],
+                      [k[2] for k in kept])
+
+
+def _get_tile_executor(workers):
+    """Pool di thread persistente per l'OCR a tile (motori da pooled_ocr_engine)."""
+    global _tile_executor
+    from concurrent.futures import ThreadPoolExecutor
+    
+    if _tile_executor is None or _tile_executor._max_workers != workers:
+        if _tile_executor is not None:
+            _tile_executor.shutdown(wait=False)
+        _tile_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-tile")
+    return _tile_executor
+
+
+@profiled("run_ocr_tiled")
+def run_ocr_tiled(source, image_scale=1.0, progress_callback=None, tile_size=OCR_TILE_SIZE,
+                  overlap=OCR_TILE_OVERLAP, workers=OCR_TILE_WORKERS, two_stage=False,
+                  exclude_zones=()):
+    """OCR a piena risoluzione su tile sovrapposte lette dalla sorgente.
+    
+    Solo poche tile alla volta sono in memoria, indipendentemente dalle
+    dimensioni della pagina. Le coordinate restituite sono riportate nello
+    spazio di working_image tramite image_scale. Con two_stage ogni tile
+    passa per run_ocr_two_stage, con le zone escluse (frazioni della
+    pagina) riportate in pixel della tile.
+    """
+    width, height = source.size
+    zones = zones_to_boxes(exclude_zones, width, height)
+    tiles = _tile_grid(width, height, tile_size, overlap)
+    total = len(tiles)
+    # Con un solo worker le tile vengono elaborate nel thread chiamante
+    executor = _get_tile_executor(workers) if workers > 1 else None
+    
+    if progress_callback:
+        progress_callback(5, f"OCR a tile: {total} tile...")
+    
+    parts = []       # (OcrResults in coordinate sorgente, maschera tagliati) per tile
+    pending = {}
+    done = 0
+    remaining = iter(tiles)
+    
+    def collect(future):
+        nonlocal done
+        x, y, tw, th = pending.pop(future)
+        res = future.result()
+        bb = res.bbox
+        # Box che toccano un bordo interno della tile: probabilmente tagliati
+        cut = (
+            ((x > 0) & (bb[:, 0] <= 2)) |
+            ((y > 0) & (bb[:, 1] <= 2)) |
+            ((x + tw < width) & (bb[:, 2] >= tw - 2)) |
+            ((y + th < height) & (bb[:, 3] >= th - 2))
+        )
+        parts.append((res.translated(x, y), cut))
+        done += 1
+        if progress_callback:
+            progress_callback(5 + int(85 * done / total), f"OCR tile {done}/{total}...")
+    
+    from concurrent.futures import Future, wait, FIRST_COMPLETED
+    
+    # Le tile vengono lette in questo thread (la sorgente non è thread-safe)
+    # e riconosciute nel pool, con un numero limitato di tile in volo
+    for x, y in remaining:
+        tw, th = min(tile_size, width - x), min(tile_size, height - y)
+        tile = source.read_region((x, y, x + tw, y + th))
+        tile_zones = [(zx0 - x, zy0 - y, zx1 - x, zy1 - y) for zx0, zy0, zx1, zy1 in zones]
+        if executor is None:
+            future = Future()
+            future.set_result(_ocr_tile(tile, two_stage, tile_zones))
+            pending[future] = (x, y, tw, th)
+            collect(future)
+            continue
+        pending[executor.submit(_ocr_tile, tile, two_stage, tile_zones, True)] = (x, y, tw, th)
+        del tile
+        while len(pending) >= 2 * workers:
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in finished:
+                collect(future)
+    while pending:
+        finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in finished:
+            collect(future)
+    
+    if progress_callback:
+        progress_callback(92, "Unione box sulle giunture...")
+    
+    candidates = OcrResults.concatenate([res for res, _ in parts])
+    cut = np.concatenate([c for _, c in parts]) if parts else np.zeros(0, dtype=bool)
+    results = _merge_tile_results(candidates, cut)
+    
+    # Riporta le coordinate nello spazio di working_image
+    if image_scale != 1.0:
+        results = results.scaled(image_scale)
+    
+    log.debug(f"OCR a tile: {total} tile, {len(candidates)} box -> {len(results)} dopo unione")
+    
+    if progress_callback:
+        progress_callback(100, "Completato!")
+    
+    return results
+
+
+@profiled("ocr_region")
+def run_ocr_region(source, image_scale, box, progress_callback=None):
+    """OCR della sola regione box (coordinate di working_image) a piena risoluzione.
+    
+    source e image_scale sono quelli dell'OCR a tile (pixel sorgente ->
+    working_image). Le regioni piccole vengono ingrandite prima dell'OCR
+    per leggere meglio i testi minuti; quelle grandi passano per le tile.
+    Le coordinate restituite sono in working_image.
+    """
+    x0, y0, x1, y1 = box
+    width, height = source.size
+    sx0, sy0 = max(0, int(x0 / image_scale)), max(0, int(y0 / image_scale))
+    sx1, sy1 = min(width, int(np.ceil(x1 / image_scale))), min(height, int(np.ceil(y1 / image_scale)))
+    if sx1 <= sx0 or sy1 <= sy0:
+        return OcrResults()
+    
+    upscale = min(OCR_REGION_MAX_UPSCALE, max(1.0, OCR_REGION_MIN_SIDE / max(sx1 - sx0, sy1 - sy0)))
+    region = RegionSource(source, (sx0, sy0, sx1, sy1), upscale)
+    # Un solo worker: le tile passano per run_ocr (servizio locale o motore già
+    # caricato, sotto _ocr_lock) senza caricare altri motori
+    results = run_ocr_tiled(region, 1.0, progress_callback, workers=1)
+    log.debug(f"OCR regione {sx1 - sx0}x{sy1 - sy0} (x{upscale:.2f}): {len(results)} testi")
+    return results.scaled(image_scale / upscale).translated(sx0 * image_scale, sy0 * image_scale)
+
+
+def merge_region_results(results, region_results, box, edge=2.0):
+    """Sostituisce in results i testi della regione box con quelli riletti.
+    
+    Vengono tolti i box vecchi con il centro dentro la regione. Dei nuovi si
+    scartano quelli che toccano il bordo della regione e si sovrappongono a
+    un box vecchio rimasto: sono testi tagliati dalla selezione, già letti
+    per intero dalla scansione della pagina.
+    """
+    x0, y0, x1, y1 = box
+    c = results.centers
+    inside = (c[:, 0] >= x0) & (c[:, 0] < x1) & (c[:, 1] >= y0) & (c[:, 1] < y1)
+    kept = results.select(~inside)
+    
+    bb = region_results.bbox
+    cut = ((bb[:, 0] <= x0 + edge) | (bb[:, 1] <= y0 + edge) |
+           (bb[:, 2] >= x1 - edge) | (bb[:, 3] >= y1 - edge))
+    if cut.any() and len(kept):
+        kb = kept.bbox
+        for i in np.flatnonzero(cut).tolist():
+            bx0, by0, bx1, by1 = bb[i].tolist()
+            iw = np.minimum(kb[:, 2], bx1) - np.maximum(kb[:, 0], bx0)
+            ih = np.minimum(kb[:, 3], by1) - np.maximum(kb[:, 1], by0)
+            cut[i] = bool(((iw > 0) & (ih > 0)).any())
+    else:
+        cut[:] = False
+    
+    added = region_results.select(~cut)
+    return OcrResults.concatenate([kept, added]), int(inside.sum()), len(added)
+
+
+# ============ OCR IN DUE FASI ============
+#
+# Il rilevamento del testo gira una volta sull'intera immagine; il
+# riconoscimento, che è la parte costosa, solo sui box che possono essere
+# quote. Cartigli, note e distinte base vengono scartati prima con
+# caratteristiche geometriche e di densità dell'inchiostro, senza leggerli.
+
+_two_stage_models = None
+
+def get_two_stage_models():
+    """Modelli PaddleOCR di rilevamento e riconoscimento separati (caricati al primo uso)."""
+    global _two_stage_models
+    if _two_stage_models is None:
+        with _engine_lock:
+            if _two_stage_models is None:
+                with profiler.span("ocr_engine_load"):
+                    from paddleocr import TextDetection, TextRecognition
+                    _two_stage_models = (TextDetection(**OCR_DET_SETTINGS),
+                                         TextRecognition(**OCR_REC_SETTINGS))
+    return _two_stage_models
+
+
+def zones_to_boxes(zones, width, height):
+    """Zone escluse (x0, y0, x1, y1 in frazioni della pagina) -> box in pixel."""
+    return [(x0 * width, y0 * height, x1 * width, y1 * height) for x0, y0, x1, y1 in zones]
+
+
+def _two_stage_variant(exclude_boxes=()):
+    """Parte della chiave della cache OCR per i risultati in due fasi."""
+    return repr(("due_fasi", sorted(OCR_DET_SETTINGS.items()), sorted(OCR_REC_SETTINGS.items()),
+                 OCR_CANDIDATE_MAX_CHARS, OCR_TABLE_MIN_ROWS,
+                 [tuple(round(float(v), 1) for v in b) for b in exclude_boxes]))
+
+
+@profiled("ocr_detection")
+def detect_text(pixels):
+    """Rilevamento del testo: quadrilateri (N, 4, 2) e punteggi (N,)."""
+    detector, _ = get_two_stage_models()
+    with _ocr_lock:
+        raw = list(detector.predict(pixels))
+    if not raw:
+        return np.zeros((0, 4, 2), np.float32), np.zeros(0, np.float32)
+    polys = raw[0].get("dt_polys")
+    if polys is None or len(polys) == 0:
+        return np.zeros((0, 4, 2), np.float32), np.zeros(0, np.float32)
+    try:
+        quads = np.asarray(polys, dtype=np.float32).reshape(len(polys), 4, 2)
+    except ValueError:
+        quads = np.stack([OcrResults.as_quad(p) for p in polys])
+    scores = raw[0].get("dt_scores")
+    scores = (np.zeros(len(quads), np.float32) if scores is None
+              else np.asarray(scores, dtype=np.float32).reshape(len(quads)))
+    return quads, scores
+
+
+def _ink_integral(pixels):
+    """Immagine integrale dei pixel scuri, per la densità d'inchiostro di un box in O(1)."""
+    if pixels.ndim == 3:
+        # np.minimum tra i canali: molto più veloce di min(axis=2) su un asse di 3
+        pixels = np.minimum(np.minimum(pixels[..., 0], pixels[..., 1]), pixels[..., 2])
+    dark = pixels < 128
+    integral = np.zeros((dark.shape[0] + 1, dark.shape[1] + 1), np.int32)
+    np.cumsum(np.cumsum(dark, axis=0, dtype=np.int32), axis=1, out=integral[1:, 1:])
+    return integral
+
+
+@profiled("ocr_candidates")
+def text_candidates(polys, integral, exclude_boxes=(), max_chars=OCR_CANDIDATE_MAX_CHARS,
+                    table_rows=OCR_TABLE_MIN_ROWS):
+    """Sceglie e ordina i box rilevati che possono essere quote.
+    
+    Vengono scartati i box con il centro in una zona esclusa, i testi troppo
+    lunghi (note), molto più alti della media (titoli), minuscoli, vuoti o
+    pieni d'inchiostro (tratteggi, campiture). I rimanenti sono ordinati dal
+    più probabile: altezza tipica, pochi caratteri, non allineati in colonna
+    con molti altri box uguali (tabelle).
+    
+    Ritorna (indici ordinati, conteggio degli scarti per motivo).
+    """
+    n = len(polys)
+    if n == 0:
+        return np.zeros(0, np.intp), {}
+    p = polys.astype(np.float32)
+    w = (np.linalg.norm(p[:, 1] - p[:, 0], axis=1) + np.linalg.norm(p[:, 2] - p[:, 3], axis=1)) / 2
+    h = (np.linalg.norm(p[:, 3] - p[:, 0], axis=1) + np.linalg.norm(p[:, 2] - p[:, 1], axis=1)) / 2
+    long_side, short_side = np.maximum(w, h), np.maximum(np.minimum(w, h), 1.0)
+    # Un carattere è largo circa metà dell'altezza del box rilevato
+    chars = 2.0 * long_side / short_side
+    typical = float(np.median(short_side))
+    
+    x0, y0 = p[:, :, 0].min(axis=1), p[:, :, 1].min(axis=1)
+    x1, y1 = p[:, :, 0].max(axis=1), p[:, :, 1].max(axis=1)
+    rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+    ix0 = np.clip(x0, 0, cols).astype(np.intp)
+    iy0 = np.clip(y0, 0, rows).astype(np.intp)
+    ix1 = np.clip(np.ceil(x1), 0, cols).astype(np.intp)
+    iy1 = np.clip(np.ceil(y1), 0, rows).astype(np.intp)
+    area = np.maximum((ix1 - ix0) * (iy1 - iy0), 1)
+    ink = (integral[iy1, ix1] - integral[iy0, ix1] - integral[iy1, ix0] + integral[iy0, ix0]) / area
+    
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    excluded = np.zeros(n, dtype=bool)
+    for bx0, by0, bx1, by1 in exclude_boxes:
+        excluded |= (cx >= bx0) & (cx < bx1) & (cy >= by0) & (cy < by1)
+    
+    # Ogni box scartato è contato una volta sola, per il primo motivo
+    reasons = {
+        "zona esclusa": excluded,
+        "nota": chars > max_chars,
+        "titolo": (n >= 5) & (short_side > 3 * typical),
+        "minuscolo": short_side < 5,
+        "vuoto": ink < 0.01,
+        "campitura": ink > 0.6,
+    }
+    drop = np.zeros(n, dtype=bool)
+    for name, mask in reasons.items():
+        reasons[name] = mask & ~drop
+        drop |= mask
+    keep = np.flatnonzero(~drop)
+    stats = {name: int(mask.sum()) for name, mask in reasons.items()}
+    if len(keep) == 0:
+        stats["tabella"] = 0
+        return keep, stats
+    
+    # Colonne di tabella: stesso bordo sinistro e stessa altezza (raggruppamento, O(N log N))
+    column = np.round(x0[keep] / (0.5 * typical)).astype(np.int64)
+    height_class = np.round(np.log(short_side[keep]) / 0.2).astype(np.int64)
+    _, inverse, counts = np.unique(np.stack([column, height_class], axis=1), axis=0,
+                                   return_inverse=True, return_counts=True)
+    in_table = counts[inverse.reshape(-1)] >= table_rows
+    
+    score = (-np.abs(np.log(short_side[keep] / typical)) - chars[keep] / max_chars
+             - in_table.astype(np.float32))
+    order = keep[np.argsort(-score, kind="stable")]
+    stats["tabella"] = int(in_table.sum())
+    return order, stats
+
+
+def _text_crops(image, quad):
+    """Ritaglio raddrizzato di un box; per i testi verticali entrambi i versi di lettura."""
+    tl, tr, br, bl = quad
+    w = max(1, int(round(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl)))))
+    h = max(1, int(round(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr)))))
+    crop = image.transform((w, h), Image.QUAD, data=(*tl, *bl, *br, *tr), resample=Image.BICUBIC)
+    if h >= 1.5 * w:
+        return [crop.transpose(Image.ROTATE_270), crop.transpose(Image.ROTATE_90)]
+    return [crop]
+
+
+@profiled("ocr_two_stage")
+def run_ocr_two_stage(image, progress_callback=None, exclude_boxes=(), max_candidates=None,
+                      stats=None):
+    """OCR in due fasi: rilevamento completo, riconoscimento dei soli candidati quota.
+    
+    image come per run_ocr (PIL o array BGR). exclude_boxes sono zone in
+    pixel dell'immagine da non leggere (es. il cartiglio); max_candidates
+    limita il riconoscimento ai candidati più probabili. Se stats è un
+    dizionario viene riempito con i conteggi delle fasi.
+    """
+    pixels = to_ocr_array(image) if isinstance(image, Image.Image) else image
+    
+    if not _two_stage_models and progress_callback:
+        progress_callback(None, "Caricamento modelli OCR...")
+    _, recognizer = get_two_stage_models()
+    
+    if progress_callback:
+        progress_callback(None, "Rilevamento testo...")
+    polys, _ = detect_text(pixels)
+    
+    order, reasons = text_candidates(polys, _ink_integral(pixels), exclude_boxes)
+    if max_candidates is not None:
+        order = order[:max_candidates]
+    
+    # Ritagli di tutti i candidati, riconosciuti a lotti in una sola chiamata
+    source = Image.fromarray(np.ascontiguousarray(pixels))
+    crops, owners = [], []
+    for k, i in enumerate(order.tolist()):
+        for crop in _text_crops(source, polys[i]):
+            crops.append(np.asarray(crop))
+            owners.append(k)
+    if progress_callback:
+        progress_callback(50, f"Riconoscimento di {len(order)} candidati su {len(polys)}...")
+    
+    texts = [""] * len(order)
+    conf = np.full(len(order), -1.0, np.float32)
+    if crops:
+        with profiler.span("ocr_recognition"), _ocr_lock:
+            raw = list(recognizer.predict(crops, batch_size=OCR_REC_BATCH))
+        for k, res in zip(owners, raw):
+            score = float(res.get("rec_score") or 0.0)
+            # Testi verticali: vince il verso di lettura più sicuro
+            if score > conf[k]:
+                texts[k], conf[k] = str(res.get("rec_text") or ""), score
+    
+    found = [k for k, text in enumerate(texts) if text.strip()]
+    results = OcrResults(polys[order[found]], [texts[k] for k in found], conf[found])
+    log.debug(f"OCR in due fasi: {len(polys)} box rilevati, {len(order)} candidati, "
+              f"{len(results)} testi (scartati: {reasons})")
+    if stats is not None:
+        stats.update(regioni=len(polys), candidati=len(order), testi=len(results), **reasons)
+    
+    if progress_callback:
+        progress_callback(100, "Completato!")
+    return results
+
+
+# ============ SERVIZIO OCR ============
+#
+# Protocollo: ogni messaggio è MAGIC, lunghezza dell'intestazione JSON,
+# intestazione e un payload binario di "size" byte. Le richieste "ocr"
+# inviano i pixel BGR grezzi, la risposta contiene i risultati nello stesso
+# formato della cache OCR.
+
+_OCR_SERVER_MAGIC = b"POS1"
+_server_retry_at = 0.0
+_server_down = False          # Irraggiungibile già segnalato (una volta per interruzione)
+
+
+def _parse_address(value):
+    host, _, port = value.rpartition(":")
+    return host or OCR_SERVER_ADDRESS[0], int(port)
+
+
+def ocr_server_address():
+    """Indirizzo del servizio OCR locale, o None se non richiesto."""
+    value = os.environ.get("PALLINATORE_OCR_SERVER", "").strip()
+    if value.lower() in ("", "0", "off", "no"):
+        return None
+    if value.lower() in ("1", "on", "si", "sì", "yes"):
+        return OCR_SERVER_ADDRESS
+    return _parse_address(value)
+
+
+def _send_message(sock, header, payload=b""):
+    import json
+    import struct
+    
+    header = json.dumps(dict(header, size=len(payload))).encode("utf-8")
+    sock.sendall(_OCR_SERVER_MAGIC + struct.pack("<I", len(header)) + header)
+    if len(payload):
+        sock.sendall(payload)
+
+
+def _recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    pos = 0
+    while pos < size:
+        n = sock.recv_into(view[pos:])
+        if n == 0:
+            raise ConnectionError("connessione chiusa")
+        pos += n
+    return buffer
+
+
+def _recv_message(sock, max_size=None):
+    import json
+    import struct
+    
+    head = _recv_exact(sock, 8)
+    if head[:4] != _OCR_SERVER_MAGIC:
+        raise ConnectionError("protocollo non riconosciuto")
+    (length,) = struct.unpack("<I", head[4:])
+    header = json.loads(_recv_exact(sock, length).decode("utf-8"))
+    size = int(header.get("size", 0))
+    if max_size is not None and size > max_size:
+        raise ValueError(f"messaggio troppo grande ({size} byte)")
+    return header, _recv_exact(sock, size)
+
+
+def _server_call(header, payload=b"", timeout=None):
+    """Una richiesta al servizio; None se non raggiungibile (riprova più tardi)."""
+    import socket
+    
+    global _server_retry_at, _server_down
+    address = ocr_server_address()
+    if address is None or time.monotonic() < _server_retry_at:
+        return None
+    try:
+        with socket.create_connection(address, timeout=OCR_SERVER_CONNECT_TIMEOUT) as sock:
+            sock.settimeout(timeout)
+            _send_message(sock, header, payload)
+            reply, data = _recv_message(sock)
+    except (OSError, ValueError) as e:
+        _server_retry_at = time.monotonic() + OCR_SERVER_RETRY
+        if not _server_down:
+            _server_down = True
+            log.warning(f"Servizio OCR non disponibile su {address[0]}:{address[1]}: {e}")
+        return None
+    _server_down = False
+    if not reply.get("ok"):
+        log.error(f"Servizio OCR: {reply.get('error')}")
+        return None
+    return reply, data
+
+
+def ocr_server_available():
+    """True se il servizio OCR locale risponde con le stesse impostazioni."""
+    reply = _server_call({"op": "ping", "settings": OCR_ENGINE_SETTINGS}, timeout=2.0)
+    return reply is not None
+
+
+@profiled("ocr_server")
+def ocr_server_request(image):
+    """OCR di un array BGR tramite il servizio locale.
+    
+    Ritorna OcrResults, oppure None se il servizio non è attivo o non ha
+    risposto: il chiamante esegue allora l'OCR nel proprio processo.
+    """
+    if ocr_server_address() is None:
+        return None
+    # Il servizio accetta solo BGR a 3 canali
+    if image.ndim == 2:
+        image = np.repeat(image[:, :, None], 3, axis=2)
+    elif image.ndim == 3 and image.shape[2] == 4:
+        image = image[:, :, :3]
+    elif image.ndim != 3 or image.shape[2] != 3:
+        return None
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    header = {"op": "ocr", "settings": OCR_ENGINE_SETTINGS, "shape": list(image.shape)}
+    reply = _server_call(header, memoryview(image).cast("B"), OCR_SERVER_TIMEOUT)
+    if reply is None:
+        return None
+    try:
+        return OcrCache._decode(bytes(reply[1]))
+    except ValueError as e:
+        log.error(f"Servizio OCR: risposta non valida: {e}")
+        return None
+
+
+class StubOcrBackend:
+    """Motore finto per provare il servizio senza modelli.
+    
+    Restituisce un solo box attorno ai pixel scuri, con le dimensioni
+    dell'immagine come testo.
+    """
+    
+    def ocr(self, images):
+        pages = []
+        for image in images:
+            ink = np.asarray(image).min(axis=2) < 128
+            rows, cols = np.flatnonzero(ink.any(axis=1)), np.flatnonzero(ink.any(axis=0))
+            if len(rows) == 0:
+                pages.append({"rec_polys": [], "rec_texts": [], "rec_scores": []})
+                continue
+            x0, x1, y0, y1 = cols[0], cols[-1] + 1, rows[0], rows[-1] + 1
+            pages.append({
+                "rec_polys": [np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]])],
+                "rec_texts": [f"{ink.shape[1]}x{ink.shape[0]}"],
+                "rec_scores": [1.0],
+            })
+        return pages
+
+
+class OcrServer:
+    """Servizio OCR locale: un solo motore in memoria per tutti i client.
+    
+    Ogni connessione è gestita in un proprio thread; le immagini vengono
+    accodate e un unico thread le passa al motore a gruppi (fino a
+    batch_size, attendendo al massimo batch_wait secondi), perché i
+    predittori di PaddleOCR non sono thread-safe.
+    """
+    
+    def __init__(self, address=OCR_SERVER_ADDRESS, backend=None,
+                 batch_size=OCR_SERVER_BATCH, batch_wait=OCR_SERVER_BATCH_WAIT):
+        import socketserver
+        
+        self.backend = backend
+        self.backend_name = "paddleocr" if backend is None else type(backend).__name__
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.requests = queue.Queue()
+        self.served = 0
+        
+        server = self
+        
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    server._handle(self.request)
+                except (OSError, ValueError) as e:
+                    log.warning(f"Servizio OCR: connessione interrotta: {e}")
+        
+        class TCPServer(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+        
+        self._tcp = TCPServer(address, Handler)
+        self.address = self._tcp.server_address
+        self._engine_thread = None
+    
+    def _handle(self, sock):
+        header, payload = _recv_message(sock, OCR_SERVER_MAX_PIXELS * 3)
+        if header.get("settings") != OCR_ENGINE_SETTINGS:
+            _send_message(sock, {"ok": False, "error": "impostazioni del motore diverse"})
+            return
+        if header.get("op") == "ping":
+            _send_message(sock, {"ok": True, "backend": self.backend_name,
+                                 "pending": self.requests.qsize(), "served": self.served})
+            return
+        if header.get("op") != "ocr":
+            _send_message(sock, {"ok": False, "error": f"operazione sconosciuta: {header.get('op')}"})
+            return
+        
+        from concurrent.futures import Future
+        
+        shape = tuple(header["shape"])
+        if len(shape) != 3 or shape[2] != 3 or int(np.prod(shape)) != len(payload):
+            _send_message(sock, {"ok": False, "error": "dimensioni dell'immagine non valide"})
+            return
+        future = Future()
+        self.requests.put((np.frombuffer(payload, np.uint8).reshape(shape), future))
+        try:
+            results = future.result()
+        except Exception as e:
+            _send_message(sock, {"ok": False, "error": str(e)})
+            return
+        _send_message(sock, {"ok": True}, OcrCache._encode(results))
+    
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                item = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self.requests.put(None)
+                break
+            batch.append(item)
+        return batch
+    
+    def _engine_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                raw = self.backend.ocr([image for image, _ in batch])
+                for (_, future), page in zip(batch, raw):
+                    future.set_result(_parse_ocr_result(page))
+            except Exception as e:
+                log.error(f"Servizio OCR: errore del motore: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("OCR non riuscito sul servizio"))
+            self.served += len(batch)
+            log.debug(f"Servizio OCR: {len(batch)} immagini in "
+                      f"{time.perf_counter() - start:.2f}s")
+    
+    def start(self):
+        """Carica il motore e avvia i thread; ritorna subito."""
+        if self.backend is None:
+            self.backend = get_ocr_engine()
+        self._engine_thread = threading.Thread(target=self._engine_loop, name="ocr-server",
+                                               daemon=True)
+        self._engine_thread.start()
+        threading.Thread(target=self._tcp.serve_forever, name="ocr-server-tcp",
+                         daemon=True).start()
+    
+    def serve_forever(self):
+        self.start()
+        host, port = self.address
+        print(f"Servizio OCR ({self.backend_name}) in ascolto su {host}:{port}")
+        if isinstance(self.backend, StubOcrBackend):
+            print("Motore finto: i client ricevono risultati fittizi "
+                  "(avviarli con PALLINATORE_OCR_CACHE=off)")
+        try:
+            while self._engine_thread.is_alive():
+                self._engine_thread.join(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+    
+    def shutdown(self):
+        self._tcp.shutdown()
+        self._tcp.server_close()
+        self.requests.put(None)
+
+
+@profiled("pdf_to_image")
+def pdf_to_image(pdf_path, dpi=PDF_DPI, page=0):
+    """Converte una pagina del PDF in immagine."""
+    try:
+        import fitz
+        doc = fitz.open(pdf_path)
+        pdf_page = doc[page]
+        mat = fitz.Matrix(dpi/72, dpi/72)
+        pix = pdf_page.get_pixmap(matrix=mat)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        doc.close()
+        return img
+    except ImportError:
+        from pdf2image import convert_from_path
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=page+1, last_page=page+1)
+        return images[0] if images else None
+
+
+def page_count(path):
+    """Numero di pagine di un PDF (o di frame di un TIFF multipagina)."""
+    if path.lower().endswith(".pdf"):
+        try:
+            import fitz
+            with fitz.open(path) as doc:
+                return doc.page_count
+        except ImportError:
+            from pdf2image import pdfinfo_from_path
+            return int(pdfinfo_from_path(path)["Pages"])
+    with Image.open(path) as img:
+        return getattr(img, "n_frames", 1)
+
+
+# Grammatica delle quote: un'unica espressione compilata con le alternative
+# nello stesso ordine di priorità dei singoli pattern (1-7) usati in passato
+_QUOTA_NUM = r"([\d.,]+)"
+_QUOTA_RE = re.compile(
+    r"^(?:"
+    rf"(?P<iso>{_QUOTA_NUM}\s*([A-Za-z]\d+))"                              # 20H7, 20 h6
+    rf"|(?P<sym>{_QUOTA_NUM}\s*[±]\s*{_QUOTA_NUM})"                        # 20±0.1
+    rf"|(?P<plus_minus>{_QUOTA_NUM}\s*\+\s*{_QUOTA_NUM}\s*[-–]\s*{_QUOTA_NUM})"  # 20+0.1-0.2
+    rf"|(?P<minus_plus>{_QUOTA_NUM}\s*[-–]\s*{_QUOTA_NUM}\s*\+\s*{_QUOTA_NUM})"  # 20-0.2+0.1
+    rf"|(?P<stacked>{_QUOTA_NUM}\s+{_QUOTA_NUM}\s+{_QUOTA_NUM})"          # 20 0.1 0.2
+    rf"|(?P<plus>{_QUOTA_NUM}\s*\+\s*{_QUOTA_NUM})"                        # 20+0.1
+    rf"|(?P<minus>{_QUOTA_NUM}\s*[-–]\s*{_QUOTA_NUM})"                     # 20-0.1
+    r")\s*$"
+)
+_QUOTA_SYMBOL_RE = re.compile(r"^([⌀RMSsGg])\s*")
+_QUOTA_SPACED_RE = re.compile(r"(\d)\s*[.,]\s*(\d)")
+_QUOTA_DOTTED_RE = re.compile(r"^([\d.]+)\s*$")
+_QUOTA_PLAIN_RE = re.compile(r"^([\d.,]+)\s*$")
+_QUOTA_FIELDS = ("simbolo", "nominale", "tol_plus", "tol_minus", "classe")
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_quota_fields(text):
+    """Campi di parse_quota come tupla (memorizzata: le quote si ripetono)."""
+    original = text
+    text = text.strip()
+    
+    # Normalizza simboli diametro
+    text = text.replace("Ø", "⌀").replace("ø", "⌀").replace("O/", "⌀").replace("0/", "⌀")
+    
+    simbolo = nominale = tol_plus = tol_minus = classe = ""
+    
+    # Estrai simbolo iniziale (⌀, R, M, S, ecc.)
+    m = _QUOTA_SYMBOL_RE.match(text)
+    if m:
+        simbolo = m.group(1).upper()
+        text = text[m.end():].strip()
+    
+    m = _QUOTA_RE.match(text)
+    if m:
+        kind = m.lastgroup
+        # Gruppi dell'alternativa riconosciuta (quelli delle altre sono None)
+        parts = [g for g in m.groups()[m.lastindex:] if g is not None]
+        nominale = parts[0].replace(",", ".")
+        if kind == "iso":
+            classe = parts[1]
+        else:
+            tols = [t.replace(",", ".") for t in parts[1:]]
+            if kind == "sym":
+                tol_plus, tol_minus = f"+{tols[0]}", f"-{tols[0]}"
+            elif kind in ("plus_minus", "stacked"):
+                # stacked: assume prima positiva, seconda negativa
+                tol_plus, tol_minus = f"+{tols[0]}", f"-{tols[1]}"
+            elif kind == "minus_plus":
+                tol_minus, tol_plus = f"-{tols[0]}", f"+{tols[1]}"
+            elif kind == "plus":
+                tol_plus = f"+{tols[0]}"
+            else:
+                tol_minus = f"-{tols[0]}"
+        return simbolo, nominale, tol_plus, tol_minus, classe
+    
+    # Numero con spazi (es. "20 . 5" -> "20.5")
+    m = _QUOTA_DOTTED_RE.match(_QUOTA_SPACED_RE.sub(r"\1.\2", text))
+    if m:
+        return simbolo, m.group(1), "", "", ""
+    
+    # Solo numero
+    m = _QUOTA_PLAIN_RE.match(text)
+    if m:
+        return simbolo, m.group(1).replace(",", "."), "", "", ""
+    
+    # Fallback: tutto come nominale
+    return simbolo, original.strip(), "", "", ""
+
+
+def parse_quota(text):
+    """Analizza una stringa di quota e estrae i componenti."""
+    return dict(zip(_QUOTA_FIELDS, _parse_quota_fields(text)))
+
+
+def parse_quota_many(texts):
+    """Analizza una sequenza di quote (export): i testi ripetuti non vengono rianalizzati."""
+    return [dict(zip(_QUOTA_FIELDS, _parse_quota_fields(t))) for t in texts]
+
+
+def working_mode(mode):
+    """Modo dell'immagine di lavoro: 1 bit e scala di grigi restano "L", il resto RGB."""
+    return "L" if mode in ("1", "L") else "RGB"
+
+
+def _resize_in_bands(img, size, mode, band_rows=256):
+    """Ridimensiona img (LANCZOS) convertendola a mode una banda alla volta.
+    
+    Ogni banda di uscita legge dalla sorgente solo le righe che le servono,
+    più il supporto del filtro: non si crea mai una copia convertita
+    dell'intera pagina (un A0 a 1 bit triplicato in RGB occupa gigabyte).
+    Il box in virgola mobile dà lo stesso risultato di un passo unico.
+    """
+    if img.mode == mode:
+        return img.resize(size, Image.LANCZOS)
+    
+    width, height = img.size
+    out_w, out_h = size
+    ratio = height / out_h
+    margin = int(3 * ratio) + 2   # Supporto LANCZOS (3 lobi) alla scala di riduzione
+    result = Image.new(mode, size)
+    for oy0 in range(0, out_h, band_rows):
+        oy1 = min(out_h, oy0 + band_rows)
+        sy0, sy1 = oy0 * ratio, oy1 * ratio
+        cy0, cy1 = max(0, int(sy0) - margin), min(height, int(sy1) + 1 + margin)
+        band = img.crop((0, cy0, width, cy1)).convert(mode)
+        result.paste(band.resize((out_w, oy1 - oy0), Image.LANCZOS,
+                                 box=(0, sy0 - cy0, width, sy1 - cy0)), (0, oy0))
+    return result
+
+
+@profiled("load_drawing")
+def load_drawing(path, max_size=DISPLAY_MAX_SIZE, status_callback=None, page=0):
+    """Carica una pagina di un disegno e la riduce per il lavoro.
+    
+    I disegni a 1 bit e in scala di grigi restano in scala di grigi invece
+    di essere triplicati in RGB. I JPEG vengono decodificati già ridotti
+    (scala DCT 1/2, 1/4, 1/8) quando il codec lo permette. La risoluzione
+    piena resta su disco: PageSource la rilegge a regioni solo quando serve.
+    
+    Ritorna (working_image, original_size, image_scale).
+    """
+    if path.lower().endswith(".pdf"):
+        if status_callback:
+            status_callback("Conversione PDF...")
+        try:
+            return _load_pdf_page(path, page, max_size)
+        except ImportError:
+            # Senza PyMuPDF: rasterizzazione a PDF_DPI e riduzione come le immagini
+            img = pdf_to_image(path, page=page)
+    else:
+        img = Image.open(path)
+        if page:
+            img.seek(page)
+    
+    # Salva dimensioni originali (lette dall'intestazione, prima di decodificare)
+    original_size = img.size
+    orig_w, orig_h = img.size
+    mode = working_mode(img.mode)
+    
+    # Calcola se serve ridimensionamento per il display
+    max_dim = max(orig_w, orig_h)
+    if max_dim > max_size:
+        image_scale = max_size / max_dim
+        new_w = int(orig_w * image_scale)
+        new_h = int(orig_h * image_scale)
+        
+        if status_callback:
+            status_callback(f"Ridimensionamento {orig_w}x{orig_h} → {new_w}x{new_h}...")
+        
+        if img.format == "JPEG":
+            # Il decoder scala di potenze di 2 restando >= alla dimensione richiesta
+            img.draft(mode, (new_w, new_h))
+        with profiler.span("decode"):
+            img.load()
+        with profiler.span("resize_lanczos"):
+            working_image = _resize_in_bands(img, (new_w, new_h), mode)
+        
+        # Libera immagine originale
+        del img
+        
+        log.debug(f"Immagine grande ridimensionata: {orig_w}x{orig_h} -> {new_w}x{new_h}")
+        log.debug(f"Fattore scala display: {image_scale:.4f}")
+    else:
+        with profiler.span("decode"):
+            working_image = img if img.mode == mode else img.convert(mode)
+            working_image.load()
+        image_scale = 1.0
+    
+    return working_image, original_size, image_scale
+
+
+@profiled("load_pdf_page")
+def _load_pdf_page(path, page, max_size):
+    """Pagina PDF renderizzata direttamente alla risoluzione di lavoro.
+    
+    Invece di rasterizzare a PDF_DPI e poi ridurre, il fattore di scala
+    entra nella matrice di rendering: nessuna bitmap intermedia e testi
+    vettoriali nitidi anche sulle tavole grandi.
+    """
+    import fitz
+    with fitz.open(path) as doc:
+        pdf_page = doc[page]
+        original_size = PageSource.pdf_page_size(pdf_page, PDF_DPI)
+        image_scale = min(1.0, max_size / max(original_size))
+        zoom = PDF_DPI / 72 * image_scale
+        with profiler.span("decode"):
+            pix = pdf_page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    working_image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    if image_scale < 1.0:
+        log.debug(f"PDF renderizzato a {PDF_DPI * image_scale:.1f} dpi: "
+                  f"{original_size[0]}x{original_size[1]} -> {pix.width}x{pix.height}")
+    return working_image, original_size, image_scale
+
+
+class PdfPageView:
+    """Regioni di una pagina PDF renderizzate dal vettoriale a qualsiasi zoom.
+    
+    Usata dalla vista quando lo zoom supera la risoluzione dell'immagine di
+    lavoro: si renderizza solo la parte visibile invece di ingrandire la
+    bitmap. Il documento resta aperto e la pagina viene interpretata una
+    volta sola (display list).
+    """
+    
+    def __init__(self, path, page, pixels_per_point):
+        import fitz
+        self._doc = fitz.open(path)
+        self._dlist = self._doc[page].get_displaylist()
+        # Pixel di working_image per punto PDF
+        self.pixels_per_point = pixels_per_point
+    
+    def render(self, zoom, box):
+        """Regione box (coordinate display al fattore zoom) come immagine PIL."""
+        import fitz
+        x0, y0, x1, y1 = box
+        k = zoom * self.pixels_per_point
+        clip = fitz.Rect(x0 / k, y0 / k, x1 / k, y1 / k)
+        with profiler.span("render_pdf_clip"):
+            pix = self._dlist.get_pixmap(matrix=fitz.Matrix(k, k), clip=clip, alpha=False)
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        # Arrotondamenti del clip: riporta alla dimensione richiesta
+        if img.size != (x1 - x0, y1 - y0):
+            img = img.resize((x1 - x0, y1 - y0), Image.BILINEAR)
+        return img
+    
+    def close(self):
+        if self._doc is not None:
+            self._dlist = None
+            self._doc.close()
+            self._doc = None
+
+
+# Layout delle pagine raster decodificate su disco: modo PIL -> (modo delle regioni, rawmode, byte/pixel)
+RASTER_LAYOUTS = {
+    "1": ("L", "L", 1),
+    "L": ("L", "L", 1),
+    "P": ("L", "L", 1),
+    "RGB": ("RGB", "RGBX", 4),
+    "RGBA": ("RGBA", "RGBA", 4),
+    "CMYK": ("CMYK", "CMYK", 4),
+}
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _decode_page_to_file(path, page, tmp_path):
+    """Decodifica una pagina raster nel file tmp_path (righe contigue, layout RASTER_LAYOUTS).
+    
+    Il decoder scrive direttamente nel file mappato in memoria invece di
+    allocare la pagina. Ritorna la palette delle immagini in modo P.
+    """
+    img = Image.open(path)
+    try:
+        if page:
+            img.seek(page)
+        mode, rawmode, channels = RASTER_LAYOUTS[img.mode]
+        width, height = img.size
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        target = np.memmap(tmp_path, dtype=np.uint8, mode="w+", shape=shape)
+        core = Image.frombuffer(mode, (width, height), target, "raw", rawmode, 0, 1).im
+        img.im = core
+        img.load()
+        if img.im is not core:
+            # TIFF non compressi: PIL mappa già il file, si copiano le righe a blocchi
+            band_mode = "RGBA" if mode == "RGB" else mode
+            for y in range(0, height, EXPORT_BAND_HEIGHT):
+                band = img.crop((0, y, width, min(height, y + EXPORT_BAND_HEIGHT)))
+                # In modo P si copiano gli indici della palette, senza conversione
+                if band.mode != "P":
+                    band = band.convert(band_mode)
+                target[y:y + band.height] = np.asarray(band)
+        palette = img.getpalette() if img.mode == "P" else None
+    finally:
+        # close() rilascia anche il buffer mappato usato dal decoder
+        img.close()
+    target.flush()
+    del target
+    return palette
+
+
+class PageSource:
+    """Pagina alla risoluzione originale, letta a regioni quando serve.
+    
+    I decoder di PIL (JPEG, PNG, TIFF compressi in un'unica striscia) leggono
+    l'immagine come un flusso unico: non si può decodificare solo un
+    riquadro. Alla prima regione raster la pagina viene decodificata una
+    volta in un file temporaneo, nel suo modo nativo; le regioni vengono poi
+    lette da lì riga per riga. In memoria resta solo la regione richiesta.
+    """
+    
+    def __init__(self, path, page=0, pdf_dpi=PDF_DPI):
+        self.path = path
+        self.page = page
+        self.pdf_dpi = pdf_dpi
+        self.is_pdf = path.lower().endswith(".pdf")
+        self._file = None       # pagina decodificata su disco (file temporaneo)
+        self._layout = None
+        self._palette = None
+        self._finalizer = None
+        self._doc = None
+        self._dlist = None
+        if self.is_pdf:
+            import fitz
+            with fitz.open(path) as doc:
+                self.size = self.pdf_page_size(doc[page], pdf_dpi)
+        else:
+            with Image.open(path) as img:
+                if page:
+                    img.seek(page)
+                self.size = img.size
+    
+    @staticmethod
+    def pdf_page_size(pdf_page, dpi):
+        """Dimensioni in pixel della pagina a dpi (stesso arrotondamento della pixmap)."""
+        import fitz
+        irect = (pdf_page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+        return (irect.width, irect.height)
+    
+    def read_region(self, box):
+        """Ritorna la regione (x0, y0, x1, y1) in pixel originali."""
+        if self.is_pdf:
+            import fitz
+            x0, y0, x1, y1 = box
+            zoom = self.pdf_dpi / 72
+            if self._dlist is None:
+                # Pagina interpretata una volta sola per tutte le regioni
+                self._doc = fitz.open(self.path)
+                self._dlist = self._doc[self.page].get_displaylist()
+            clip = fitz.Rect(x0 / zoom, y0 / zoom, x1 / zoom, y1 / zoom)
+            pix = self._dlist.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            # Arrotondamenti del clip: riporta alla dimensione richiesta
+            if img.size != (x1 - x0, y1 - y0):
+                img = img.resize((x1 - x0, y1 - y0), Image.BILINEAR)
+            return img
+        
+        if self._file is None and not self._decode_to_disk():
+            # Modo senza layout su disco (16 bit, float...): decodifica senza trattenere la pagina
+            with Image.open(self.path) as img:
+                if self.page:
+                    img.seek(self.page)
+                return img.crop(box)
+        
+        x0, y0, x1, y1 = box
+        mode, rawmode, channels = self._layout
+        width, height = self.size
+        region = np.zeros((y1 - y0, x1 - x0, channels), dtype=np.uint8)
+        # Parte della regione dentro la pagina (fuori resta nera, come Image.crop)
+        cx0, cx1 = max(0, x0), min(width, x1)
+        cy0, cy1 = max(0, y0), min(height, y1)
+        row_bytes = width * channels
+        if cx0 < cx1 and cy0 < cy1:
+            # Letture dal file invece di una mappatura: in memoria resta solo la regione
+            if x0 == 0 and x1 == width:
+                self._file.seek(cy0 * row_bytes)
+                self._file.readinto(region[cy0 - y0:cy1 - y0, :width])
+            else:
+                for y in range(cy0, cy1):
+                    self._file.seek(y * row_bytes + cx0 * channels)
+                    self._file.readinto(region[y - y0, cx0 - x0:cx1 - x0])
+        # Mantiene il modo nativo (1 bit come scala di grigi 0/255) senza triplicarlo in RGB
+        img = Image.frombytes(mode, (x1 - x0, y1 - y0), region, "raw", rawmode)
+        if self._palette is not None:
+            img.putpalette(self._palette)
+        return img
+    
+    def _decode_to_disk(self):
+        """Decodifica la pagina nel file temporaneo; False se il modo non è gestito."""
+        import tempfile
+        import weakref
+        
+        with Image.open(self.path) as img:
+            if self.page:
+                img.seek(self.page)
+            layout = RASTER_LAYOUTS.get(img.mode)
+        if layout is None:
+            return False
+        
+        fd, tmp_path = tempfile.mkstemp(prefix="pallinatore_", suffix=".raw")
+        os.close(fd)
+        self._finalizer = weakref.finalize(self, _remove_file, tmp_path)
+        
+        width, height = self.size
+        with profiler.span("decode_to_disk"):
+            if width * height * layout[2] > RASTER_DECODE_PROCESS_BYTES:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Le pagine grandi in un processo a parte: il picco della decodifica
+                # non resta nella memoria dell'applicazione. spawn perché qui ci sono
+                # thread attivi (Tk, OCR) e fork non è sicuro.
+                with ProcessPoolExecutor(max_workers=1,
+                                         mp_context=multiprocessing.get_context("spawn")) as executor:
+                    palette = executor.submit(_decode_page_to_file, self.path, self.page,
+                                              tmp_path).result()
+            else:
+                palette = _decode_page_to_file(self.path, self.page, tmp_path)
+        
+        self._palette = palette
+        self._layout = layout
+        self._file = open(tmp_path, "rb")
+        return True
+    
+    def close(self):
+        if self._file is not None:
+            # Su Windows il file si può cancellare solo dopo averlo chiuso
+            self._file.close()
+            self._file = None
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        if self._doc is not None:
+            self._dlist = None
+            self._doc.close()
+            self._doc = None
+
+
+class RegionSource:
+    """Regione di una sorgente vista come sorgente a sé, eventualmente ingrandita.
+    
+    Ha la stessa interfaccia di PageSource (size, read_region, close), così
+    run_ocr_tiled può lavorare su una sola parte della pagina.
+    """
+    
+    def __init__(self, source, box, upscale=1.0):
+        self.source = source
+        self.box = box
+        self.upscale = upscale
+        x0, y0, x1, y1 = box
+        self.size = (max(1, int(round((x1 - x0) * upscale))), max(1, int(round((y1 - y0) * upscale))))
+    
+    def read_region(self, box):
+        x0, y0, x1, y1 = box
+        ox, oy, ox1, oy1 = self.box
+        k = self.upscale
+        inner = (ox + int(x0 / k), oy + int(y0 / k),
+                 min(ox1, ox + int(np.ceil(x1 / k))), min(oy1, oy + int(np.ceil(y1 / k))))
+        img = self.source.read_region(inner)
+        if img.size != (x1 - x0, y1 - y0):
+            img = img.resize((x1 - x0, y1 - y0), Image.BICUBIC)
+        return img
+    
+    def close(self):
+        pass
+
+
+class DrawingDocument:
+    """Documento aperto: elenco di pagine rasterizzate solo quando servono."""
+    
+    # Pagine ridotte tenute in memoria (le altre vengono rigenerate)
+    CACHE_PAGES = 3
+    
+    def __init__(self, path, max_size=DISPLAY_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.page_count = page_count(path)
+        self._cache = {}   # pagina -> (working_image, original_size, image_scale)
+    
+    @property
+    def is_pdf(self):
+        return self.path.lower().endswith(".pdf")
+    
+    def source(self, index):
+        """Sorgente a piena risoluzione della pagina (per OCR a tile ed export)."""
+        return PageSource(self.path, index)
+    
+    def ocr_source(self, index, image_scale):
+        """Sorgente per l'OCR a tile e fattore verso le coordinate di working_image.
+        
+        I PDF vengono letti a PDF_OCR_DPI direttamente dal vettoriale: più
+        pixel per carattere senza alcun costo di memoria (una tile alla volta).
+        """
+        if not self.is_pdf:
+            return self.source(index), image_scale
+        source = PageSource(self.path, index, PDF_OCR_DPI)
+        return source, image_scale * PDF_DPI / PDF_OCR_DPI
+    
+    def page_view(self, index, image_scale):
+        """Vista vettoriale per lo zoom oltre il 100% (None per le immagini)."""
+        if not self.is_pdf:
+            return None
+        try:
+            return PdfPageView(self.path, index, PDF_DPI / 72 * image_scale)
+        except ImportError:
+            return None
+    
+    def page_scale(self, source):
+        """image_scale della pagina ridotta, senza rasterizzarla."""
+        return min(1.0, self.max_size / max(source.size))
+    
+    def page_image_scale(self, index):
+        """image_scale della pagina index, letto dall'intestazione."""
+        return self.page_geometry(index)[1]
+    
+    def page_geometry(self, index):
+        """(original_size, image_scale) della pagina index, senza rasterizzarla."""
+        if index in self._cache:
+            return self._cache[index][1:]
+        source = self.source(index)
+        try:
+            return source.size, self.page_scale(source)
+        finally:
+            source.close()
+    
+    def get_page(self, index, status_callback=None):
+        """Ritorna la pagina ridotta, rasterizzandola se non è in cache."""
+        page = self._cache.pop(index, None)
+        if page is None:
+            page = load_drawing(self.path, self.max_size, status_callback, index)
+        self._remember(index, page)
+        return page
+    
+    def _remember(self, index, page):
+        self._cache.pop(index, None)
+        self._cache[index] = page
+        while len(self._cache) > self.CACHE_PAGES:
+            del self._cache[next(iter(self._cache))]
+    
+    def iter_pages(self, indices=None, workers=None):
+        """Rasterizza le pagine in parallelo restituendole in ordine.
+        
+        Le pagine successive vengono preparate mentre il chiamante elabora
+        quella corrente (es. OCR della pagina N+1 mentre si rasterizza la N+2).
+        Genera tuple (indice, working_image, original_size, image_scale).
+        
+        Il pool parte al primo next(), nel thread del chiamante: dall'app va
+        consumato dentro il task in background, mai dal thread di Tk.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        
+        indices = list(range(self.page_count)) if indices is None else list(indices)
+        if not indices:
+            return
+        if workers is None:
+            workers = min(os.cpu_count() or 1, len(indices))
+        
+        # Con un solo worker basta un thread: l'OCR rilascia il GIL. spawn perché
+        # nel processo dell'app ci sono thread attivi (Tk, OCR) e fork non è sicuro.
+        if workers > 1:
+            executor = ProcessPoolExecutor(max_workers=workers,
+                                           mp_context=multiprocessing.get_context("spawn"))
+        else:
+            executor = ThreadPoolExecutor(max_workers=1)
+        
+        # Limita le pagine in volo per non tenere tutto il documento in memoria
+        ahead = workers + 1
+        with executor:
+            pending = {}
+            upcoming = iter(indices)
+            for index in upcoming:
+                pending[index] = executor.submit(load_drawing, self.path, self.max_size, None, index)
+                if len(pending) >= ahead:
+                    break
+            for index in indices:
+                page = pending.pop(index).result()
+                nxt = next(upcoming, None)
+                if nxt is not None:
+                    pending[nxt] = executor.submit(load_drawing, self.path, self.max_size, None, nxt)
+                self._remember(index, page)
+                yield (index,) + page
+
+
+@profiled("ocr_drawing")
+def ocr_drawing(working_image, progress_callback=None, max_size=OCR_MAX_SIZE, two_stage=False,
+                exclude_zones=()):
+    """Esegue OCR sull'immagine di lavoro.
+    
+    Con two_stage vengono riconosciuti solo i candidati quota (vedi
+    run_ocr_two_stage); exclude_zones sono frazioni della pagina.
+    Le coordinate restituite sono relative a working_image.
+    """
+    work_w, work_h = working_image.size
+    
+    # Calcola se serve ulteriore ridimensionamento per OCR
+    max_dim = max(work_w, work_h)
+    if max_dim > max_size:
+        ocr_scale = max_size / max_dim
+        new_w = int(work_w * ocr_scale)
+        new_h = int(work_h * ocr_scale)
+        needs_resize = True
+    else:
+        ocr_scale = 1.0
+        new_w, new_h = work_w, work_h
+        needs_resize = False
+    
+    # Immagine effettivamente inviata all'OCR, passata in memoria al motore
+    if needs_resize:
+        if progress_callback:
+            progress_callback(2, "Preparazione immagine per OCR...")
+        with profiler.span("resize_lanczos"):
+            ocr_image = working_image.resize((new_w, new_h), Image.LANCZOS)
+        log.debug(f"Immagine OCR: {new_w}x{new_h}")
+    else:
+        ocr_image = working_image
+    pixels = to_ocr_array(ocr_image)
+    del ocr_image
+    
+    exclude_boxes = zones_to_boxes(exclude_zones, new_w, new_h) if two_stage else ()
+    
+    def compute():
+        if progress_callback:
+            progress_callback(5, "Avvio OCR...")
+        if two_stage:
+            return run_ocr_two_stage(pixels, progress_callback, exclude_boxes)
+        return run_ocr(pixels, progress_callback)
+    
+    # Con la cache un disegno già letto non passa più da PaddleOCR
+    variant = _two_stage_variant(exclude_boxes) if two_stage else ""
+    results = cached_ocr(pixels, compute, ocr_scale, variant)
+    
+    if progress_callback:
+        progress_callback(100, "Completato!")
+    
+    # IMPORTANTE: riscala le coordinate
+    # Le coordinate OCR sono relative all'immagine OCR
+    # Dobbiamo riportarle alle coordinate dell'immagine WORKING (non originale!)
+    # perché il display usa working_image
+    if ocr_scale != 1.0:
+        inv_scale = 1.0 / ocr_scale
+        results = results.scaled(inv_scale)
+        log.debug(f"Coordinate riscalate: {inv_scale:.4f}x")
+    
+    return results
+
+
+def _coverage_integral(cover):
+    """Immagine integrale (float64) di una mappa di copertura per celle."""
+    integral = np.zeros((cover.shape[0] + 1, cover.shape[1] + 1))
+    np.cumsum(np.cumsum(cover, axis=0, dtype=np.float64), axis=1, out=integral[1:, 1:])
+    return integral
+
+
+def _coverage(integral, cell, xs, ys, r):
+    """Frazione coperta del quadrato di lato 2r attorno a ogni punto (vettoriale)."""
+    rows, cols = integral.shape[0] - 1, integral.shape[1] - 1
+    # Solo le celle interamente dentro il quadrato: il box del proprio testo,
+    # a distanza PALLINO_PLACE_GAP, non conta per arrotondamento
+    cx0 = np.clip(np.ceil((xs - r) / cell), 0, cols).astype(np.intp)
+    cy0 = np.clip(np.ceil((ys - r) / cell), 0, rows).astype(np.intp)
+    cx1 = np.clip(np.floor((xs + r) / cell), 0, cols).astype(np.intp)
+    cy1 = np.clip(np.floor((ys + r) / cell), 0, rows).astype(np.intp)
+    cx1, cy1 = np.maximum(cx1, cx0), np.maximum(cy1, cy0)
+    total = integral[cy1, cx1] - integral[cy0, cx1] - integral[cy1, cx0] + integral[cy0, cx0]
+    return total / np.maximum((cx1 - cx0) * (cy1 - cy0), 1)
+
+
+@profiled("auto_place_pallini")
+def auto_place_pallini(ocr_results, image=None, radius=PALLINO_PLACE_RADIUS):
+    """Calcola le posizioni dei pallini per i testi che contengono cifre.
+    
+    Per ogni testo si valutano alcune posizioni attorno al box: a sinistra
+    (la preferita, come in passato), a destra, sopra, sotto, in diagonale e
+    più lontano. Il costo di una posizione somma la preferenza, la parte di
+    pallino che copre altri testi e l'inchiostro del disegno sotto di esso
+    (da una mappa ridotta di image, se data), calcolati per tutte le
+    posizioni insieme con immagini integrali. I testi vengono poi assegnati
+    in modo greedy, dai più vincolati, scartando le posizioni a contatto con
+    pallini già piazzati (SpatialGrid): O(N log N) in tutto.
+    
+    Ritorna una lista di tuple (x, y, testo), nell'ordine dei testi.
+    """
+    idx = np.flatnonzero(ocr_results.has_digit)
+    if len(idx) == 0:
+        return []
+    r, gap, cell = float(radius), PALLINO_PLACE_GAP, PALLINO_INK_CELL
+    
+    x0, y0, x1, y1 = ocr_results.bbox[idx].astype(np.float64).T
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    near, far = r + gap, 3 * r + 2 * gap
+    corner = near / np.sqrt(2)
+    candidates = [
+        (x0 - near, cy, 0),                        # sinistra (posizione storica)
+        (x1 + near, cy, 3),                        # destra
+        (cx, y0 - near, 5), (cx, y1 + near, 5),    # sopra, sotto
+        (x0 - corner, y0 - corner, 6), (x0 - corner, y1 + corner, 6),
+        (x1 + corner, y0 - corner, 7), (x1 + corner, y1 + corner, 7),
+        (x0 - far, cy, 15), (x1 + far, cy, 17),    # secondo anello
+        (cx, y0 - far, 19), (cx, y1 + far, 19),
+    ]
+    xs = np.stack([c[0] for c in candidates], axis=1)
+    ys = np.stack([c[1] for c in candidates], axis=1)
+    preference = np.array([c[2] for c in candidates], dtype=np.float64)
+    
+    # Mappe per celle: testi (tutti i box OCR) e inchiostro del disegno
+    if image is not None:
+        width, height = image.size
+        gray = image if image.mode == "L" else image.convert("L")
+        ink = 1.0 - np.asarray(gray.reduce(cell), dtype=np.float32) / 255.0
+    else:
+        width = float(ocr_results.bbox[:, 2].max()) + far + r
+        height = float(ocr_results.bbox[:, 3].max()) + far + r
+        ink = None
+    xs = np.clip(xs, r, max(r, width - r))
+    ys = np.clip(ys, r, max(r, height - r))
+    
+    rows, cols = int(np.ceil(height / cell)), int(np.ceil(width / cell))
+    text_cover = np.zeros((rows, cols), np.uint8)
+    for bx0, by0, bx1, by1 in (ocr_results.bbox / cell).tolist():
+        text_cover[max(0, int(by0)):max(0, int(np.ceil(by1))),
+                   max(0, int(bx0)):max(0, int(np.ceil(bx1)))] = 1
+    
+    # Una linea di 1 pixel che attraversa il pallino (~3% d'inchiostro) pesa
+    # più che spostarlo sopra o sotto il testo
+    cost = preference + 200.0 * _coverage(_coverage_integral(text_cover), cell, xs, ys, r)
+    if ink is not None:
+        cost += 250.0 * _coverage(_coverage_integral(ink), cell, xs, ys, r)
+    
+    # Prima i testi con meno posizioni libere; a parità, in ordine di lettura
+    order_in_box = np.argsort(cost, axis=1, kind="stable")
+    free = ((cost - preference) < 1.0).sum(axis=1)
+    sequence = np.lexsort((cx, cy, free))
+    
+    grid = SpatialGrid(cell=2 * r + gap)
+    min_dist = 2 * r + gap
+    placed = [None] * len(idx)
+    xs_l, ys_l, order_l = xs.tolist(), ys.tolist(), order_in_box.tolist()
+    for n in sequence.tolist():
+        for k in order_l[n]:
+            x, y = xs_l[n][k], ys_l[n][k]
+            if grid.nearest(x, y, min_dist) is None:
+                break
+        else:
+            # Nessuna posizione libera: quella più lontana dai pallini vicini
+            def clearance(k):
+                x, y = xs_l[n][k], ys_l[n][k]
+                other = grid.nearest(x, y, 2 * min_dist)
+                if other is None:
+                    return 2 * min_dist
+                ox, oy = placed[other]
+                return ((ox - x) ** 2 + (oy - y) ** 2) ** 0.5
+            k = max(order_l[n], key=clearance)
+            x, y = xs_l[n][k], ys_l[n][k]
+        placed[n] = (x, y)
+        grid.insert(n, x, y)
+    
+    texts = ocr_results.texts
+    return [(x, y, texts[i].strip()) for i, (x, y) in zip(idx.tolist(), placed)]
+
+
+def _pallino_style(scale=1.0):
+    """Raggio, spessore del bordo, font e scostamento del testo dei pallini.
+    
+    scale > 1 per disegnare su immagini più grandi di working_image.
+    """
+    from PIL import ImageFont
+    
+    size = max(1, int(round(16 * scale)))
+    # Cerca un font, fallback a default
+    try:
+        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", size)
+    except:
+        try:
+            font = ImageFont.truetype("arial.ttf", size)
+        except:
+            font = ImageFont.load_default()
+    return int(round(15 * scale)), max(1, int(round(3 * scale))), font, int(round(2 * scale))
+
+
+def _draw_pallino_mark(draw, x, y, text, style):
+    """Disegna un pallino (cerchio bianco, bordo e numero rossi) centrato in x, y."""
+    r, width, font, dy = style
+    
+    # Cerchio bianco con bordo rosso
+    draw.ellipse([x-r, y-r, x+r, y+r], fill="white", outline="red", width=width)
+    
+    # Numero centrato
+    bbox = draw.textbbox((0, 0), text, font=font)
+    tw = bbox[2] - bbox[0]
+    th = bbox[3] - bbox[1]
+    draw.text((x - tw//2, y - th//2 - dy), text, fill="red", font=font)
+
+
+def draw_pallini(image, pallini):
+    """Crea una copia dell'immagine con i pallini disegnati sopra."""
+    from PIL import ImageDraw
+    
+    # Copia l'immagine di lavoro (in RGB: i pallini sono rossi anche sui disegni in grigio)
+    img = image.convert("RGB") if image.mode != "RGB" else image.copy()
+    draw = ImageDraw.Draw(img)
+    
+    style = _pallino_style()
+    for p in pallini:
+        _draw_pallino_mark(draw, int(p["x"]), int(p["y"]), str(p["id"]), style)
+    
+    return img
+
+
+def _png_scanlines(band, width):
+    """Righe RGB di una banda nel formato PNG: ognuna preceduta dal tipo di filtro (0)."""
+    if band.mode != "RGB":
+        band = band.convert("RGB")
+    arr = np.asarray(band)
+    if arr.shape[1] != width:
+        raise ValueError(f"banda larga {arr.shape[1]} px invece di {width}")
+    rows = np.zeros((arr.shape[0], width * 3 + 1), dtype=np.uint8)
+    rows[:, 1:] = arr.reshape(arr.shape[0], -1)
+    return rows.tobytes()
+
+
+class PngStreamWriter:
+    """Scrive un PNG RGB una banda di righe alla volta.
+    
+    L'immagine completa non esiste mai in memoria: ogni banda viene
+    compressa e scritta in blocchi IDAT appena ricevuta.
+    """
+    
+    def __init__(self, fp, size, level=6):
+        import zlib
+        
+        self._fp = fp
+        self.width, self.height = size
+        self._rows = 0
+        self._z = zlib.compressobj(level)
+        fp.write(b"\x89PNG\r\n\x1a\n")
+        # 8 bit per canale, RGB, nessun interlacciamento
+        self._chunk(b"IHDR", self._pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0))
+    
+    @staticmethod
+    def _pack(fmt, *values):
+        import struct
+        return struct.pack(fmt, *values)
+    
+    def _chunk(self, tag, data):
+        import zlib
+        
+        self._fp.write(self._pack(">I", len(data)) + tag)
+        self._fp.write(data)
+        self._fp.write(self._pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF))
+    
+    def write(self, band):
+        """Aggiunge le righe di una banda (immagine PIL larga quanto il PNG)."""
+        data = self._z.compress(_png_scanlines(band, self.width))
+        if data:
+            self._chunk(b"IDAT", data)
+        self._rows += band.height
+    
+    def close(self):
+        if self._rows != self.height:
+            raise ValueError(f"scritte {self._rows} righe su {self.height}")
+        self._chunk(b"IDAT", self._z.flush())
+        self._chunk(b"IEND", b"")
+
+
+class TiffStreamWriter:
+    """Scrive un TIFF RGB (Deflate, una striscia per banda) una banda alla volta.
+    
+    Le strisce vengono compresse e scritte appena ricevute; la directory
+    (IFD) con le loro posizioni va in fondo al file e l'intestazione viene
+    aggiornata alla chiusura. Tutte le bande tranne l'ultima devono essere
+    alte rows_per_strip righe.
+    """
+    
+    def __init__(self, fp, size, rows_per_strip=EXPORT_BAND_HEIGHT, level=6):
+        self._fp = fp
+        self.width, self.height = size
+        self.rows_per_strip = rows_per_strip
+        self._level = level
+        self._rows = 0
+        self._offsets = []
+        self._counts = []
+        self._start = fp.tell()
+        # Little endian; l'offset della IFD (ancora ignoto) viene scritto da close()
+        fp.write(b"II*\x00\x00\x00\x00\x00")
+        self._pos = 8
+    
+    def _write(self, data):
+        self._fp.write(data)
+        self._pos += len(data)
+        if self._pos > 0xFFFFFFFF:
+            raise ValueError("TIFF oltre 4 GB: usa PNG")
+    
+    def write(self, band):
+        """Aggiunge una banda (immagine PIL larga quanto il TIFF) come striscia."""
+        import zlib
+        
+        if self._rows % self.rows_per_strip or self._rows >= self.height:
+            raise ValueError(f"banda dopo l'ultima striscia (righe {self._rows})")
+        if band.height != min(self.rows_per_strip, self.height - self._rows):
+            raise ValueError(f"banda alta {band.height} righe invece di {self.rows_per_strip}")
+        if band.mode != "RGB":
+            band = band.convert("RGB")
+        if band.width != self.width:
+            raise ValueError(f"banda larga {band.width} px invece di {self.width}")
+        data = zlib.compress(band.tobytes(), self._level)
+        self._offsets.append(self._pos)
+        self._counts.append(len(data))
+        self._write(data)
+        self._rows += band.height
+    
+    def close(self):
+        import struct
+        
+        if self._rows != self.height:
+            raise ValueError(f"scritte {self._rows} righe su {self.height}")
+        if self._pos % 2:
+            self._write(b"\x00")
+        n = len(self._offsets)
+        ifd = self._pos
+        entries = 10
+        extra = ifd + 2 + 12 * entries + 4   # Valori che non stanno nei 4 byte della voce
+        values = b""
+        
+        def array(fmt, items):
+            nonlocal values
+            if len(items) * struct.calcsize(fmt) <= 4:
+                return struct.pack("<" + fmt * len(items), *items).ljust(4, b"\x00")
+            offset = extra + len(values)
+            values += struct.pack("<" + fmt * len(items), *items)
+            return struct.pack("<I", offset)
+        
+        SHORT, LONG = 3, 4
+        tags = [
+            (256, LONG, 1, array("I", [self.width])),
+            (257, LONG, 1, array("I", [self.height])),
+            (258, SHORT, 3, array("H", [8, 8, 8])),         # BitsPerSample
+            (259, SHORT, 1, array("H", [8])),               # Compression: Deflate
+            (262, SHORT, 1, array("H", [2])),               # Photometric: RGB
+            (273, LONG, n, array("I", self._offsets)),      # StripOffsets
+            (277, SHORT, 1, array("H", [3])),               # SamplesPerPixel
+            (278, LONG, 1, array("I", [self.rows_per_strip])),
+            (279, LONG, n, array("I", self._counts)),       # StripByteCounts
+            (284, SHORT, 1, array("H", [1])),               # PlanarConfiguration
+        ]
+        self._write(struct.pack("<H", entries))
+        for tag, kind, count, value in tags:
+            self._write(struct.pack("<HHI", tag, kind, count) + value)
+        self._write(struct.pack("<I", 0))
+        self._write(values)
+        end = self._fp.tell()
+        self._fp.seek(self._start + 4)
+        self._fp.write(struct.pack("<I", ifd))
+        self._fp.seek(end)
+
+
+class RasterPdfWriter:
+    """PDF di sole immagini (una per pagina) scritto in streaming.
+    
+    Lo stream dell'immagine contiene le stesse righe del PNG compresse con
+    zlib: il filtro FlateDecode con predittore PNG le legge così come sono,
+    quindi ogni pagina viene scritta banda per banda senza ricomprimerla.
+    """
+    
+    def __init__(self, fp):
+        self._fp = fp
+        self._pos = 0
+        self._offsets = {}
+        self._pages = []
+        self._next = 3           # 1 = catalogo, 2 = albero delle pagine
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    
+    def _write(self, data):
+        self._fp.write(data)
+        self._pos += len(data)
+    
+    def _alloc(self):
+        self._next += 1
+        return self._next - 1
+    
+    def _obj(self, num, body):
+        self._offsets[num] = self._pos
+        self._write(b"%d 0 obj\n%s\nendobj\n" % (num, body))
+    
+    def add_page(self, bands, image_size, page_size, level=6):
+        """Aggiunge una pagina di page_size punti con l'immagine data a bande."""
+        import zlib
+        
+        w, h = image_size
+        pw, ph = page_size
+        image, length, content, page = (self._alloc() for _ in range(4))
+        
+        self._offsets[image] = self._pos
+        self._write(b"%d 0 obj\n<< /Type /XObject /Subtype /Image /Width %d /Height %d "
+                    b"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode "
+                    b"/DecodeParms << /Predictor 15 /Colors 3 /BitsPerComponent 8 /Columns %d >> "
+                    b"/Length %d 0 R >>\nstream\n" % (image, w, h, w, length))
+        z = zlib.compressobj(level)
+        size = rows = 0
+        for band in bands:
+            data = z.compress(_png_scanlines(band, w))
+            self._write(data)
+            size += len(data)
+            rows += band.height
+        data = z.flush()
+        self._write(data)
+        size += len(data)
+        self._write(b"\nendstream\nendobj\n")
+        if rows != h:
+            raise ValueError(f"scritte {rows} righe su {h}")
+        self._obj(length, b"%d" % size)
+        
+        ops = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (pw, ph)
+        self._obj(content, b"<< /Length %d >>\nstream\n%s\nendstream" % (len(ops), ops))
+        self._obj(page, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                        b"/Resources << /XObject << /Im0 %d 0 R >> >> /Contents %d 0 R >>"
+                  % (pw, ph, image, content))
+        self._pages.append(page)
+    
+    def close(self):
+        kids = b" ".join(b"%d 0 R" % p for p in self._pages)
+        self._obj(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+        self._obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref = self._pos
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next)
+        for num in range(1, self._next):
+            self._write(b"%010d 00000 n \n" % self._offsets[num])
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (self._next, xref))
 
-def get_ocr_engine():
-    global _ocr_engine
-    if _ocr_engine is None:
-        from paddleocr import PaddleOCR
-        _ocr_engine = PaddleOCR(lang="en")
-    return _ocr_engine
+
+def render_pallinated_bands(source, pallini, image_scale=1.0, band_height=EXPORT_BAND_HEIGHT,
+                            progress_callback=None):
+    """Genera (y0, banda RGB) della pagina a piena risoluzione con i pallini.
+    
+    I pallini sono in coordinate di working_image: posizione, raggio e font
+    vengono riportati alla risoluzione della sorgente con 1 / image_scale.
+    In memoria c'è una sola banda alla volta.
+    """
+    import bisect
+    from PIL import ImageDraw
+    
+    f = 1.0 / image_scale
+    style = _pallino_style(f)
+    r, width_px, font, _ = style
+    reach = r + width_px + getattr(font, "size", 16)
+    
+    # Pallini in coordinate sorgente, ordinati per y per trovare quelli di ogni banda
+    marks = sorted((int(p["y"] * f), k, int(p["x"] * f), str(p["id"]))
+                   for k, p in enumerate(pallini))
+    ys = [m[0] for m in marks]
+    
+    width, height = source.size
+    for y0 in range(0, height, band_height):
+        y1 = min(height, y0 + band_height)
+        band = source.read_region((0, y0, width, y1))
+        if band.mode != "RGB":
+            band = band.convert("RGB")
+        
+        lo = bisect.bisect_left(ys, y0 - reach)
+        hi = bisect.bisect_right(ys, y1 + reach)
+        if lo < hi:
+            draw = ImageDraw.Draw(band)
+            # Stesso ordine di disegno dell'elenco: conta dove i pallini si sovrappongono
+            for y, _, x, text in sorted(marks[lo:hi], key=lambda m: m[1]):
+                _draw_pallino_mark(draw, x, y - y0, text, style)
+        
+        if progress_callback:
+            progress_callback(int(100 * y1 / height), f"Esportazione righe {y1}/{height}...")
+        yield y0, band
+
+
+def _write_png_stream(fp, source, pallini, image_scale, progress_callback=None):
+    writer = PngStreamWriter(fp, source.size)
+    for _, band in render_pallinated_bands(source, pallini, image_scale,
+                                           progress_callback=progress_callback):
+        writer.write(band)
+    writer.close()
+
+
+def _write_tiff_stream(fp, source, pallini, image_scale, progress_callback=None):
+    writer = TiffStreamWriter(fp, source.size)
+    for _, band in render_pallinated_bands(source, pallini, image_scale,
+                                           progress_callback=progress_callback):
+        writer.write(band)
+    writer.close()
 
 
-def run_ocr(image_path, progress_callback=None):
-    """Esegue OCR su un'immagine."""
-    ocr = get_ocr_engine()
+class ReducedSource:
+    """Vista ridotta (LANCZOS) di una PageSource, letta a regioni come l'originale.
     
-    with Image.open(image_path) as img:
-        orig_w, orig_h = img.size
+    Ogni regione legge dalla sorgente solo le righe che le servono più il
+    supporto del filtro, come _resize_in_bands.
+    """
     
+    def __init__(self, source, size):
+        self.source = source
+        self.size = size
+        self._ratio = (source.size[0] / size[0], source.size[1] / size[1])
+    
+    def read_region(self, box):
+        x0, y0, x1, y1 = box
+        rx, ry = self._ratio
+        width, height = self.source.size
+        sx0, sy0, sx1, sy1 = x0 * rx, y0 * ry, x1 * rx, y1 * ry
+        margin = int(3 * max(rx, ry)) + 2   # Supporto LANCZOS alla scala di riduzione
+        cx0, cy0 = max(0, int(sx0) - margin), max(0, int(sy0) - margin)
+        cx1, cy1 = min(width, int(sx1) + 1 + margin), min(height, int(sy1) + 1 + margin)
+        region = self.source.read_region((cx0, cy0, cx1, cy1))
+        if region.mode not in ("L", "RGB"):
+            region = region.convert("RGB")
+        return region.resize((x1 - x0, y1 - y0), Image.LANCZOS,
+                             box=(sx0 - cx0, sy0 - cy0, sx1 - cx0, sy1 - cy0))
+
+
+@profiled("export_image")
+def export_pallinated_image(source, pallini, image_scale, path, progress_callback=None):
+    """Salva la pagina pallinata alla risoluzione originale della sorgente.
+    
+    PNG e TIFF vengono scritti a bande con memoria limitata, qualunque sia
+    il formato del foglio. Gli altri formati (JPEG, BMP) richiedono a PIL
+    l'immagine intera: oltre EXPORT_IMAGE_MAX_PIXELS vengono ridotti, con
+    un avviso. Ritorna le dimensioni dell'immagine scritta.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    tmp = path + ".tmp"
+    try:
+        if ext == ".png":
+            with open(tmp, "wb") as fp:
+                _write_png_stream(fp, source, pallini, image_scale, progress_callback)
+            size = source.size
+        elif ext in (".tif", ".tiff"):
+            with open(tmp, "wb") as fp:
+                _write_tiff_stream(fp, source, pallini, image_scale, progress_callback)
+            size = source.size
+        else:
+            fmt = Image.registered_extensions().get(ext)
+            if fmt is None:
+                raise ValueError(f"Formato immagine non supportato: {ext}")
+            width, height = source.size
+            reduction = min(1.0, (EXPORT_IMAGE_MAX_PIXELS / (width * height)) ** 0.5)
+            if reduction < 1.0:
+                size = (max(1, int(width * reduction)), max(1, int(height * reduction)))
+                log.warning(f"{fmt}: {width}x{height} ridotta a {size[0]}x{size[1]} "
+                            f"(piena risoluzione solo in PNG o TIFF)")
+                source, image_scale = ReducedSource(source, size), image_scale / reduction
+            size = source.size
+            img = Image.new("RGB", size, "white")
+            for y0, band in render_pallinated_bands(source, pallini, image_scale,
+                                                    progress_callback=progress_callback):
+                img.paste(band, (0, y0))
+            img.save(tmp, fmt)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return size
+
+
+@profiled("export_pdf_vector")
+def export_annotated_pdf(document, pallini, path, progress_callback=None):
+    """PDF pallinato di un PDF sorgente: pallini vettoriali sulle pagine originali.
+    
+    Il contenuto delle pagine resta intatto; i pallini sono cerchi e testo
+    (Helvetica Bold, font standard non incorporato) aggiunti sopra. Le
+    coordinate di working_image diventano punti PDF tramite image_scale e
+    i dpi di rasterizzazione, poi passano nello spazio non ruotato della
+    pagina; il testo viene ruotato con la pagina per restare dritto.
+    """
+    import fitz
+    
+    doc = fitz.open(document.path)
+    tmp = path + ".tmp"
+    try:
+        total = len(doc)
+        for index, page in enumerate(doc):
+            if progress_callback:
+                progress_callback(int(100 * index / total), f"Pagina {index + 1}/{total}...")
+            page_pallini = [p for p in pallini if p.get("page", 0) == index]
+            if not page_pallini:
+                continue
+            
+            source = document.source(index)
+            # Pixel di working_image -> punti PDF (pagina ruotata, come la vede l'utente)
+            f = 72.0 / source.pdf_dpi / document.page_scale(source)
+            source.close()
+            r, width, fontsize = 15 * f, 3 * f, 16 * f
+            derotate = page.derotation_matrix
+            
+            if not page.is_wrapped:
+                page.wrap_contents()
+            shape = page.new_shape()
+            for p in page_pallini:
+                shape.draw_circle(fitz.Point(p["x"] * f, p["y"] * f) * derotate, r)
+                shape.finish(color=(1, 0, 0), fill=(1, 1, 1), width=width)
+            for p in page_pallini:
+                text = str(p["id"])
+                tw = fitz.get_text_length(text, fontname="hebo", fontsize=fontsize)
+                origin = fitz.Point(p["x"] * f - tw / 2, p["y"] * f + fontsize * 0.35) * derotate
+                shape.insert_text(origin, text, fontname="hebo", fontsize=fontsize,
+                                  color=(1, 0, 0), rotate=page.rotation)
+            shape.commit()
+        
+        doc.save(tmp, garbage=1, deflate=True)
+        os.replace(tmp, path)
+    finally:
+        doc.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
     if progress_callback:
-        progress_callback(10, "Analisi immagine...")
+        progress_callback(100, "Completato!")
+
+
+@profiled("export_pdf")
+def export_pallinated_pdf(document, pallini, path, progress_callback=None):
+    """PDF con tutte le pagine pallinate.
     
-    raw = ocr.ocr(image_path)
+    Un PDF sorgente viene annotato in forma vettoriale (export_annotated_pdf).
+    Le immagini vengono scritte alla risoluzione originale, a bande, con
+    RasterPdfWriter: in memoria c'è una sola banda alla volta. Le dimensioni
+    della pagina restano quelle dei PDF delle versioni precedenti
+    (working_image a 100 dpi).
+    """
+    if document.path.lower().endswith(".pdf"):
+        import importlib.util
+        # Senza PyMuPDF anche i PDF vengono esportati come immagini
+        if importlib.util.find_spec("fitz") is not None:
+            return export_annotated_pdf(document, pallini, path, progress_callback)
     
+    total = document.page_count
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as fp:
+            writer = RasterPdfWriter(fp)
+            for index in range(total):
+                if progress_callback:
+                    progress_callback(int(100 * index / total), f"Pagina {index + 1}/{total}...")
+                source = document.source(index)
+                try:
+                    image_scale = document.page_scale(source)
+                    w, h = source.size
+                    page_pallini = [p for p in pallini if p.get("page", 0) == index]
+                    bands = (band for _, band in
+                             render_pallinated_bands(source, page_pallini, image_scale))
+                    writer.add_page(bands, source.size,
+                                    (int(w * image_scale) * 0.72, int(h * image_scale) * 0.72))
+                finally:
+                    source.close()
+            writer.close()
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
     if progress_callback:
-        progress_callback(70, "Elaborazione risultati...")
+        progress_callback(100, "Completato!")
+
+
+# Colonne della tabella quote: (intestazione, tipo) - il tipo serve a Parquet
+QUOTE_COLUMNS = [("ID", int), ("Quota_raw", str), ("Simbolo", str), ("Nominale", str),
+                 ("Tol+", str), ("Tol-", str), ("Classe", str)]
+# Riepilogo batch: una riga per pallino di tutti i disegni
+SUMMARY_COLUMNS = [("Disegno", str), ("Pagina", int)] + QUOTE_COLUMNS + [("X", int), ("Y", int)]
+
+
+class QuoteTableWriter:
+    """Tabella delle quote scritta in streaming, con memoria limitata.
     
-    if raw is None or len(raw) == 0:
-        return []
+    Il formato segue l'estensione: .xlsx (openpyxl in modalità write-only),
+    .csv (separatore ";", UTF-8 con BOM per Excel) o .parquet (pyarrow,
+    a blocchi). Per l'xlsx le larghezze delle colonne vanno fissate prima
+    delle righe: vengono stimate sulle prime WIDTH_SAMPLE righe, tenute in
+    memoria solo fino a quel momento.
+    """
     
-    results = []
-    res_obj = raw[0]
+    WIDTH_SAMPLE = 1000
+    PARQUET_CHUNK = 50000
     
-    try:
-        polys = res_obj.get('rec_polys') or res_obj.get('dt_polys')
-        texts = res_obj.get('rec_texts', [])
-        scores = res_obj.get('rec_scores', [])
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self.format = os.path.splitext(path)[1].lower().lstrip(".")
+        self._buffer = []
+        self._tmp = path + ".tmp"
         
-        if polys is None or len(polys) == 0:
-            return []
+        if self.format == "xlsx":
+            import openpyxl
+            self._wb = openpyxl.Workbook(write_only=True)
+            self._ws = self._wb.create_sheet("Quote")
+        elif self.format == "csv":
+            import csv
+            self._fp = open(self._tmp, "w", newline="", encoding="utf-8-sig")
+            self._csv = csv.writer(self._fp, delimiter=";")
+            self._csv.writerow([name for name, _ in columns])
+        elif self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            types = {int: pa.int64(), str: pa.string()}
+            self._schema = pa.schema([(name, types[kind]) for name, kind in columns])
+            self._pq = pq.ParquetWriter(self._tmp, self._schema)
+        else:
+            raise ValueError(f"Formato tabella non supportato: .{self.format}")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._abort()
+    
+    def write_rows(self, rows):
+        """Aggiunge righe (sequenze con un valore per colonna)."""
+        for row in rows:
+            self.rows += 1
+            if self.format == "csv":
+                self._csv.writerow(row)
+            elif self._buffer is None:
+                self._ws.append(row)
+            else:
+                self._buffer.append(row)
+                if self.format == "xlsx":
+                    if len(self._buffer) >= self.WIDTH_SAMPLE:
+                        self._start_sheet()
+                elif len(self._buffer) >= self.PARQUET_CHUNK:
+                    self._flush_parquet()
+    
+    def _start_sheet(self):
+        """Larghezze dal campione, intestazione e righe in attesa."""
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment
+        from openpyxl.utils import get_column_letter
         
-        total = len(polys)
-        for i, poly in enumerate(polys):
-            box = np.array(poly, dtype=float)
-            text = texts[i] if i < len(texts) else ""
-            conf = float(scores[i]) if i < len(scores) and scores[i] is not None else 0.0
-            results.append({"box": box, "text": str(text), "conf": conf})
-            
-            if progress_callback and i % 10 == 0:
-                pct = 70 + int(25 * i / total)
-                progress_callback(pct, f"Elaborazione {i+1}/{total}...")
+        sample = self._buffer
+        headers = [name for name, _ in self.columns]
+        for col, h in enumerate(headers):
+            width = max([len(h)] + [len(str(r[col] if r[col] is not None else "")) for r in sample])
+            self._ws.column_dimensions[get_column_letter(col + 1)].width = width + 2
+        
+        cells = []
+        for h in headers:
+            cell = WriteOnlyCell(self._ws, value=h)
+            cell.font = Font(bold=True)
+            cell.alignment = Alignment(horizontal="center")
+            cells.append(cell)
+        self._ws.append(cells)
+        for row in sample:
+            self._ws.append(row)
+        # Da qui in poi le righe vanno direttamente al foglio
+        self._buffer = None
     
-    except Exception as e:
-        print(f"[OCR Error] {e}")
+    def _flush_parquet(self):
+        import pyarrow as pa
+        
+        if self._buffer:
+            columns = list(zip(*self._buffer))
+            self._pq.write_table(pa.Table.from_arrays(
+                [pa.array(c, type=t) for c, t in zip(columns, self._schema.types)],
+                schema=self._schema))
+        self._buffer = []
     
-    if progress_callback:
-        progress_callback(100, "Completato!")
+    def close(self):
+        try:
+            if self.format == "xlsx":
+                if self._buffer is not None:
+                    self._start_sheet()
+                self._wb.save(self._tmp)
+            elif self.format == "csv":
+                self._fp.close()
+            else:
+                self._flush_parquet()
+                self._pq.close()
+            os.replace(self._tmp, self.path)
+        finally:
+            self._abort()
+        return self.rows
     
-    return results
+    def _abort(self):
+        if self.format == "csv" and not self._fp.closed:
+            self._fp.close()
+        elif self.format == "parquet" and self._pq.is_open:
+            self._pq.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+
+def quote_rows(pallini, drawing=None):
+    """Righe della tabella quote (una per pallino).
+    
+    Senza drawing: colonne QUOTE_COLUMNS; con drawing (nome del disegno):
+    colonne SUMMARY_COLUMNS, per il riepilogo batch.
+    """
+    chunk = 1000
+    for start in range(0, len(pallini), chunk):
+        batch = pallini[start:start + chunk]
+        for p, parsed in zip(batch, parse_quota_many([p["text"] for p in batch])):
+            row = [p["id"], p["text"], parsed["simbolo"], parsed["nominale"],
+                   parsed["tol_plus"], parsed["tol_minus"], parsed["classe"]]
+            if drawing is not None:
+                row = [drawing, p.get("page", 0) + 1] + row + [int(p["x"]), int(p["y"])]
+            yield row
+
+
+@profiled("export_excel")
+def write_excel(path, pallini):
+    """Scrive la tabella delle quote di un disegno (xlsx, csv o parquet dall'estensione)."""
+    # Colonna pagina solo per documenti multipagina
+    multi_page = any(p.get("page", 0) for p in pallini)
+    
+    columns = QUOTE_COLUMNS + ([("Pagina", int)] if multi_page else [])
+    rows = quote_rows(pallini)
+    if multi_page:
+        rows = (row + [p.get("page", 0) + 1] for row, p in zip(rows, pallini))
+    
+    with QuoteTableWriter(path, columns) as writer:
+        writer.write_rows(rows)
+
+
+# ============ PROGETTO ============
+
+def file_sha256(path, chunk=1 << 20):
+    """Impronta SHA-256 del contenuto di un file."""
+    import hashlib
+    
+    h = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
 
 
-def pdf_to_image(pdf_path, dpi=150):
-    """Converte PDF in immagine."""
+@profiled("save_project")
+def save_project(path, source_path, pallini, next_id, page_ocr, page_index=0,
+                 original_size=(0, 0), image_scale=1.0, source_hash=None, page_geometry=None):
+    """Salva il progetto (disegno, OCR per pagina, pallini) in modo atomico.
+    
+    Il file è un archivio .npz senza pickle: i metadati sono JSON, i
+    risultati OCR restano nei loro array (poligoni, confidenze, testi).
+    page_geometry: pagina -> (original_size, image_scale) delle pagine con
+    pallini o OCR, le cui coordinate sono nell'immagine di lavoro; la pagina
+    corrente usa original_size e image_scale.
+    """
+    import json
+    
+    geometry = dict(page_geometry or {})
+    geometry[page_index] = (original_size, image_scale)
+    source_path = os.path.abspath(source_path)
+    meta = {
+        "version": PROJECT_VERSION,
+        "source": source_path,
+        # Percorso relativo: il progetto resta valido se la cartella viene spostata
+        "source_rel": os.path.relpath(source_path, os.path.dirname(os.path.abspath(path))),
+        "sha256": source_hash or file_sha256(source_path),
+        "page_index": page_index,
+        "original_size": list(original_size),
+        "image_scale": image_scale,
+        "pages": {str(i): {"original_size": list(size), "image_scale": scale}
+                  for i, (size, scale) in sorted(geometry.items())},
+        "next_id": next_id,
+        "ocr_pages": sorted(int(i) for i in page_ocr),
+    }
+    arrays = {
+        "meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+        "pallini_id": np.array([p["id"] for p in pallini], dtype=np.int32),
+        "pallini_page": np.array([p.get("page", 0) for p in pallini], dtype=np.int32),
+        "pallini_xy": np.array([(p["x"], p["y"]) for p in pallini], dtype=np.float64).reshape(-1, 2),
+        "pallini_text": np.array([p["text"] for p in pallini], dtype=str),
+    }
+    for index, results in page_ocr.items():
+        arrays[f"ocr{index}_polys"] = results.polys
+        arrays[f"ocr{index}_conf"] = results.conf
+        arrays[f"ocr{index}_text"] = np.array(results.texts, dtype=str)
+    
+    tmp = path + ".tmp"
     try:
-        import fitz
-        doc = fitz.open(pdf_path)
-        page = doc[0]
-        mat = fitz.Matrix(dpi/72, dpi/72)
-        pix = page.get_pixmap(matrix=mat)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        doc.close()
-        return img
-    except ImportError:
-        from pdf2image import convert_from_path
-        images = convert_from_path(pdf_path, dpi=dpi, first_page=1, last_page=1)
-        return images[0] if images else None
+        with open(tmp, "wb") as fp:
+            np.savez_compressed(fp, **arrays)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 
-def parse_quota(text):
-    """Analizza una stringa di quota e estrae i componenti."""
-    original = text
-    text = text.strip()
+@profiled("load_project")
+def load_project(path):
+    """Legge un progetto salvato con save_project.
     
-    # Normalizza simboli diametro
-    text = text.replace("Ø", "⌀").replace("ø", "⌀").replace("O/", "⌀").replace("0/", "⌀")
+    Ritorna un dizionario con i metadati, "pallini" (lista di dizionari),
+    "page_ocr" (pagina -> OcrResults) e "page_geometry" (pagina ->
+    (original_size, image_scale) al salvataggio). "source" è il disegno da
+    aprire: se il percorso assoluto non esiste più si prova quello relativo.
+    """
+    import json
     
-    result = {"simbolo": "", "nominale": "", "tol_plus": "", "tol_minus": "", "classe": ""}
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+        if meta.get("version", 0) > PROJECT_VERSION:
+            raise ValueError("Progetto creato da una versione più recente del Pallinatore")
+        
+        xy = data["pallini_xy"].tolist()
+        meta["pallini"] = [
+            {"id": int(pid), "x": x, "y": y, "text": str(text), "page": int(page)}
+            for pid, (x, y), text, page in zip(data["pallini_id"].tolist(), xy,
+                                               data["pallini_text"].tolist(),
+                                               data["pallini_page"].tolist())
+        ]
+        meta["page_ocr"] = {
+            index: OcrResults(data[f"ocr{index}_polys"], data[f"ocr{index}_text"].tolist(),
+                              data[f"ocr{index}_conf"])
+            for index in meta["ocr_pages"]
+        }
     
-    # Estrai simbolo iniziale (⌀, R, M, S, ecc.)
-    m = re.match(r"^([⌀RMSsGg])\s*", text)
-    if m:
-        result["simbolo"] = m.group(1).upper()
-        text = text[m.end():].strip()
+    # I progetti precedenti registrano solo la pagina corrente
+    pages = meta.get("pages") or {str(meta["page_index"]): meta}
+    meta["page_geometry"] = {int(i): (tuple(g["original_size"]), g["image_scale"])
+                             for i, g in pages.items() if all(g["original_size"])}
     
-    # Pattern 1: Numero + classe tolleranza ISO (es. "20H7", "20 H7", "10h6", "50g6")
-    m = re.match(r"^([\d.,]+)\s*([A-Za-z]\d+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        result["classe"] = m.group(2)
-        return result
+    if not os.path.exists(meta["source"]):
+        relative = os.path.join(os.path.dirname(os.path.abspath(path)), meta["source_rel"])
+        if os.path.exists(relative):
+            meta["source"] = os.path.normpath(relative)
+    return meta
+
+
+def rescale_project(project, page_geometry):
+    """Riporta pallini e OCR del progetto alla geometria delle pagine riaperte.
     
-    # Pattern 2: ±tolleranza simmetrica (es. "20±0.1", "20 ± 0.1")
-    m = re.match(r"^([\d.,]+)\s*[±]\s*([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        tol = m.group(2).replace(",", ".")
-        result["tol_plus"] = f"+{tol}"
-        result["tol_minus"] = f"-{tol}"
-        return result
-    
-    # Pattern 3: Tolleranze asimmetriche +X/-Y (es. "20+0.1-0.2", "20 +0.1 -0.2")
-    m = re.match(r"^([\d.,]+)\s*\+\s*([\d.,]+)\s*[-–]\s*([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        result["tol_plus"] = f"+{m.group(2).replace(',', '.')}"
-        result["tol_minus"] = f"-{m.group(3).replace(',', '.')}"
-        return result
+    Le coordinate sono nell'immagine di lavoro: se la pagina viene ridotta a
+    un'altra scala (o il disegno ha cambiato dimensioni) vengono moltiplicate
+    per il rapporto tra le immagini di lavoro, asse per asse.
+    page_geometry: pagina -> (original_size, image_scale) attuali.
+    Ritorna le pagine le cui dimensioni originali sono cambiate.
+    """
+    resized = []
+    for index, (saved_size, saved_scale) in project["page_geometry"].items():
+        if index not in page_geometry:
+            continue
+        size, scale = page_geometry[index]
+        if tuple(size) != tuple(saved_size):
+            resized.append(index)
+        elif scale == saved_scale:
+            continue
+        fx = size[0] * scale / (saved_size[0] * saved_scale)
+        fy = size[1] * scale / (saved_size[1] * saved_scale)
+        for p in project["pallini"]:
+            if p["page"] == index:
+                p["x"], p["y"] = p["x"] * fx, p["y"] * fy
+        if index in project["page_ocr"]:
+            project["page_ocr"][index] = project["page_ocr"][index].scaled((fx, fy))
+    return sorted(resized)
+
+
+class SpatialGrid:
+    """Indice spaziale a griglia uniforme per punti (pallini, centri dei box OCR).
     
-    # Pattern 4: Tolleranze asimmetriche -Y/+X (ordine inverso)
-    m = re.match(r"^([\d.,]+)\s*[-–]\s*([\d.,]+)\s*\+\s*([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        result["tol_minus"] = f"-{m.group(2).replace(',', '.')}"
-        result["tol_plus"] = f"+{m.group(3).replace(',', '.')}"
-        return result
+    Ogni punto sta in una cella di lato `cell`: la ricerca entro un raggio
+    esamina solo le celle che lo intersecano invece di tutti i punti.
+    Inserimento, spostamento e rimozione sono O(1).
+    """
     
-    # Pattern 5: Tolleranze su righe separate (es. "20\n+0.1\n-0.2" o "20 0.1 0.2")
-    m = re.match(r"^([\d.,]+)\s+([\d.,]+)\s+([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        # Assume prima positiva, seconda negativa
-        result["tol_plus"] = f"+{m.group(2).replace(',', '.')}"
-        result["tol_minus"] = f"-{m.group(3).replace(',', '.')}"
-        return result
-    
-    # Pattern 6: Solo +tolleranza (es. "20+0.1")
-    m = re.match(r"^([\d.,]+)\s*\+\s*([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        result["tol_plus"] = f"+{m.group(2).replace(',', '.')}"
-        return result
+    def __init__(self, cell=64.0):
+        self.cell = float(cell)
+        self._cells = {}     # (cx, cy) -> {chiave: (x, y)}
+        self._where = {}     # chiave -> (cx, cy)
     
-    # Pattern 7: Solo -tolleranza (es. "20-0.1")
-    m = re.match(r"^([\d.,]+)\s*[-–]\s*([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        result["tol_minus"] = f"-{m.group(2).replace(',', '.')}"
-        return result
+    def __len__(self):
+        return len(self._where)
     
-    # Pattern 8: Numero con spazi (es. "20 . 5" -> "20.5")
-    cleaned = re.sub(r"(\d)\s*[.,]\s*(\d)", r"\1.\2", text)
-    m = re.match(r"^([\d.]+)\s*$", cleaned)
-    if m:
-        result["nominale"] = m.group(1)
-        return result
+    def _cell_of(self, x, y):
+        return int(x // self.cell), int(y // self.cell)
     
-    # Pattern 9: Solo numero
-    m = re.match(r"^([\d.,]+)\s*$", text)
-    if m:
-        result["nominale"] = m.group(1).replace(",", ".")
-        return result
+    def insert(self, key, x, y):
+        if key in self._where:
+            self.remove(key)
+        c = self._cell_of(x, y)
+        self._cells.setdefault(c, {})[key] = (x, y)
+        self._where[key] = c
     
-    # Fallback: tutto come nominale
-    result["nominale"] = original.strip()
-    return result
+    def move(self, key, x, y):
+        c = self._where.get(key)
+        new = self._cell_of(x, y)
+        if c == new:
+            self._cells[c][key] = (x, y)
+        else:
+            self.insert(key, x, y)
+    
+    def remove(self, key):
+        c = self._where.pop(key, None)
+        if c is None:
+            return
+        bucket = self._cells[c]
+        del bucket[key]
+        if not bucket:
+            del self._cells[c]
+    
+    def clear(self):
+        self._cells.clear()
+        self._where.clear()
+    
+    def nearest(self, x, y, max_dist):
+        """Chiave del punto più vicino entro max_dist, o None.
+        
+        A parità di distanza vince la chiave più piccola.
+        """
+        cx0, cy0 = self._cell_of(x - max_dist, y - max_dist)
+        cx1, cy1 = self._cell_of(x + max_dist, y + max_dist)
+        best, best_d2 = None, max_dist * max_dist
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                bucket = self._cells.get((cx, cy))
+                if not bucket:
+                    continue
+                for key, (px, py) in bucket.items():
+                    d2 = (px - x) ** 2 + (py - y) ** 2
+                    if d2 < best_d2 or (d2 == best_d2 and best is not None and key < best):
+                        best, best_d2 = key, d2
+        return best
+
+
+class ZoomPyramid:
+    """Piramide multirisoluzione dell'immagine di lavoro per il display.
+    
+    I livelli (1, 1/2, 1/4, ...) vengono calcolati una volta sola, entro un
+    budget di memoria; ogni regione visibile viene poi ricampionata dal
+    livello più piccolo che ha ancora risoluzione sufficiente.
+    """
+    
+    MIN_SIDE = 256
+    
+    def __init__(self, image, max_bytes=PYRAMID_MAX_MB * 1024 * 1024, detail=None):
+        self.image = image
+        # Sorgente dei dettagli oltre il 100% (es. PdfPageView), opzionale
+        self.detail = detail
+        self.levels = [image]
+        used = self._nbytes(image)
+        level = image
+        while min(level.size) >= 2 * self.MIN_SIDE:
+            # reduce() è un filtro box: veloce e senza aliasing per fattore 2
+            smaller = level.reduce(2)
+            used += self._nbytes(smaller)
+            if used > max_bytes:
+                break
+            self.levels.append(smaller)
+            level = smaller
+    
+    @staticmethod
+    def _nbytes(img):
+        return img.width * img.height * len(img.getbands())
+    
+    def close(self):
+        """Chiude la sorgente dei dettagli (il documento PDF resta aperto fino a qui)."""
+        if self.detail is not None:
+            self.detail.close()
+            self.detail = None
+    
+    def render(self, zoom, box):
+        """Regione box (coordinate display al fattore zoom) come immagine PIL."""
+        if zoom > 1 and self.detail is not None:
+            return self.detail.render(zoom, box)
+        x0, y0, x1, y1 = box
+        k = 0
+        while k + 1 < len(self.levels) and zoom <= 0.5 ** (k + 1):
+            k += 1
+        level = self.levels[k]
+        f = zoom * self.image.width / level.width
+        
+        if zoom >= 4:
+            resample = Image.NEAREST     # Pixel netti per ispezionare testi minuti
+        else:
+            resample = Image.BILINEAR
+        # Il box sorgente in virgola mobile evita giunture tra tile adiacenti
+        return level.resize((x1 - x0, y1 - y0), resample,
+                            box=(x0 / f, y0 / f, min(x1 / f, level.width), min(y1 / f, level.height)))
+
+
+class TaskCancelled(BaseException):
+    """Operazione annullata dall'utente.
+    
+    Deriva da BaseException (come KeyboardInterrupt) per non essere
+    intercettata dai blocchi "except Exception" lungo la pipeline OCR.
+    """
+
+
+class BackgroundTask:
+    """Esegue una funzione in un thread separato.
+    
+    Gli eventi (avanzamento, risultato, errore) vengono messi in una coda
+    letta dal loop Tk: il thread non tocca mai i widget. L'annullamento è
+    cooperativo: la prossima chiamata a progress() solleva TaskCancelled.
+    """
+    
+    def __init__(self, fn):
+        self.events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(fn,), daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        return self
+    
+    def cancel(self):
+        self._cancel.set()
+    
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+    
+    def progress(self, value, text=""):
+        """Avanzamento 0-100, oppure None per una fase di durata ignota."""
+        if self.cancelled:
+            raise TaskCancelled()
+        self.events.put(("progress", value, text))
+    
+    def _run(self, fn):
+        try:
+            result = fn(self)
+        except TaskCancelled:
+            self.events.put(("cancelled", None, ""))
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self.events.put(("error", e, ""))
+        else:
+            self.events.put(("done", result, ""))
 
 
 class ProgressDialog(tk.Toplevel):
-    """Dialog con barra di progresso."""
+    """Dialog con barra di progresso (non modale, con annullamento)."""
     
-    def __init__(self, parent, title="Elaborazione"):
+    def __init__(self, parent, title="Elaborazione", on_cancel=None):
         super().__init__(parent)
         self.title(title)
         self.transient(parent)
         self.resizable(False, False)
         
         # Centra sulla finestra padre
-        self.geometry("350x100")
+        self.geometry("350x130")
         x = parent.winfo_x() + (parent.winfo_width() - 350) // 2
-        y = parent.winfo_y() + (parent.winfo_height() - 100) // 2
+        y = parent.winfo_y() + (parent.winfo_height() - 130) // 2
         self.geometry(f"+{x}+{y}")
         
         self.label = tk.Label(self, text="Inizializzazione...")
         self.label.pack(pady=(15, 5))
         
         self.progress = ttk.Progressbar(self, length=300, mode='determinate')
-        self.progress.pack(pady=10)
+        self.progress.pack(pady=5)
         
-        self.protocol("WM_DELETE_WINDOW", lambda: None)  # Blocca chiusura
-        self.grab_set()
+        # Nessun grab: la finestra principale resta utilizzabile (zoom, scorrimento)
+        if on_cancel:
+            tk.Button(self, text="Annulla", width=10, command=on_cancel).pack(pady=5)
+            self.protocol("WM_DELETE_WINDOW", on_cancel)
+        else:
+            self.protocol("WM_DELETE_WINDOW", lambda: None)  # Blocca chiusura
     
     def update_progress(self, value, text=""):
-        self.progress['value'] = value
+        if value is None:
+            # Fase senza avanzamento misurabile (es. inferenza del motore)
+            if str(self.progress['mode']) != 'indeterminate':
+                self.progress.config(mode='indeterminate')
+                self.progress.start(15)
+        else:
+            if str(self.progress['mode']) != 'determinate':
+                self.progress.stop()
+                self.progress.config(mode='determinate')
+            self.progress['value'] = value
         if text:
             self.label.config(text=text)
-        self.update()
+
+
+class ProfilePanel(tk.Toplevel):
+    """Riepilogo delle misure per fase, aggiornato mentre la finestra è aperta."""
+    
+    COLUMNS = (("fase", "Fase", 170), ("n", "N", 50), ("totale", "Totale ms", 80),
+               ("medio", "Medio ms", 80), ("max", "Max ms", 80),
+               ("picco_rss", "Picco RSS MB", 95), ("crescita_rss", "Crescita MB", 85))
+    
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Prestazioni")
+        self.transient(parent)
+        self.geometry("700x360")
+        
+        bar = tk.Frame(self)
+        bar.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.enabled_var = tk.BooleanVar(value=profiler.enabled)
+        tk.Checkbutton(bar, text="Registra misure", variable=self.enabled_var,
+                       command=self._toggle).pack(side=tk.LEFT)
+        tk.Button(bar, text="Azzera", command=self._clear).pack(side=tk.LEFT, padx=5)
+        tk.Button(bar, text="Salva traccia...", command=self._save).pack(side=tk.LEFT)
+        self.info = tk.Label(bar, fg="gray")
+        self.info.pack(side=tk.RIGHT)
+        
+        self.tree = ttk.Treeview(self, columns=[c[0] for c in self.COLUMNS], show="headings")
+        for key, title, width in self.COLUMNS:
+            self.tree.heading(key, text=title)
+            self.tree.column(key, width=width, anchor=tk.W if key == "fase" else tk.E)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        
+        self._refresh()
+    
+    def _toggle(self):
+        if self.enabled_var.get():
+            profiler.enable()
+        else:
+            profiler.disable()
+    
+    def _clear(self):
+        profiler.clear()
+        self._refresh()
+    
+    def _save(self):
+        path = filedialog.asksaveasfilename(
+            parent=self, title="Salva traccia", defaultextension=".json",
+            initialfile="pallinatore_trace.json",
+            filetypes=[("Traccia Chrome", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            profiler.dump(path)
+        except OSError as e:
+            messagebox.showerror("Errore", f"Impossibile salvare la traccia:\n{e}", parent=self)
+    
+    def _refresh(self):
+        if not self.winfo_exists():
+            return
+        mb = 1024 * 1024
+        self.tree.delete(*self.tree.get_children())
+        for s in profiler.summary():
+            self.tree.insert("", tk.END, values=(
+                s["fase"], s["n"], f"{s['totale'] * 1000:.1f}", f"{s['medio'] * 1000:.1f}",
+                f"{s['max'] * 1000:.1f}", f"{s['picco_rss'] / mb:.0f}",
+                f"{s['crescita_rss'] / mb:+.0f}"))
+        self.info.config(text=f"RSS attuale {current_rss() / mb:.0f} MB")
+        self.after(1000, self._refresh)
 
 
 class PallinatoreApp(tk.Tk):
     """Applicazione principale."""
     
     # Dimensione massima per display (pixel sul lato lungo)
-    DISPLAY_MAX_SIZE = 2000
+    DISPLAY_MAX_SIZE = DISPLAY_MAX_SIZE
     PALLINO_RADIUS = 12
     
-    def __init__(self):
+    def __init__(self, exclude_zones=()):
         super().__init__()
         
         self.title("Pallinatore Quote v6")
@@ -226,22 +3500,68 @@ class PallinatoreApp(tk.Tk):
         
         # Stato
         self.image_path = None
+        self.project_path = None     # Ultimo file di progetto salvato o aperto
         self.original_size = (0, 0)  # Dimensioni REALI dell'immagine
         self.working_image = None    # Immagine ridimensionata per lavorare
-        self.display_image = None    # Immagine per display (zoomata)
-        self.tk_image = None
+        self.pyramid = None          # Livelli di zoom precalcolati di working_image
+        self._view_tiles = {}        # (tx, ty) -> (PhotoImage, item canvas) visibili
+        self._render_pending = False
         self.zoom = 1.0
         self.image_scale = 1.0       # Fattore scala tra originale e working
         
-        self.ocr_results = []
-        self.pallini = []
+        # Documento multipagina: pagina corrente e risultati OCR per pagina
+        self.document = None
+        self.page_index = 0
+        self.page_ocr = {}
+        
+        self.ocr_results = OcrResults()
+        self.pallini = []            # Pallini di tutte le pagine (chiave "page")
         self.next_id = 1
+        self._next_key = 1           # Chiave stabile dei pallini (non cambia con la rinumerazione)
+        self._pallino_items = {}     # chiave pallino -> (cerchio, testo) sul canvas
+        self._pallini_by_key = {}    # chiave pallino -> pallino (pagina corrente)
+        self._tree_pallini = {}      # riga della tabella -> pallino (tutte le pagine)
+        self._pallino_grid = SpatialGrid()   # Pallini della pagina corrente (per chiave)
+        self._ocr_grid = None        # Centri dei box OCR (per indice), creato al primo click
+        self._ocr_grid_source = None
         
         # Stato drag
-        self.dragging = None
+        self.dragging = None         # Pallino (dict) in trascinamento
         self.drag_offset = (0, 0)
+        self.roi_start = None        # Angolo della regione da rileggere (Maiusc+trascina)
+        
+        # Zone della pagina da non leggere con l'OCR solo quote (frazioni, es. cartiglio)
+        self.exclude_zones = list(exclude_zones)
+        
+        # Operazione in background in corso (OCR, caricamento)
+        self.task = None
+        self.profile_panel = None
         
         self._build_ui()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        
+        # Il motore OCR si carica mentre l'utente apre il disegno
+        self.after(200, self._start_engine_warmup)
+    
+    def _on_close(self):
+        self._drop_pyramid()
+        self.destroy()
+    
+    def _start_engine_warmup(self):
+        if start_ocr_warmup() is not None:
+            self._poll_engine_status()
+    
+    def _poll_engine_status(self):
+        state = ocr_engine_status()
+        label = {
+            "caricamento": ("⏳ OCR: caricamento...", "gray25"),
+            "pronto": ("✅ OCR pronto", "dark green"),
+            "servizio": ("✅ OCR: servizio locale", "dark green"),
+            "errore": ("⚠ OCR non disponibile", "red"),
+        }.get(state, ("OCR: non caricato", "gray25"))
+        self.engine_status.configure(text=label[0], fg=label[1])
+        if state == "caricamento":
+            self.after(300, self._poll_engine_status)
     
     def _build_ui(self):
         # Toolbar
@@ -249,7 +3569,19 @@ class PallinatoreApp(tk.Tk):
         toolbar.pack(side=tk.TOP, fill=tk.X)
         
         tk.Button(toolbar, text="📂 Apri", command=self.open_file).pack(side=tk.LEFT, padx=2, pady=2)
+        tk.Button(toolbar, text="📁 Apri progetto", command=self.open_project).pack(side=tk.LEFT, padx=2, pady=2)
+        tk.Button(toolbar, text="💾 Salva progetto", command=self.save_project).pack(side=tk.LEFT, padx=2, pady=2)
+        
+        # Navigazione pagine (PDF multipagina)
+        tk.Button(toolbar, text="◀", width=2, command=self.prev_page).pack(side=tk.LEFT)
+        self.page_label = tk.Label(toolbar, text="-/-", width=7)
+        self.page_label.pack(side=tk.LEFT)
+        tk.Button(toolbar, text="▶", width=2, command=self.next_page).pack(side=tk.LEFT)
+        
+        ttk.Separator(toolbar, orient=tk.VERTICAL).pack(side=tk.LEFT, fill=tk.Y, padx=5)
+        
         tk.Button(toolbar, text="🔍 Scansiona OCR", command=self.scan_ocr).pack(side=tk.LEFT, padx=2, pady=2)
+        tk.Button(toolbar, text="📑 OCR documento", command=self.scan_document).pack(side=tk.LEFT, padx=2, pady=2)
         tk.Button(toolbar, text="🎯 Auto Pallina", command=self.auto_pallina).pack(side=tk.LEFT, padx=2, pady=2)
         
         ttk.Separator(toolbar, orient=tk.VERTICAL).pack(side=tk.LEFT, fill=tk.Y, padx=5)
@@ -273,10 +3605,23 @@ class PallinatoreApp(tk.Tk):
         
         self.show_boxes_var = tk.BooleanVar(value=True)
         tk.Checkbutton(toolbar, text="Mostra box OCR", variable=self.show_boxes_var, 
-                       command=self.redraw).pack(side=tk.LEFT, padx=10)
+                       command=self._toggle_boxes).pack(side=tk.LEFT, padx=10)
+        
+        # OCR a tile sulla risoluzione originale (testi piccoli su fogli grandi)
+        self.tiled_ocr_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(toolbar, text="OCR alta risoluzione", 
+                       variable=self.tiled_ocr_var).pack(side=tk.LEFT)
+        
+        # OCR in due fasi: si riconoscono solo i testi che possono essere quote
+        self.two_stage_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(toolbar, text="Solo quote (veloce)", 
+                       variable=self.two_stage_var).pack(side=tk.LEFT)
+        
+        tk.Button(toolbar, text="⏱ Prestazioni", 
+                  command=self.show_profile_panel).pack(side=tk.RIGHT, padx=2, pady=2)
         
         # Istruzioni
-        tk.Label(toolbar, text="│ Trascina=sposta │ DX=elimina │ Click=aggiungi", 
+        tk.Label(toolbar, text="│ Trascina=sposta │ DX=elimina │ Click=aggiungi │ Maiusc+trascina=OCR regione", 
                  fg="gray").pack(side=tk.RIGHT, padx=10)
         
         # Area principale
@@ -290,14 +3635,26 @@ class PallinatoreApp(tk.Tk):
         self.canvas = tk.Canvas(canvas_frame, bg="#404040", cursor="crosshair")
         self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
-        vscroll = tk.Scrollbar(canvas_frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        vscroll = tk.Scrollbar(canvas_frame, orient=tk.VERTICAL, command=self._scroll_y)
         vscroll.pack(side=tk.RIGHT, fill=tk.Y)
         
-        hscroll = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        hscroll = tk.Scrollbar(self, orient=tk.HORIZONTAL, command=self._scroll_x)
         hscroll.pack(side=tk.BOTTOM, fill=tk.X)
         
         self.canvas.configure(xscrollcommand=hscroll.set, yscrollcommand=vscroll.set)
         
+        # Il display viene generato solo per la parte visibile
+        self.canvas.bind("<Configure>", lambda e: self._schedule_render())
+        
+        # Rotella: scorrimento (Maiusc = orizzontale, Ctrl = zoom)
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Shift-MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Control-MouseWheel>", self.on_mouse_wheel)
+        for button, delta in (("4", 120), ("5", -120)):
+            for mod in ("", "Shift-", "Control-"):
+                self.canvas.bind(f"<{mod}Button-{button}>",
+                                 lambda e, d=delta: self.on_mouse_wheel(e, d))
+        
         # Eventi mouse
         self.canvas.bind("<Button-1>", self.on_mouse_down)
         self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
@@ -308,14 +3665,16 @@ class PallinatoreApp(tk.Tk):
         table_frame = tk.Frame(main, width=350)
         main.add(table_frame)
         
-        columns = ("id", "quota", "x", "y")
+        columns = ("id", "pag", "quota", "x", "y")
         self.tree = ttk.Treeview(table_frame, columns=columns, show="headings", height=30)
         self.tree.heading("id", text="ID")
+        self.tree.heading("pag", text="Pag")
         self.tree.heading("quota", text="Quota")
         self.tree.heading("x", text="X")
         self.tree.heading("y", text="Y")
         self.tree.column("id", width=40, anchor=tk.CENTER)
-        self.tree.column("quota", width=180)
+        self.tree.column("pag", width=35, anchor=tk.CENTER)
+        self.tree.column("quota", width=150)
         self.tree.column("x", width=50, anchor=tk.CENTER)
         self.tree.column("y", width=50, anchor=tk.CENTER)
         
@@ -328,9 +3687,15 @@ class PallinatoreApp(tk.Tk):
         # Doppio click per eliminare dalla tabella
         self.tree.bind("<Double-1>", self.on_tree_double_click)
         
-        # Status bar
+        # Status bar (a destra lo stato del motore OCR)
+        statusbar = tk.Frame(self)
+        statusbar.pack(side=tk.BOTTOM, fill=tk.X)
         self.status = tk.StringVar(value="Pronto. Apri un'immagine per iniziare.")
-        tk.Label(self, textvariable=self.status, anchor=tk.W, relief=tk.SUNKEN).pack(side=tk.BOTTOM, fill=tk.X)
+        self.engine_status = tk.Label(statusbar, text="OCR: non caricato", anchor=tk.E,
+                                      relief=tk.SUNKEN, width=22)
+        self.engine_status.pack(side=tk.RIGHT)
+        tk.Label(statusbar, textvariable=self.status, anchor=tk.W,
+                 relief=tk.SUNKEN).pack(side=tk.LEFT, fill=tk.X, expand=True)
     
     # ============ FILE ============
     
@@ -345,257 +3710,632 @@ class PallinatoreApp(tk.Tk):
         if not path:
             return
         
-        try:
-            import gc
-            
-            self.status.set("Caricamento...")
-            self.update()
-            
-            # Libera memoria precedente
-            if self.working_image:
-                del self.working_image
-            if self.display_image:
-                del self.display_image
-            gc.collect()
-            
-            # Carica immagine
-            if path.lower().endswith(".pdf"):
-                self.status.set("Conversione PDF...")
-                self.update()
-                img = pdf_to_image(path)
-            else:
-                img = Image.open(path)
-            
-            img = img.convert("RGB")
+        def work(task):
+            task.progress(None, "Caricamento...")
+            with profiler.span("open_file"):
+                # Apre il documento: le pagine vengono rasterizzate solo quando servono
+                document = DrawingDocument(path, self.DISPLAY_MAX_SIZE)
+                # Carica prima pagina (ridotta per il display se necessario)
+                page = document.get_page(0, lambda text: task.progress(None, text))
+            return document, page
+        
+        def done(result):
+            document, page = result
+            self._set_document(path, document, 0, page)
+            self.clear_pallini()
             
-            # Salva dimensioni originali
-            self.original_size = img.size
-            orig_w, orig_h = img.size
+            orig_w, orig_h = self.original_size
+            size_str = f"{orig_w}x{orig_h}"
+            if self.image_scale < 1.0:
+                size_str += f" (display ridotto)"
+            if document.page_count > 1:
+                size_str += f", {document.page_count} pagine"
+            self.status.set(f"Caricato: {os.path.basename(path)} ({size_str})")
+        
+        def error(e):
+            messagebox.showerror("Errore", f"Impossibile aprire il file:\n{e}")
+            self.status.set("Pronto.")
+        
+        self._start_task(work, done, on_error=error)
+    
+    def _set_document(self, path, document, index, page, page_ocr=None):
+        """Sostituisce il documento aperto e mostra la pagina index."""
+        import gc
+        
+        # Libera memoria precedente
+        self.working_image = None
+        self._drop_pyramid()
+        gc.collect()
+        
+        self.working_image, self.original_size, self.image_scale = page
+        self.document = document
+        self.page_index = index
+        self.page_ocr = page_ocr or {}
+        self.image_path = path
+        self.project_path = None
+        self.zoom = 1.0
+        self.ocr_results = self.page_ocr.get(index, OcrResults())
+        self.dragging = None
+        
+        self._update_display()
+        self._update_page_label()
+    
+    # ============ PROGETTO ============
+    
+    def save_project(self):
+        """Salva OCR e pallini per riaprire il disegno senza rifare l'OCR."""
+        if self.document is None:
+            messagebox.showinfo("Info", "Nessun disegno caricato.")
+            return
+        
+        initial = self.project_path or (os.path.splitext(self.image_path)[0] + PROJECT_EXTENSION)
+        path = filedialog.asksaveasfilename(
+            title="Salva progetto",
+            defaultextension=PROJECT_EXTENSION,
+            initialdir=os.path.dirname(initial),
+            initialfile=os.path.basename(initial),
+            filetypes=[("Progetto Pallinatore", f"*{PROJECT_EXTENSION}")]
+        )
+        if not path:
+            return
+        
+        page_ocr = dict(self.page_ocr)
+        page_ocr[self.page_index] = self.ocr_results
+        page_ocr = {i: r for i, r in page_ocr.items() if len(r)}
+        pallini = [dict(p) for p in self.pallini]
+        document = self.document
+        args = (self.image_path, pallini, self.next_id, page_ocr, self.page_index,
+                self.original_size, self.image_scale)
+        
+        def work(task):
+            task.progress(None, "Salvataggio progetto...")
+            # Scala di ogni pagina con pallini o OCR: coordinate nella sua immagine di lavoro
+            geometry = {}
+            for index in {p.get("page", 0) for p in pallini} | set(page_ocr):
+                try:
+                    geometry[index] = document.page_geometry(index)
+                except ImportError:
+                    pass   # PDF senza PyMuPDF: solo le pagine già rasterizzate
+            save_project(path, *args, page_geometry=geometry)
+        
+        def done(_):
+            self.project_path = path
+            self.status.set(f"Progetto salvato: {os.path.basename(path)}")
+        
+        def error(e):
+            messagebox.showerror("Errore", f"Impossibile salvare il progetto:\n{e}")
+        
+        self._start_task(work, done, on_error=error)
+    
+    def open_project(self):
+        """Riapre un progetto: disegno, OCR e pallini, senza passare da PaddleOCR."""
+        path = filedialog.askopenfilename(
+            title="Apri progetto",
+            filetypes=[("Progetto Pallinatore", f"*{PROJECT_EXTENSION}"), ("Tutti i file", "*.*")]
+        )
+        if not path:
+            return
+        
+        def work(task):
+            task.progress(None, "Lettura progetto...")
+            project = load_project(path)
+            source = project["source"]
+            if not os.path.exists(source):
+                raise FileNotFoundError(f"Disegno non trovato:\n{source}")
             
-            # Calcola se serve ridimensionamento per il display
-            max_dim = max(orig_w, orig_h)
-            if max_dim > self.DISPLAY_MAX_SIZE:
-                self.image_scale = self.DISPLAY_MAX_SIZE / max_dim
-                new_w = int(orig_w * self.image_scale)
-                new_h = int(orig_h * self.image_scale)
-                
-                self.status.set(f"Ridimensionamento {orig_w}x{orig_h} → {new_w}x{new_h}...")
-                self.update()
-                
-                self.working_image = img.resize((new_w, new_h), Image.LANCZOS)
-                
-                # Libera immagine originale
-                del img
-                gc.collect()
-                
-                print(f"[DEBUG] Immagine grande ridimensionata: {orig_w}x{orig_h} -> {new_w}x{new_h}")
-                print(f"[DEBUG] Fattore scala display: {self.image_scale:.4f}")
-            else:
-                self.working_image = img
-                self.image_scale = 1.0
+            document = DrawingDocument(source, self.DISPLAY_MAX_SIZE)
+            index = min(project["page_index"], document.page_count - 1)
+            page = document.get_page(index, lambda text: task.progress(None, text))
+            task.progress(None, "Verifica disegno...")
+            changed = file_sha256(source) != project["sha256"]
+            geometry = {}
+            for i in project["page_geometry"]:
+                if i < document.page_count:
+                    try:
+                        geometry[i] = document.page_geometry(i)
+                    except ImportError:
+                        pass
+            resized = rescale_project(project, geometry)
+            return project, document, index, page, changed, resized
+        
+        def done(result):
+            project, document, index, page, changed, resized = result
             
-            self.image_path = path
-            self.zoom = 1.0
-            self.ocr_results = []
-            self.clear_pallini()
+            self.pallini = []
+            self._set_document(project["source"], document, index, page, project["page_ocr"])
+            self.project_path = path
+            for p in project["pallini"]:
+                p["key"] = self._next_key
+                self._next_key += 1
+                self.pallini.append(p)
+            self.next_id = project["next_id"]
+            self._refresh_tree()
+            self.redraw()
             
-            self._update_display()
+            self.status.set(f"Progetto aperto: {os.path.basename(path)} "
+                            f"({len(self.pallini)} pallini)")
+            if resized:
+                pages = ", ".join(str(i + 1) for i in resized)
+                messagebox.showwarning(
+                    "Disegno modificato",
+                    f"Le dimensioni del disegno sono cambiate (pagine {pages}):\n"
+                    "pallini e box OCR sono stati riportati in scala, ma\n"
+                    "potrebbero non corrispondere più.\n\n"
+                    f"{project['source']}")
+            elif changed:
+                messagebox.showwarning(
+                    "Disegno modificato",
+                    "Il disegno è cambiato dopo il salvataggio del progetto:\n"
+                    "box OCR e pallini potrebbero non corrispondere più.\n\n"
+                    f"{project['source']}")
+        
+        def error(e):
+            messagebox.showerror("Errore", f"Impossibile aprire il progetto:\n{e}")
+            self.status.set("Pronto.")
+        
+        self._start_task(work, done, on_error=error)
+    
+    # ============ PRESTAZIONI ============
+    
+    def show_profile_panel(self):
+        if self.profile_panel is not None and self.profile_panel.winfo_exists():
+            self.profile_panel.lift()
+            return
+        self.profile_panel = ProfilePanel(self)
+    
+    # ============ OPERAZIONI IN BACKGROUND ============
+    
+    def _start_task(self, work, on_done, title=None, on_error=None):
+        """Avvia work(task) in background; on_done riceve il risultato nel thread Tk."""
+        if self.task is not None:
+            messagebox.showinfo("Info", "Operazione in corso, attendere o annullare.")
+            return
+        
+        task = BackgroundTask(work)
+        dialog = ProgressDialog(self, title, on_cancel=lambda: self._cancel_task(task)) if title else None
+        self.task = task
+        task.start()
+        self.after(50, self._poll_task, task, dialog, on_done, on_error)
+    
+    def _cancel_task(self, task):
+        """Annulla l'operazione: l'interfaccia torna subito disponibile."""
+        task.cancel()
+        if self.task is task:
+            self.task = None
+        self.status.set("Operazione annullata")
+    
+    def _poll_task(self, task, dialog, on_done, on_error):
+        """Legge gli eventi del thread in background (chiamato dal loop Tk)."""
+        while True:
+            try:
+                kind, value, text = task.events.get_nowait()
+            except queue.Empty:
+                break
             
-            size_str = f"{orig_w}x{orig_h}"
-            if self.image_scale < 1.0:
-                size_str += f" (display ridotto)"
-            self.status.set(f"Caricato: {os.path.basename(path)} ({size_str})")
+            if kind == "progress":
+                if task.cancelled:
+                    continue
+                if dialog is not None:
+                    dialog.update_progress(value, text)
+                elif text:
+                    self.status.set(text)
+                continue
             
-            gc.collect()
+            # Operazione terminata
+            if dialog is not None:
+                dialog.destroy()
+            if self.task is task:
+                self.task = None
+            if task.cancelled or kind == "cancelled":
+                return
+            if kind == "done":
+                on_done(value)
+            elif on_error is not None:
+                on_error(value)
+            else:
+                messagebox.showerror("Errore", str(value))
+            return
+        
+        if task.cancelled and dialog is not None and dialog.winfo_exists():
+            dialog.destroy()
+        self.after(50, self._poll_task, task, dialog, on_done, on_error)
+    
+    # ============ PAGINE ============
+    
+    def _update_page_label(self):
+        if self.document is None:
+            self.page_label.config(text="-/-")
+        else:
+            self.page_label.config(text=f"{self.page_index + 1}/{self.document.page_count}")
+    
+    def prev_page(self):
+        self.show_page(self.page_index - 1)
+    
+    def next_page(self):
+        self.show_page(self.page_index + 1)
+    
+    def show_page(self, index):
+        """Mostra una pagina del documento, rasterizzandola se necessario."""
+        if self.document is None or not 0 <= index < self.document.page_count:
+            return
+        if index == self.page_index:
+            return
+        
+        document = self.document
+        
+        def work(task):
+            task.progress(None, f"Caricamento pagina {index + 1}...")
+            return document.get_page(index)
+        
+        def done(page):
+            if document is not self.document:
+                return
+            self.page_ocr[self.page_index] = self.ocr_results
+            self.working_image, self.original_size, self.image_scale = page
+            self.page_index = index
+            self.ocr_results = self.page_ocr.get(index, OcrResults())
+            self.dragging = None
             
-        except Exception as e:
-            messagebox.showerror("Errore", f"Impossibile aprire il file:\n{e}")
+            self._update_display()
+            self._update_page_label()
+            self.status.set(f"Pagina {index + 1}/{self.document.page_count}")
+        
+        def error(e):
+            messagebox.showerror("Errore", f"Impossibile caricare la pagina:\n{e}")
+        
+        self._start_task(work, done, on_error=error)
+    
+    def _page_pallini(self):
+        """Pallini della pagina corrente."""
+        return [p for p in self.pallini if p.get("page", 0) == self.page_index]
     
     # ============ ZOOM ============
     
     def zoom_in(self):
         if self.working_image:
-            self.zoom = min(3.0, self.zoom * 1.25)
-            self._update_display()
+            self._set_zoom(min(ZOOM_MAX, self.zoom * 1.25))
     
     def zoom_out(self):
         if self.working_image:
-            self.zoom = max(0.1, self.zoom / 1.25)
-            self._update_display()
+            self._set_zoom(max(ZOOM_MIN, self.zoom / 1.25))
+    
+    def _set_zoom(self, zoom):
+        """Cambia lo zoom mantenendo fermo il centro della vista."""
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        cx = self.canvas.canvasx(cw / 2) / self.zoom
+        cy = self.canvas.canvasy(ch / 2) / self.zoom
+        
+        self.zoom = zoom
+        self._update_display()
+        
+        w = self.working_image.width * zoom
+        h = self.working_image.height * zoom
+        self.canvas.xview_moveto(max(0.0, (cx * zoom - cw / 2) / w))
+        self.canvas.yview_moveto(max(0.0, (cy * zoom - ch / 2) / h))
+        self._render_viewport()
     
+    def _drop_pyramid(self):
+        """Rilascia la piramide chiudendo la vista PDF (documento fitz e display list)."""
+        if self.pyramid is not None:
+            self.pyramid.close()
+            self.pyramid = None
+    
+    @profiled("update_display")
     def _update_display(self):
         if self.working_image is None:
             return
         
-        import gc
+        # La piramide si ricalcola solo quando cambia l'immagine, non lo zoom
+        if self.pyramid is None or self.pyramid.image is not self.working_image:
+            self._drop_pyramid()
+            with profiler.span("zoom_pyramid"):
+                detail = None
+                if self.document is not None:
+                    detail = self.document.page_view(self.page_index, self.image_scale)
+                self.pyramid = ZoomPyramid(self.working_image, detail=detail)
         
-        w = int(self.working_image.width * self.zoom)
-        h = int(self.working_image.height * self.zoom)
+        self._clear_view_tiles()
+        self.zoom_label.config(text=f"{int(self.zoom*100)}%")
+        self.redraw()
+    
+    def _scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self._schedule_render()
+    
+    def _scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_render()
+    
+    def on_mouse_wheel(self, event, delta=None):
+        delta = event.delta if delta is None else delta
+        if event.state & 0x0004:      # Ctrl
+            if delta > 0:
+                self.zoom_in()
+            else:
+                self.zoom_out()
+            return
+        units = -1 if delta > 0 else 1
+        if event.state & 0x0001:      # Maiusc
+            self.canvas.xview_scroll(units * 3, "units")
+        else:
+            self.canvas.yview_scroll(units * 3, "units")
+        self._schedule_render()
+    
+    # ============ VIEWPORT ============
+    
+    # Lato delle tile di display (pixel canvas) e quante tenerne in memoria
+    VIEW_TILE = 512
+    VIEW_TILE_CACHE = 48
+    
+    def _schedule_render(self):
+        """Raggruppa gli eventi di scorrimento in un solo aggiornamento."""
+        if not self._render_pending:
+            self._render_pending = True
+            self.after_idle(self._render_viewport)
+    
+    def _clear_view_tiles(self):
+        self.canvas.delete("bg")
+        self._view_tiles.clear()
+    
+    @profiled("render_viewport")
+    def _render_viewport(self):
+        """Crea le tile di sfondo che coprono la parte visibile del canvas."""
+        self._render_pending = False
+        if self.pyramid is None:
+            return
         
-        # Libera vecchia display_image
-        if self.display_image is not None:
-            del self.display_image
+        z = self.zoom
+        w = int(self.working_image.width * z)
+        h = int(self.working_image.height * z)
+        x0 = max(0, int(self.canvas.canvasx(0)))
+        y0 = max(0, int(self.canvas.canvasy(0)))
+        x1 = min(w, int(self.canvas.canvasx(self.canvas.winfo_width())) + 1)
+        y1 = min(h, int(self.canvas.canvasy(self.canvas.winfo_height())) + 1)
+        if x1 <= x0 or y1 <= y0:
+            return
         
-        self.display_image = self.working_image.resize((w, h), Image.LANCZOS)
-        self.zoom_label.config(text=f"{int(self.zoom*100)}%")
+        t = self.VIEW_TILE
+        visible = set()
+        for ty in range(y0 // t, (y1 - 1) // t + 1):
+            for tx in range(x0 // t, (x1 - 1) // t + 1):
+                visible.add((tx, ty))
+                if (tx, ty) in self._view_tiles:
+                    continue
+                box = (tx * t, ty * t, min(w, (tx + 1) * t), min(h, (ty + 1) * t))
+                photo = ImageTk.PhotoImage(self.pyramid.render(z, box))
+                item = self.canvas.create_image(box[0], box[1], anchor=tk.NW,
+                                                image=photo, tags=("bg",))
+                self._view_tiles[(tx, ty)] = (photo, item)
         
-        gc.collect()
-        self.redraw()
+        # Scarta le tile fuori vista oltre il limite della cache
+        excess = len(self._view_tiles) - self.VIEW_TILE_CACHE
+        if excess > 0:
+            for key in [k for k in self._view_tiles if k not in visible][:excess]:
+                _, item = self._view_tiles.pop(key)
+                self.canvas.delete(item)
+        
+        self.canvas.tag_lower("bg")
     
     # ============ OCR ============
     
     # Dimensione massima per OCR (pixel sul lato lungo)
-    OCR_MAX_SIZE = 2500
+    OCR_MAX_SIZE = OCR_MAX_SIZE
     
     def scan_ocr(self):
         if self.working_image is None:
             messagebox.showinfo("Info", "Carica prima un'immagine.")
             return
         
-        # Mostra dialog progresso
-        progress = ProgressDialog(self, "Scansione OCR")
+        index, image, image_scale = self.page_index, self.working_image, self.image_scale
+        document, tiled = self.document, self.tiled_ocr_var.get()
+        two_stage = self.two_stage_var.get()
         
-        def update_progress(value, text):
-            progress.update_progress(value, text)
+        def work(task):
+            # Esegui OCR (coordinate già riportate su working_image)
+            with profiler.span("scan_ocr"):
+                return self._ocr_page(document, index, image, image_scale, task.progress, tiled,
+                                      two_stage)
         
-        ocr_path = None
-        converted_file = None
-        
-        try:
+        def done(results):
             import gc
             
-            work_w, work_h = self.working_image.size
-            orig_w, orig_h = self.original_size
-            
-            # Calcola se serve ulteriore ridimensionamento per OCR
-            max_dim = max(work_w, work_h)
-            if max_dim > self.OCR_MAX_SIZE:
-                ocr_scale = self.OCR_MAX_SIZE / max_dim
-                new_w = int(work_w * ocr_scale)
-                new_h = int(work_h * ocr_scale)
-                needs_resize = True
-            else:
-                ocr_scale = 1.0
-                new_w, new_h = work_w, work_h
-                needs_resize = False
-            
-            # Determina se serve conversione formato
-            needs_conversion = (
-                self.image_path is None or
-                self.image_path.lower().endswith('.pdf') or
-                self.image_path.lower().endswith('.tif') or
-                self.image_path.lower().endswith('.tiff')
-            )
-            
-            # Crea file per OCR
-            if needs_resize or needs_conversion:
-                update_progress(2, "Preparazione immagine per OCR...")
-                
-                if needs_resize:
-                    ocr_image = self.working_image.resize((new_w, new_h), Image.LANCZOS)
-                else:
-                    ocr_image = self.working_image
-                
-                if self.image_path:
-                    base = os.path.splitext(self.image_path)[0]
-                    converted_file = f"{base}_ocr.png"
-                else:
-                    converted_file = os.path.join(os.path.expanduser("~"), "ocr_temp.png")
-                
-                ocr_image.save(converted_file, "PNG", optimize=True)
-                ocr_path = converted_file
-                
-                if needs_resize:
-                    del ocr_image
-                    gc.collect()
-                
-                print(f"[DEBUG] File OCR: {new_w}x{new_h}")
-            else:
-                ocr_path = self.image_path
-                ocr_scale = 1.0
-            
-            update_progress(5, "Avvio OCR...")
-            
-            # Esegui OCR
-            self.ocr_results = run_ocr(ocr_path, update_progress)
-            
-            # IMPORTANTE: riscala le coordinate
-            # Le coordinate OCR sono relative all'immagine OCR
-            # Dobbiamo riportarle alle coordinate dell'immagine WORKING (non originale!)
-            # perché il display usa working_image
-            if ocr_scale != 1.0:
-                inv_scale = 1.0 / ocr_scale
-                for r in self.ocr_results:
-                    r["box"] = r["box"] * inv_scale
-                print(f"[DEBUG] Coordinate riscalate: {inv_scale:.4f}x")
-            
+            if document is not self.document:
+                return
+            self._set_page_ocr(index, results)
             gc.collect()
             
-            quote_count = sum(1 for r in self.ocr_results if re.search(r"\d", r["text"]))
+            quote_count = int(results.has_digit.sum())
             
-            msg = f"OCR completato: {len(self.ocr_results)} testi, {quote_count} quote"
+            msg = f"OCR completato: {len(results)} testi, {quote_count} quote"
             self.status.set(msg)
             self.redraw()
-            
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+        
+        def error(e):
             messagebox.showerror("Errore OCR", str(e))
             self.status.set("Errore durante OCR")
-        finally:
-            progress.destroy()
+        
+        self._start_task(work, done, "Scansione OCR", error)
+    
+    def _set_page_ocr(self, index, results):
+        self._poll_engine_status()
+        self.page_ocr[index] = results
+        if index == self.page_index:
+            self.ocr_results = results
+    
+    def scan_region(self, box):
+        """Rilegge con l'OCR la sola regione box e la unisce ai risultati della pagina."""
+        x0, y0, x1, y1 = box
+        if x1 - x0 < 4 or y1 - y0 < 4:
+            return
+        
+        index, image_scale, document = self.page_index, self.image_scale, self.document
+        
+        def work(task):
+            source, scale = document.ocr_source(index, image_scale)
+            try:
+                return run_ocr_region(source, scale, box, task.progress)
+            finally:
+                source.close()
+        
+        def done(region_results):
+            if document is not self.document:
+                return
+            # Oggetto nuovo: indici e box sul canvas si aggiornano da soli
+            merged, removed, added = merge_region_results(
+                self.page_ocr.get(index, OcrResults()), region_results, box)
+            self._set_page_ocr(index, merged)
+            self.status.set(f"OCR regione: {added} testi letti, {removed} sostituiti "
+                            f"({len(merged)} in totale)")
+            self.redraw()
+        
+        def error(e):
+            messagebox.showerror("Errore OCR", str(e))
+            self.status.set("Errore durante OCR della regione")
+        
+        self._start_task(work, done, "OCR regione", error)
+    
+    def _ocr_page(self, document, index, working_image, image_scale, progress_callback, tiled,
+                  two_stage=False):
+        """OCR di una pagina, ridotta o a tile a piena risoluzione."""
+        if tiled:
+            source, scale = document.ocr_source(index, image_scale)
+            try:
+                return run_ocr_tiled(source, scale, progress_callback, two_stage=two_stage,
+                                     exclude_zones=self.exclude_zones)
+            finally:
+                source.close()
+        return ocr_drawing(working_image, progress_callback, self.OCR_MAX_SIZE, two_stage,
+                           self.exclude_zones)
+    
+    def scan_document(self):
+        """OCR di tutte le pagine: la rasterizzazione procede in parallelo all'OCR."""
+        if self.document is None:
+            messagebox.showinfo("Info", "Carica prima un'immagine.")
+            return
+        
+        document, tiled = self.document, self.tiled_ocr_var.get()
+        two_stage = self.two_stage_var.get()
+        total = document.page_count
+        
+        def work(task):
             import gc
-            gc.collect()
+            
+            results = {}
+            if tiled:
+                # L'OCR a tile legge la pagina da PageSource: niente da rasterizzare
+                pages = ((index, None, None, document.page_image_scale(index))
+                         for index in range(total))
+            else:
+                # Il pool di rasterizzazione parte qui, nel thread del task
+                pages = document.iter_pages()
+            while True:
+                # La rasterizzazione della pagina successiva è misurata a parte
+                with profiler.span("scan_document_page_wait"):
+                    item = next(pages, None)
+                if item is None:
+                    break
+                index, image, original_size, image_scale = item
+                def update_progress(value, text, index=index):
+                    pct = None if value is None else int((index + value / 100) * 100 / total)
+                    task.progress(pct, f"Pagina {index + 1}/{total}: {text}")
+                
+                with profiler.span("scan_ocr"):
+                    results[index] = self._ocr_page(document, index, image, image_scale,
+                                                    update_progress, tiled, two_stage)
+                del image
+                gc.collect()
+            return results
+        
+        def done(results):
+            if document is not self.document:
+                return
+            for index, page_results in results.items():
+                self._set_page_ocr(index, page_results)
+            
+            n_texts = sum(len(r) for r in self.page_ocr.values())
+            self.status.set(f"OCR completato su {total} pagine: {n_texts} testi")
+            self.redraw()
+        
+        def error(e):
+            messagebox.showerror("Errore OCR", str(e))
+            self.status.set("Errore durante OCR")
+        
+        self._start_task(work, done, "Scansione OCR documento", error)
     
     # ============ PALLINI ============
     
+    @profiled("auto_pallina")
     def auto_pallina(self):
         if not self.ocr_results:
             messagebox.showinfo("Info", "Esegui prima la scansione OCR.")
             return
         
-        self.clear_pallini()
+        # Sostituisce i pallini della sola pagina corrente: la numerazione
+        # prosegue da quelli delle altre pagine
+        removed = [p for p in self.pallini if p.get("page", 0) == self.page_index]
+        self.pallini = [p for p in self.pallini if p.get("page", 0) != self.page_index]
+        self.next_id = max((p["id"] for p in self.pallini), default=0) + 1
+        self._tree_delete(*removed)
         
-        for r in self.ocr_results:
-            text = r["text"].strip()
-            box = r["box"]
-            
-            if not re.search(r"\d", text):
-                continue
-            
-            # Posizione: a sinistra del box, centrato verticalmente
-            x = float(box[:, 0].min()) - 20
-            y = float(box[:, 1].mean())
-            x = max(15, x)
-            
+        for x, y, text in auto_place_pallini(self.ocr_results, self.working_image):
             self._add_pallino(x, y, text)
         
         self.redraw()
-        self.status.set(f"Creati {len(self.pallini)} pallini (trascinabili)")
+        self.status.set(f"Creati {len(self._page_pallini())} pallini (trascinabili)")
     
     def _add_pallino(self, x, y, text):
         pallino = {
             "id": self.next_id,
             "x": x,
             "y": y,
-            "text": text
+            "text": text,
+            "page": self.page_index,
+            "key": self._next_key
         }
         self.pallini.append(pallino)
         self.next_id += 1
-        self._refresh_tree()
+        self._next_key += 1
+        self._tree_insert(pallino)
+        return pallino
     
-    def _remove_pallino(self, index):
-        if 0 <= index < len(self.pallini):
-            del self.pallini[index]
-            self._refresh_tree()
-            self.redraw()
+    def _remove_pallino(self, p):
+        self.pallini.remove(p)
+        self._tree_delete(p)
+        self._delete_pallino_items(p)
+    
+    # La tabella viene aggiornata riga per riga: ogni pallino ha la propria
+    # riga (iid legato alla chiave stabile), così aggiunte, spostamenti ed
+    # eliminazioni non ricostruiscono l'intera tabella
+    
+    @staticmethod
+    def _tree_iid(p):
+        return f"p{p['key']}"
     
+    @staticmethod
+    def _tree_values(p):
+        return (p["id"], p.get("page", 0) + 1, p["text"], int(p["x"]), int(p["y"]))
+    
+    def _tree_insert(self, p):
+        iid = self.tree.insert("", tk.END, iid=self._tree_iid(p), values=self._tree_values(p))
+        self._tree_pallini[iid] = p
+    
+    def _tree_update(self, p):
+        iid = self._tree_iid(p)
+        if iid in self._tree_pallini:
+            self.tree.item(iid, values=self._tree_values(p))
+    
+    def _tree_delete(self, *pallini):
+        iids = [iid for iid in map(self._tree_iid, pallini) if self._tree_pallini.pop(iid, None)]
+        if iids:
+            self.tree.delete(*iids)
+    
+    @profiled("refresh_tree")
     def _refresh_tree(self):
-        """Aggiorna la tabella."""
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+        """Ricostruisce la tabella (solo per sostituzioni complete dei pallini)."""
+        self.tree.delete(*self.tree.get_children())
+        self._tree_pallini = {}
         for p in self.pallini:
-            self.tree.insert("", tk.END, values=(p["id"], p["text"], int(p["x"]), int(p["y"])))
+            self._tree_insert(p)
     
     def clear_pallini(self):
         self.pallini = []
@@ -608,30 +4348,48 @@ class PallinatoreApp(tk.Tk):
         if not self.pallini:
             return
         
-        # Ordina per Y poi per X (dall'alto in basso, da sinistra a destra)
-        self.pallini.sort(key=lambda p: (p["y"], p["x"]))
+        # Ordina per pagina, poi per Y e per X (dall'alto in basso, da sinistra a destra)
+        self.pallini.sort(key=lambda p: (p.get("page", 0), p["y"], p["x"]))
         
         # Rinumera
         for i, p in enumerate(self.pallini, 1):
             p["id"] = i
+            # Aggiorna solo il numero sul canvas, senza ricreare gli elementi
+            items = self._pallino_items.get(p.get("key"))
+            if items:
+                self.canvas.itemconfigure(items[1], text=str(i))
         
         self.next_id = len(self.pallini) + 1
-        self._refresh_tree()
-        self.redraw()
+        
+        # Stesse righe, nuovo ordine e nuovi numeri
+        for i, p in enumerate(self.pallini):
+            iid = self._tree_iid(p)
+            self.tree.item(iid, values=self._tree_values(p))
+            self.tree.move(iid, "", i)
         self.status.set(f"Rinumerati {len(self.pallini)} pallini")
     
     # ============ MOUSE EVENTS ============
     
     def _find_pallino_at(self, canvas_x, canvas_y):
-        """Trova pallino alle coordinate canvas. Ritorna indice o None."""
+        """Trova pallino alle coordinate canvas. Ritorna il pallino o None."""
         img_x = canvas_x / self.zoom
         img_y = canvas_y / self.zoom
         
-        for i, p in enumerate(self.pallini):
-            dist = ((p["x"] - img_x)**2 + (p["y"] - img_y)**2)**0.5
-            if dist < self.PALLINO_RADIUS / self.zoom + 5:
-                return i
-        return None
+        key = self._pallino_grid.nearest(img_x, img_y, self.PALLINO_RADIUS / self.zoom + 5)
+        return self._pallini_by_key.get(key)
+    
+    def _nearest_ocr_text(self, img_x, img_y, max_dist=100):
+        """Testo del box OCR con il centro più vicino entro max_dist, o ""."""
+        if not self.ocr_results:
+            return ""
+        # L'indice si ricostruisce solo quando cambiano i risultati OCR
+        if self._ocr_grid_source is not self.ocr_results:
+            self._ocr_grid = SpatialGrid(cell=max_dist)
+            for i, (x, y) in enumerate(self.ocr_results.centers.tolist()):
+                self._ocr_grid.insert(i, x, y)
+            self._ocr_grid_source = self.ocr_results
+        i = self._ocr_grid.nearest(img_x, img_y, max_dist)
+        return self.ocr_results.texts[i] if i is not None else ""
     
     def on_mouse_down(self, event):
         if self.working_image is None:
@@ -640,27 +4398,42 @@ class PallinatoreApp(tk.Tk):
         cx = self.canvas.canvasx(event.x)
         cy = self.canvas.canvasy(event.y)
         
+        # Maiusc: selezione della regione da rileggere con l'OCR
+        if event.state & 0x0001:
+            self.dragging = None
+            self.roi_start = (cx, cy)
+            self.canvas.create_rectangle(cx, cy, cx, cy, outline="#0078d7", dash=(4, 2),
+                                         width=2, tags=("overlay", "roi_band"))
+            return
+        
         # Cerca pallino da trascinare
-        idx = self._find_pallino_at(cx, cy)
+        p = self._find_pallino_at(cx, cy)
         
-        if idx is not None:
+        if p is not None:
             # Inizia drag
-            self.dragging = idx
-            p = self.pallini[idx]
+            self.dragging = p
             self.drag_offset = (p["x"] - cx/self.zoom, p["y"] - cy/self.zoom)
             self.canvas.config(cursor="fleur")
+            
+            # Evidenzia pallino in drag
+            x, y, r = p["x"] * self.zoom, p["y"] * self.zoom, self.PALLINO_RADIUS
+            self.canvas.create_oval(x-r-2, y-r-2, x+r+2, y+r+2, outline="blue", width=2,
+                                    tags=("overlay", "drag_halo"))
         else:
             self.dragging = None
     
     def on_mouse_drag(self, event):
-        if self.dragging is None:
-            return
-        
         cx = self.canvas.canvasx(event.x)
         cy = self.canvas.canvasy(event.y)
         
+        if self.roi_start is not None:
+            self.canvas.coords("roi_band", *self.roi_start, cx, cy)
+            return
+        if self.dragging is None:
+            return
+        
         # Aggiorna posizione pallino
-        p = self.pallini[self.dragging]
+        p = self.dragging
         p["x"] = cx/self.zoom + self.drag_offset[0]
         p["y"] = cy/self.zoom + self.drag_offset[1]
         
@@ -668,12 +4441,23 @@ class PallinatoreApp(tk.Tk):
         p["x"] = max(10, min(self.working_image.width - 10, p["x"]))
         p["y"] = max(10, min(self.working_image.height - 10, p["y"]))
         
-        self.redraw()
+        # Sposta solo gli elementi del pallino trascinato
+        self._move_pallino_items(p)
     
     def on_mouse_up(self, event):
-        if self.dragging is not None:
-            self._refresh_tree()
+        if self.roi_start is not None:
+            (sx, sy), self.roi_start = self.roi_start, None
+            self.canvas.delete("roi_band")
+            cx = self.canvas.canvasx(event.x)
+            cy = self.canvas.canvasy(event.y)
+            w, h = self.working_image.size
+            box = (max(0, min(sx, cx) / self.zoom), max(0, min(sy, cy) / self.zoom),
+                   min(w, max(sx, cx) / self.zoom), min(h, max(sy, cy) / self.zoom))
+            self.scan_region(box)
+        elif self.dragging is not None:
+            self._tree_update(self.dragging)
             self.dragging = None
+            self.canvas.delete("drag_halo")
             self.canvas.config(cursor="crosshair")
         else:
             # Click semplice = aggiungi nuovo pallino
@@ -684,17 +4468,7 @@ class PallinatoreApp(tk.Tk):
             img_y = cy / self.zoom
             
             # Cerca testo OCR vicino
-            text = ""
-            if self.ocr_results:
-                best_dist = float('inf')
-                for r in self.ocr_results:
-                    box = r["box"]
-                    bx = float(box[:, 0].mean())
-                    by = float(box[:, 1].mean())
-                    dist = ((bx - img_x)**2 + (by - img_y)**2)**0.5
-                    if dist < best_dist and dist < 100:
-                        best_dist = dist
-                        text = r["text"]
+            text = self._nearest_ocr_text(img_x, img_y)
             
             # Chiedi testo
             text = simpledialog.askstring(
@@ -705,8 +4479,7 @@ class PallinatoreApp(tk.Tk):
             )
             
             if text:
-                self._add_pallino(img_x, img_y, text)
-                self.redraw()
+                self._draw_pallino(self._add_pallino(img_x, img_y, text))
     
     def on_right_click(self, event):
         """Click destro = elimina pallino."""
@@ -716,9 +4489,9 @@ class PallinatoreApp(tk.Tk):
         cx = self.canvas.canvasx(event.x)
         cy = self.canvas.canvasy(event.y)
         
-        idx = self._find_pallino_at(cx, cy)
-        if idx is not None:
-            self._remove_pallino(idx)
+        p = self._find_pallino_at(cx, cy)
+        if p is not None:
+            self._remove_pallino(p)
             self.status.set(f"Pallino eliminato. Rimasti: {len(self.pallini)}")
     
     def on_tree_double_click(self, event):
@@ -727,60 +4500,98 @@ class PallinatoreApp(tk.Tk):
         if not sel:
             return
         
-        item = sel[0]
-        values = self.tree.item(item, "values")
-        pid = int(values[0])
-        
-        # Trova e rimuovi
-        for i, p in enumerate(self.pallini):
-            if p["id"] == pid:
-                self._remove_pallino(i)
-                break
+        p = self._tree_pallini.get(sel[0])
+        if p is not None:
+            self._remove_pallino(p)
     
     # ============ DISEGNO ============
     
+    @profiled("redraw")
     def redraw(self):
-        self.canvas.delete("all")
+        # Lo sfondo (tag "bg") resta: si ridisegnano solo box e pallini
+        self.canvas.delete("overlay")
+        self._pallino_items = {}
+        self._pallini_by_key = {}
+        self._pallino_grid.clear()
         
-        if self.display_image is None:
+        if self.pyramid is None:
+            self._clear_view_tiles()
             return
         
-        # Immagine
-        self.tk_image = ImageTk.PhotoImage(self.display_image)
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_image)
-        self.canvas.configure(scrollregion=(0, 0, self.display_image.width, self.display_image.height))
+        # Immagine: solo le tile visibili
+        w = int(self.working_image.width * self.zoom)
+        h = int(self.working_image.height * self.zoom)
+        self.canvas.configure(scrollregion=(0, 0, w, h))
+        self._render_viewport()
         
-        # Box OCR
-        if self.show_boxes_var.get() and self.ocr_results:
-            for r in self.ocr_results:
-                box = r["box"]
-                text = r["text"]
-                
-                if not re.search(r"\d", text):
-                    continue
-                
-                x0 = float(box[:, 0].min()) * self.zoom
-                y0 = float(box[:, 1].min()) * self.zoom
-                x1 = float(box[:, 0].max()) * self.zoom
-                y1 = float(box[:, 1].max()) * self.zoom
-                
-                self.canvas.create_rectangle(x0, y0, x1, y1, outline="yellow", width=1)
-                self.canvas.create_text(x0, y0-2, text=text[:15], anchor=tk.SW, 
-                                        fill="yellow", font=("Arial", 8))
+        # Box OCR (nascosti, non eliminati, quando la casella è disattivata)
+        if self.ocr_results:
+            state = tk.NORMAL if self.show_boxes_var.get() else tk.HIDDEN
+            idx = np.flatnonzero(self.ocr_results.has_digit)
+            rects = (self.ocr_results.bbox[idx] * self.zoom).tolist()
+            texts = self.ocr_results.texts
+            for i, (x0, y0, x1, y1) in zip(idx.tolist(), rects):
+                text = texts[i]
+                self.canvas.create_rectangle(x0, y0, x1, y1, outline="yellow", width=1,
+                                             state=state, tags=("overlay", "ocrbox"))
+                self.canvas.create_text(x0, y0-2, text=text[:15], anchor=tk.SW, state=state,
+                                        fill="yellow", font=("Arial", 8), tags=("overlay", "ocrbox"))
         
-        # Pallini
-        for i, p in enumerate(self.pallini):
-            x = p["x"] * self.zoom
-            y = p["y"] * self.zoom
-            r = self.PALLINO_RADIUS
+        # Pallini (solo pagina corrente)
+        for p in self.pallini:
+            if p.get("page", 0) != self.page_index:
+                continue
             
             # Evidenzia pallino in drag
-            if i == self.dragging:
-                self.canvas.create_oval(x-r-2, y-r-2, x+r+2, y+r+2, outline="blue", width=2)
+            if p is self.dragging:
+                x, y, r = p["x"] * self.zoom, p["y"] * self.zoom, self.PALLINO_RADIUS
+                self.canvas.create_oval(x-r-2, y-r-2, x+r+2, y+r+2, outline="blue", width=2,
+                                        tags=("overlay", "drag_halo"))
             
-            # Cerchio
-            self.canvas.create_oval(x-r, y-r, x+r, y+r, fill="white", outline="red", width=2)
-            self.canvas.create_text(x, y, text=str(p["id"]), fill="red", font=("Arial", 9, "bold"))
+            self._draw_pallino(p)
+    
+    def _pallino_coords(self, p):
+        x = p["x"] * self.zoom
+        y = p["y"] * self.zoom
+        r = self.PALLINO_RADIUS
+        return x, y, r
+    
+    def _draw_pallino(self, p):
+        """Crea gli elementi canvas di un pallino (cerchio e numero)."""
+        x, y, r = self._pallino_coords(p)
+        
+        # Cerchio
+        oval = self.canvas.create_oval(x-r, y-r, x+r, y+r, fill="white", outline="red", width=2,
+                                       tags=("overlay", "pallino"))
+        text = self.canvas.create_text(x, y, text=str(p["id"]), fill="red",
+                                       font=("Arial", 9, "bold"), tags=("overlay", "pallino"))
+        if "key" in p:
+            self._pallino_items[p["key"]] = (oval, text)
+            self._pallini_by_key[p["key"]] = p
+            self._pallino_grid.insert(p["key"], p["x"], p["y"])
+    
+    def _move_pallino_items(self, p):
+        """Sposta gli elementi di un pallino già disegnato con canvas.coords."""
+        items = self._pallino_items.get(p.get("key"))
+        if items is None:
+            self.redraw()
+            return
+        x, y, r = self._pallino_coords(p)
+        oval, text = items
+        self.canvas.coords(oval, x-r, y-r, x+r, y+r)
+        self.canvas.coords(text, x, y)
+        self.canvas.coords("drag_halo", x-r-2, y-r-2, x+r+2, y+r+2)
+        self._pallino_grid.move(p["key"], p["x"], p["y"])
+    
+    def _delete_pallino_items(self, p):
+        self._pallino_grid.remove(p.get("key"))
+        self._pallini_by_key.pop(p.get("key"), None)
+        for item in self._pallino_items.pop(p.get("key"), ()):
+            self.canvas.delete(item)
+    
+    def _toggle_boxes(self):
+        state = tk.NORMAL if self.show_boxes_var.get() else tk.HIDDEN
+        self.canvas.itemconfigure("ocrbox", state=state)
     
     # ============ EXPORT ============
     
@@ -792,86 +4603,22 @@ class PallinatoreApp(tk.Tk):
         path = filedialog.asksaveasfilename(
             title="Salva Excel",
             defaultextension=".xlsx",
-            filetypes=[("Excel", "*.xlsx")]
+            filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv"), ("Parquet", "*.parquet")]
         )
         if not path:
             return
         
         try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment
-            
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Quote"
-            
-            headers = ["ID", "Quota_raw", "Simbolo", "Nominale", "Tol+", "Tol-", "Classe"]
-            for col, h in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=h)
-                cell.font = Font(bold=True)
-                cell.alignment = Alignment(horizontal="center")
-            
-            for row, p in enumerate(self.pallini, 2):
-                parsed = parse_quota(p["text"])
-                
-                ws.cell(row=row, column=1, value=p["id"])
-                ws.cell(row=row, column=2, value=p["text"])
-                ws.cell(row=row, column=3, value=parsed["simbolo"])
-                ws.cell(row=row, column=4, value=parsed["nominale"])
-                ws.cell(row=row, column=5, value=parsed["tol_plus"])
-                ws.cell(row=row, column=6, value=parsed["tol_minus"])
-                ws.cell(row=row, column=7, value=parsed["classe"])
-            
-            for col in ws.columns:
-                max_len = max(len(str(cell.value or "")) for cell in col)
-                ws.column_dimensions[col[0].column_letter].width = max_len + 2
-            
-            wb.save(path)
+            write_excel(path, self.pallini)
             self.status.set(f"Esportato: {os.path.basename(path)}")
             messagebox.showinfo("Esportazione", f"File salvato:\n{path}")
-            
-        except ImportError:
-            messagebox.showerror("Errore", "Installa openpyxl: pip install openpyxl")
+        
+        except ImportError as e:
+            package = "pyarrow" if path.lower().endswith(".parquet") else "openpyxl"
+            messagebox.showerror("Errore", f"Installa {package}: pip install {package}\n\n{e}")
         except Exception as e:
             messagebox.showerror("Errore", f"Errore esportazione:\n{e}")
     
-    def _create_pallinated_image(self):
-        """Crea un'immagine con i pallini disegnati sopra."""
-        if self.working_image is None:
-            return None
-        
-        from PIL import ImageDraw, ImageFont
-        
-        # Copia l'immagine di lavoro
-        img = self.working_image.copy()
-        draw = ImageDraw.Draw(img)
-        
-        # Cerca un font, fallback a default
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 16)
-        except:
-            try:
-                font = ImageFont.truetype("arial.ttf", 16)
-            except:
-                font = ImageFont.load_default()
-        
-        # Disegna i pallini
-        r = 15  # Raggio pallino
-        for p in self.pallini:
-            x, y = int(p["x"]), int(p["y"])
-            
-            # Cerchio bianco con bordo rosso
-            draw.ellipse([x-r, y-r, x+r, y+r], fill="white", outline="red", width=3)
-            
-            # Numero centrato
-            text = str(p["id"])
-            bbox = draw.textbbox((0, 0), text, font=font)
-            tw = bbox[2] - bbox[0]
-            th = bbox[3] - bbox[1]
-            draw.text((x - tw//2, y - th//2 - 2), text, fill="red", font=font)
-        
-        return img
-    
     def export_image(self):
         """Esporta l'immagine con i pallini."""
         if self.working_image is None:
@@ -891,17 +4638,35 @@ class PallinatoreApp(tk.Tk):
         if not path:
             return
         
-        try:
-            img = self._create_pallinated_image()
-            if img:
-                # Per JPEG, converti in RGB se necessario
-                if path.lower().endswith(('.jpg', '.jpeg')):
-                    img = img.convert('RGB')
-                img.save(path)
-                self.status.set(f"Immagine salvata: {os.path.basename(path)}")
-                messagebox.showinfo("Esportazione", f"Immagine salvata:\n{path}")
-        except Exception as e:
+        # Pagina corrente alla risoluzione originale (in background: può richiedere secondi)
+        document, index = self.document, self.page_index
+        pallini = [dict(p) for p in self._page_pallini()]
+        image_scale = self.image_scale
+        
+        def work(task):
+            source = document.source(index)
+            try:
+                size = export_pallinated_image(source, pallini, image_scale, path, task.progress)
+                return size, source.size
+            finally:
+                source.close()
+        
+        def done(sizes):
+            (width, height), (orig_w, orig_h) = sizes
+            self.status.set(f"Immagine salvata: {os.path.basename(path)}")
+            if (width, height) != (orig_w, orig_h):
+                messagebox.showwarning(
+                    "Esportazione",
+                    f"Immagine salvata ridotta a {width}x{height} "
+                    f"(originale {orig_w}x{orig_h}):\n{path}\n\n"
+                    f"Per la piena risoluzione salva in PNG o TIFF.")
+                return
+            messagebox.showinfo("Esportazione", f"Immagine salvata:\n{path}")
+        
+        def error(e):
             messagebox.showerror("Errore", f"Errore salvataggio immagine:\n{e}")
+        
+        self._start_task(work, done, "Esportazione immagine", error)
     
     def export_pdf(self):
         """Esporta l'immagine con i pallini in PDF."""
@@ -917,19 +4682,261 @@ class PallinatoreApp(tk.Tk):
         if not path:
             return
         
-        try:
-            img = self._create_pallinated_image()
-            if img:
-                # Converti in RGB per PDF
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                img.save(path, "PDF", resolution=100.0)
-                self.status.set(f"PDF salvato: {os.path.basename(path)}")
-                messagebox.showinfo("Esportazione", f"PDF salvato:\n{path}")
-        except Exception as e:
+        document, pallini = self.document, [dict(p) for p in self.pallini]
+        
+        def work(task):
+            export_pallinated_pdf(document, pallini, path, task.progress)
+        
+        def done(_):
+            self.status.set(f"PDF salvato: {os.path.basename(path)}")
+            messagebox.showinfo("Esportazione", f"PDF salvato:\n{path}")
+        
+        def error(e):
             messagebox.showerror("Errore", f"Errore salvataggio PDF:\n{e}")
+        
+        self._start_task(work, done, "Creazione PDF", error)
 
 
-if __name__ == "__main__":
-    app = PallinatoreApp()
+# ============ BATCH ============
+
+def _batch_worker_init(profile=False, two_stage=False):
+    """Inizializza un processo worker: carica subito il motore OCR.
+    
+    Con il servizio OCR locale attivo i worker non caricano i modelli;
+    l'OCR in due fasi usa sempre i propri modelli, nel worker.
+    """
+    # Con spawn il worker non eredita la configurazione del processo principale
+    configure_logging()
+    if profile:
+        profiler.enable()
+    if two_stage:
+        get_two_stage_models()
+    elif not ocr_server_available():
+        get_ocr_engine()
+
+
+def _batch_process(*args):
+    """process_drawing in un worker; le misure tornano al processo principale."""
+    summary = process_drawing(*args)
+    if profiler.enabled:
+        summary["profilo"] = profiler.take()
+    return summary
+
+
+def collect_drawings(inputs):
+    """Espande cartelle e pattern glob nella lista dei disegni da elaborare."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = sorted(os.path.join(item, name) for name in os.listdir(item))
+        else:
+            import glob
+            candidates = sorted(glob.glob(item)) or [item]
+        for path in candidates:
+            # Esclude i file temporanei lasciati dalle versioni precedenti
+            if (os.path.isfile(path) and path.lower().endswith(SUPPORTED_EXTENSIONS)
+                    and not path.lower().endswith("_ocr.png")):
+                paths.append(path)
+    # Rimuove duplicati mantenendo l'ordine
+    return list(dict.fromkeys(paths))
+
+
+@profiled("process_drawing")
+def process_drawing(path, out_dir, formats=("xlsx", "png", "pdf"), tiled=False, collect=False,
+                    two_stage=False, exclude_zones=()):
+    """Elabora un disegno senza GUI: carica, OCR, pallina ed esporta.
+    
+    Ritorna un dizionario con il riepilogo dell'elaborazione; con collect
+    contiene anche i pallini ("quote") per il riepilogo complessivo.
+    two_stage ed exclude_zones come in ocr_drawing.
+    """
+    start = time.perf_counter()
+    summary = {"file": path, "pagine": 0, "testi": 0, "pallini": 0,
+               "secondi": 0.0, "errore": None}
+    try:
+        document = DrawingDocument(path)
+        base = os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0])
+        multi_page = document.page_count > 1
+        
+        # Un solo thread di rasterizzazione per processo: la pagina successiva
+        # viene preparata mentre l'OCR lavora su quella corrente
+        pallini = []
+        for index, working_image, _, image_scale in document.iter_pages(workers=1):
+            if tiled:
+                source, scale = document.ocr_source(index, image_scale)
+                # Il parallelismo è già sui file: tile nel processo stesso
+                ocr_results = run_ocr_tiled(source, scale, workers=1, two_stage=two_stage,
+                                            exclude_zones=exclude_zones)
+                source.close()
+            else:
+                ocr_results = ocr_drawing(working_image, two_stage=two_stage,
+                                          exclude_zones=exclude_zones)
+            page_pallini = []
+            for x, y, text in auto_place_pallini(ocr_results, working_image):
+                page_pallini.append({"id": len(pallini) + len(page_pallini) + 1,
+                                     "x": x, "y": y, "text": text, "page": index})
+            pallini.extend(page_pallini)
+            summary["pagine"] += 1
+            summary["testi"] += len(ocr_results)
+            
+            if "png" in formats:
+                # Alla risoluzione originale, a bande
+                suffix = f"_p{index + 1}" if multi_page else ""
+                source = document.source(index)
+                try:
+                    export_pallinated_image(source, page_pallini, image_scale,
+                                            f"{base}_pallinato{suffix}.png")
+                finally:
+                    source.close()
+        
+        if "xlsx" in formats:
+            write_excel(f"{base}_quote.xlsx", pallini)
+        if "pdf" in formats:
+            export_pallinated_pdf(document, pallini, f"{base}_pallinato.pdf")
+        
+        summary["pallini"] = len(pallini)
+        if collect:
+            summary["quote"] = pallini
+    except Exception as e:
+        summary["errore"] = f"{type(e).__name__}: {e}"
+    summary["secondi"] = time.perf_counter() - start
+    return summary
+
+
+def run_batch(inputs, out_dir, workers=None, formats=("xlsx", "png", "pdf"), tiled=False,
+              summary_path=None, two_stage=False, exclude_zones=()):
+    """Elabora tutti i disegni distribuendoli su un pool di processi.
+    
+    summary_path: tabella unica (xlsx, csv o parquet) con le quote di tutti
+    i disegni, scritta in streaming man mano che i disegni sono completati.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    paths = collect_drawings(inputs)
+    if not paths:
+        print("Nessun disegno trovato.")
+        return []
+    
+    os.makedirs(out_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    print(f"Elaborazione di {len(paths)} disegni con {workers} processi...")
+    
+    start = time.perf_counter()
+    summaries = []
+    table = QuoteTableWriter(summary_path, SUMMARY_COLUMNS) if summary_path else None
+    table_time = 0.0
+    collect = table is not None
+    # Il riepilogo viene chiuso all'uscita dal with; se il pool si interrompe
+    # (es. BrokenProcessPool) il file temporaneo viene eliminato
+    with table if table is not None else contextlib.nullcontext():
+        with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init,
+                                 initargs=(profiler.enabled, two_stage)) as pool:
+            futures = [pool.submit(_batch_process, p, out_dir, formats, tiled, collect,
+                                   two_stage, exclude_zones) for p in paths]
+            for n, future in enumerate(as_completed(futures), 1):
+                s = future.result()
+                profiler.merge(s.pop("profilo", ()))
+                summaries.append(s)
+                name = os.path.basename(s["file"])
+                if table is not None:
+                    t0 = time.perf_counter()
+                    table.write_rows(quote_rows(s.pop("quote", []), drawing=name))
+                    table_time += time.perf_counter() - t0
+                if s["errore"]:
+                    print(f"[{n}/{len(paths)}] {name}: ERRORE {s['errore']}")
+                else:
+                    print(f"[{n}/{len(paths)}] {name}: {s['pagine']} pag, {s['testi']} testi, "
+                          f"{s['pallini']} pallini, {s['secondi']:.1f} s")
+        t0 = time.perf_counter()
+    
+    if table is not None:
+        table_time += time.perf_counter() - t0
+        rows = table.rows
+        rate = rows / table_time if table_time > 0 else 0.0
+        print(f"Riepilogo {os.path.basename(summary_path)}: {rows} righe "
+              f"in {table_time:.2f} s ({rate:,.0f} righe/s)")
+    
+    elapsed = time.perf_counter() - start
+    ok = sum(1 for s in summaries if not s["errore"])
+    rate = len(summaries) / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"Completati {ok}/{len(summaries)} disegni in {elapsed:.1f} s "
+          f"({rate:.1f} disegni/min)")
+    return summaries
+
+
+def _parse_zone(text):
+    """Zona "x0,y0,x1,y1" in frazioni della pagina (per argparse)."""
+    import argparse
+    try:
+        x0, y0, x1, y1 = (float(v) for v in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"zona non valida: {text!r} (attese 4 frazioni)")
+    if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+        raise argparse.ArgumentTypeError(f"zona non valida: {text!r} (frazioni tra 0 e 1)")
+    return (x0, y0, x1, y1)
+
+
+def main(argv=None):
+    import argparse
+    
+    configure_logging()
+    _profile_from_env()
+    
+    parser = argparse.ArgumentParser(description="Pallinatore Quote v6")
+    parser.add_argument("--batch", nargs="+", metavar="INPUT",
+                        help="elabora senza GUI le cartelle o i pattern glob indicati")
+    parser.add_argument("-o", "--output", default="pallinati",
+                        help="cartella di destinazione per la modalità batch")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="numero di processi (default: numero di CPU)")
+    parser.add_argument("--formats", default="xlsx,png,pdf",
+                        help="formati di esportazione separati da virgola")
+    parser.add_argument("--tiled", action="store_true",
+                        help="OCR a tile sulla risoluzione originale")
+    parser.add_argument("--solo-quote", action="store_true",
+                        help="OCR in due fasi: riconosce solo i testi che possono essere quote")
+    parser.add_argument("--escludi", action="append", default=[], type=_parse_zone,
+                        metavar="X0,Y0,X1,Y1",
+                        help="zona da non leggere con --solo-quote, in frazioni della pagina "
+                             "(es. cartiglio 0.6,0.8,1,1); ripetibile")
+    parser.add_argument("--riepilogo", metavar="FILE",
+                        help="tabella unica delle quote di tutti i disegni (.xlsx, .csv, .parquet)")
+    parser.add_argument("--ocr-server", nargs="?", const="", metavar="HOST:PORTA",
+                        help="avvia il servizio OCR locale condiviso "
+                             f"(default {OCR_SERVER_ADDRESS[0]}:{OCR_SERVER_ADDRESS[1]})")
+    parser.add_argument("--ocr-stub", action="store_true",
+                        help="con --ocr-server: motore finto senza modelli, per i test")
+    parser.add_argument("--usa-ocr-server", nargs="?", const="on", metavar="HOST:PORTA",
+                        help="usa il servizio OCR locale se risponde (come PALLINATORE_OCR_SERVER)")
+    args = parser.parse_args(argv)
+    
+    if args.usa_ocr_server is not None:
+        # Tramite l'ambiente lo vedono anche i processi worker del batch
+        os.environ["PALLINATORE_OCR_SERVER"] = args.usa_ocr_server
+    
+    if args.ocr_server is not None:
+        address = _parse_address(args.ocr_server) if args.ocr_server else OCR_SERVER_ADDRESS
+        backend = StubOcrBackend() if args.ocr_stub else None
+        OcrServer(address, backend).serve_forever()
+        return 0
+    
+    if args.batch:
+        formats = tuple(f.strip().lower() for f in args.formats.split(",") if f.strip())
+        summary_path = args.riepilogo
+        if summary_path and not os.path.dirname(summary_path):
+            summary_path = os.path.join(args.output, summary_path)
+        summaries = run_batch(args.batch, args.output, args.workers, formats, args.tiled,
+                              summary_path, args.solo_quote, args.escludi)
+        return 1 if any(s["errore"] for s in summaries) else 0
+    
+    app = PallinatoreApp(exclude_zones=args.escludi)
+    if args.solo_quote:
+        app.two_stage_var.set(True)
     app.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())